@@ -0,0 +1,164 @@
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# 3rd party packages
+import numpy as np
+
+
+#
+# Vectorized aggregations of the tracking data (histograms and heat surfaces).
+#
+
+def angle_histogram(angs, step=1):
+    # angles are truncated to whole degrees and the negative ones moved to ]180, 360[
+    degs = np.trunc(np.asarray(angs, dtype=np.float64)).astype(np.int64)
+    degs[degs < 0] += 360
+
+    return np.bincount(degs // step, minlength=360 // step + 1).astype(np.float64)
+
+
+def slice_bounds(start, stop, size):
+    # the bounds of data[start:stop] along an axis of the given size (negative indexes count from the end)
+    start = np.where(start < 0, start + size, start).clip(0, size)
+    stop = np.where(stop < 0, stop + size, stop).clip(0, size)
+
+    return (start, np.maximum(start, stop))
+
+
+def heat_surface(xs, ys, wnd_size=1, wnd_weight=1, cell=1):
+    xs = np.asarray(xs, dtype=np.float64) / cell
+    ys = np.asarray(ys, dtype=np.float64) / cell
+
+    xsize = (np.max(xs) - np.min(xs)) if len(xs) > 0 else 0
+    ysize = (np.max(ys) - np.min(ys)) if len(ys) > 0 else 0
+
+    size = int(max(xsize, ysize) + 1)  # we want the surface to be square (!!)
+
+    xs = np.trunc(xs).astype(np.int64)
+    ys = np.trunc(ys).astype(np.int64)
+
+    if wnd_size <= 0:
+        # one cell per point
+        xs = np.where(xs < 0, xs + size, xs)
+        ys = np.where(ys < 0, ys + size, ys)
+
+        inside = (xs >= 0) & (xs < size) & (ys >= 0) & (ys < size)
+        img = np.bincount(ys[inside] * size + xs[inside], minlength=size * size).astype(np.float64)
+
+        return img.reshape(size, size) * wnd_weight
+
+    # each point adds the weight to the window [y - size, y + size[ x [x - size, x + size[ (clipped
+    # to the surface). The windows are accumulated as the corners of a 2D difference image that
+    # is integrated with two cumulative sums, i.e. a box kernel convolution of the points.
+    (y0, y1) = slice_bounds(ys - wnd_size, ys + wnd_size, size)
+    (x0, x1) = slice_bounds(xs - wnd_size, xs + wnd_size, size)
+
+    diff = np.zeros((size + 1) * (size + 1), dtype=np.float64)
+    corners = np.concatenate((y0 * (size + 1) + x0, y1 * (size + 1) + x1, y0 * (size + 1) + x1, y1 * (size + 1) + x0))
+    weights = np.concatenate((np.ones(2 * len(xs)), -np.ones(2 * len(xs))))
+
+    diff += np.bincount(corners, weights=weights, minlength=len(diff))
+    diff = diff.reshape(size + 1, size + 1)
+
+    return np.cumsum(np.cumsum(diff, axis=0), axis=1)[:size, :size] * wnd_weight
+
+
+def count_grid(xs, ys, cell=1):
+    # the number of points in each cell, from the cell of the smallest coordinates to the one
+    # of the largest. Returns the (column, row) of the first cell and the counts.
+    cols = np.floor(np.asarray(xs, dtype=np.float64) / cell).astype(np.int64)
+    rows = np.floor(np.asarray(ys, dtype=np.float64) / cell).astype(np.int64)
+
+    if len(cols) == 0:
+        return ((0, 0), np.zeros((0, 0)))
+
+    (col0, row0) = (int(np.min(cols)), int(np.min(rows)))
+    (width, height) = (int(np.max(cols)) - col0 + 1, int(np.max(rows)) - row0 + 1)
+
+    counts = np.bincount((rows - row0) * width + (cols - col0), minlength=width * height)
+
+    return ((col0, row0), counts.reshape(height, width).astype(np.float64))
+
+
+def window_surface(grid, wnd_size=1, wnd_weight=1):
+    # the heat surface of a grid of point counts: each point adds the weight to the window
+    # [y - size, y + size[ x [x - size, x + size[ as in heat_surface, so a cell gets the points
+    # of the cells [i - size + 1, i + size] (two cumulative sums with the sums clipped to the grid)
+    if wnd_size <= 0:
+        return grid * wnd_weight
+
+    def window(grid, axis):
+        size = grid.shape[axis]
+        sums = np.concatenate((np.zeros_like(np.take(grid, [0], axis=axis)), np.cumsum(grid, axis=axis)), axis=axis)
+        idx = np.arange(size)
+
+        return np.take(sums, np.minimum(idx + wnd_size + 1, size), axis=axis) - np.take(sums, np.clip(idx - wnd_size + 1, 0, size), axis=axis)
+
+    if grid.size == 0:
+        return grid
+
+    return window(window(grid, 0), 1) * wnd_weight
+
+
+class TrackSummary(object):
+    #
+    # Streaming aggregation of dat rows for the plots: counts the rows, adds up
+    # the orientation histogram block by block and keeps the centroids of the
+    # valid rows (the extent of the heat surface is only known at the end).
+    #
+    def __init__(self, step=1):
+        self.step = step
+        self.rows = 0
+        self.valid = 0
+        self.theta_hist = np.zeros(360 // step + 1)
+
+        self._xs = []
+        self._ys = []
+
+    def feed(self, dat):
+        self.rows += len(dat)
+
+        dat = np.asarray(dat[dat[:, 1] == 1], dtype=np.float64)
+        self.valid += len(dat)
+
+        self.theta_hist += angle_histogram(dat[:, 8], self.step)
+        self._xs.append(dat[:, 4])
+        self._ys.append(dat[:, 5])
+
+    def stream(self, blocks):
+        # streaming stage: aggregates the blocks and passes them on
+        for dat in blocks:
+            self.feed(dat)
+
+            yield dat
+
+    def centroids(self):
+        if len(self._xs) == 0:
+            return (np.zeros(0), np.zeros(0))
+
+        return (np.concatenate(self._xs), np.concatenate(self._ys))
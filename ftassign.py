@@ -0,0 +1,170 @@
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# 3rd party packages
+import numpy as np
+
+
+#
+# Assignment of detections to tracks (predicted positions). Pairs farther
+# than the gate are never matched, which splits the cost matrix in small
+# independent groups (usually a single track and detection): each group is
+# solved exactly with the Hungarian method, so the cost stays low with dozens
+# of fish.
+#
+
+def hungarian(cost):
+    #
+    # minimum cost assignment of the rows of a (rows <= cols) cost matrix,
+    # returns the column of each row.
+    #
+    # Each row is added with a shortest augmenting path (Jonker-Volgenant).
+    # The distances to all the columns are updated at once with numpy, and
+    # they're kept relative to the start of the path (d), so the potentials u
+    # and v are only updated once per row.
+    #
+    cost = np.asarray(cost, dtype=np.float64)
+    (n, m) = cost.shape
+
+    u = [0.0] * n
+    v = np.zeros(m)
+    p = [-1] * m        # row of each column (-1 when free)
+
+    for i in range(n):
+        reduced = cost - v
+        minv = np.full(m, np.inf)
+        way = np.full(m, -1, dtype=np.intp)
+        blocked = np.zeros(m)
+        (cur, better) = (np.empty(m), np.empty(m, dtype=bool))
+
+        # columns in the path with the distance when they joined it
+        path = []
+        (i0, j0, d) = (i, -1, 0.0)
+
+        while True:
+            np.add(reduced[i0], blocked, out=cur)
+            np.add(cur, d - u[i0], out=cur)
+            np.less(cur, minv, out=better)
+            np.copyto(minv, cur, where=better)
+            np.copyto(way, j0, where=better)
+
+            j0 = int(minv.argmin())
+            d = minv.item(j0)
+
+            blocked[j0] = np.inf
+            minv[j0] = np.inf
+            path.append((j0, d))
+
+            if p[j0] < 0:
+                break
+
+            i0 = p[j0]
+
+        u[i] += d
+        for (j, dj) in path:
+            if p[j] >= 0:
+                u[p[j]] += d - dj
+            v[j] -= d - dj
+
+        while j0 >= 0:
+            j1 = way.item(j0)
+            p[j0] = i if j1 < 0 else p[j1]
+            j0 = j1
+
+    cols = [0] * n
+    for (j, r) in enumerate(p):
+        if r >= 0:
+            cols[r] = j
+
+    return cols
+
+
+def gated_groups(allowed):
+    # connected groups of rows and columns linked by allowed pairs (union-find)
+    (n, m) = allowed.shape
+    parent = list(range(n + m))
+
+    def root(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    (rows, cols) = np.nonzero(allowed)
+
+    for (r, c) in zip(rows.tolist(), (cols + n).tolist()):
+        parent[root(r)] = root(c)
+
+    groups = {}
+    for (r, c) in zip(rows.tolist(), cols.tolist()):
+        group = groups.setdefault(root(r), (set(), set()))
+        group[0].add(r)
+        group[1].add(c)
+
+    return [(sorted(rs), sorted(cs)) for (rs, cs) in groups.values()]
+
+
+def assign(predicted, detected, gate):
+    #
+    # matches predicted positions (n x 2) with detected ones (m x 2), returns
+    # the (row, col) pairs; the number of pairs is maximised first and then
+    # the sum of the distances is minimised (pairs farther than the gate apart
+    # are not allowed)
+    #
+    predicted = np.asarray(predicted, dtype=np.float64).reshape(-1, 2)
+    detected = np.asarray(detected, dtype=np.float64).reshape(-1, 2)
+
+    if (len(predicted) == 0) or (len(detected) == 0):
+        return []
+
+    dist = np.hypot(predicted[:, None, 0] - detected[None, :, 0], predicted[:, None, 1] - detected[None, :, 1])
+    allowed = dist <= gate
+
+    # forbidden pairs cost more than any set of allowed ones
+    big = (gate + 1.0) * (min(dist.shape) + 1)
+
+    pairs = []
+    for (rows, cols) in gated_groups(allowed):
+        if len(rows) == 1:
+            pairs.append((rows[0], cols[int(np.argmin(dist[rows[0], cols]))]))
+            continue
+
+        if len(cols) == 1:
+            pairs.append((rows[int(np.argmin(dist[rows, cols[0]]))], cols[0]))
+            continue
+
+        cost = np.where(allowed[np.ix_(rows, cols)], dist[np.ix_(rows, cols)], big)
+
+        if len(rows) <= len(cols):
+            matches = [(rows[i], cols[j]) for (i, j) in enumerate(hungarian(cost))]
+        else:
+            matches = [(rows[i], cols[j]) for (j, i) in enumerate(hungarian(cost.T))]
+
+        pairs.extend((r, c) for (r, c) in matches if allowed[r, c])
+
+    return sorted(pairs)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# python standard library
+import argparse
+import contextlib
+import csv
+import multiprocessing
+import os
+import re
+import runpy
+import sys
+import time
+
+# the workers never show the plots
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+# 3rd party packages
+import cv2  # not used here: loaded once before the workers are forked
+import numpy as np
+import matplotlib.pyplot as plt
+
+# fish_tracker packages
+from ftlib import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST_COLUMNS = ["video", "prj", "mask", "lumth"]
+
+
+def read_manifest(fname):
+    try:
+        if fname.endswith(".json"):
+            rows = json.loads(open(fname).read())
+        else:
+            rows = list(csv.DictReader(open(fname)))
+    except ValueError:
+        sys.stderr.write("ERROR: Bad manifest file '%s'.\n" % fname)
+        sys.exit(1)
+    except IOError:
+        sys.stderr.write("ERROR: File not found '%s'.\n" % fname)
+        sys.exit(1)
+
+    for (i, row) in enumerate(rows):
+        missing = [c for c in MANIFEST_COLUMNS if c not in row]
+
+        if len(missing) > 0:
+            sys.stderr.write("ERROR: Row %d of the manifest misses: %s.\n" % (i + 1, ", ".join(missing)))
+            sys.exit(1)
+
+    return [dict((c, str(row[c]).strip()) for c in MANIFEST_COLUMNS) for row in rows]
+
+
+def newer(outputs, inputs):
+    if not all(map(os.path.isfile, outputs)):
+        return False
+
+    return min(map(os.path.getmtime, outputs)) >= max(map(os.path.getmtime, inputs))
+
+
+def run_script(script, argv, log):
+    # the scripts run at import time: run them as __main__ with their own command line
+    argv0 = sys.argv
+    sys.argv = [script] + argv
+
+    try:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            runpy.run_path(os.path.join(SCRIPTS_DIR, script), run_name="__main__")
+        return True
+    except SystemExit as e:
+        return e.code in [None, 0]
+    finally:
+        sys.argv = argv0
+        plt.close("all")
+
+
+def run_project(row):
+    (video, fprj) = (row["video"], row["prj"])
+
+    result = {"prj": fprj, "video": video, "status": "ok", "steps": {}}
+
+    # a worker must always give a result back, or the pool never ends (the scripts and
+    # the project files exit on errors)
+    try:
+        run_steps(row, result)
+    except SystemExit:
+        result["status"] = "failed (exited)"
+    except Exception as e:
+        result["status"] = "failed (%s)" % e
+
+    return result
+
+
+def run_steps(row, result):
+    (video, fprj) = (row["video"], row["prj"])
+
+    fraw = fprj + ".raw"
+    fdat = fprj + ".dat"
+    fplots = [fprj + ".plt_heat.svg", fprj + ".plt_polar.svg"]
+
+    steps = [
+        ("get", "ftget.py", [video, fprj, row["mask"], row["lumth"]], [fprj, fraw], [video]),
+        ("proc", "ftproc.py", [fprj], [fdat], [fraw]),
+        ("plot", "ftplot.py", [fprj], fplots, [fdat])
+    ]
+
+    log = open(fprj + ".log", "a")
+
+    try:
+        for (name, script, argv, outputs, inputs) in steps:
+            if not all(map(os.path.isfile, inputs)):
+                result["status"] = "missing input (%s)" % name
+                break
+
+            up_to_date = newer(outputs, inputs)
+
+            if name == "get":
+                up_to_date = up_to_date and tracking_complete(fprj, row)
+
+            if up_to_date:
+                result["steps"][name] = None
+                continue
+
+            log.write("\n# %s %s %s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), script, " ".join(argv)))
+            log.flush()
+
+            start = time.time()
+            ok = run_script(script, argv, log)
+            result["steps"][name] = time.time() - start
+
+            if not ok:
+                result["status"] = "failed (%s)" % name
+                break
+    finally:
+        log.close()
+
+    # summary of the tracking
+    if os.path.isfile(fraw):
+        raw = read_data(fraw)
+
+        result["frames"] = len(raw)
+        result["detected"] = float(np.mean(raw[:, 1])) if len(raw) > 0 else 0.0
+
+
+def tracking_complete(fprj, row):
+    # the raw file is only up to date if it was fully tracked with the same parameters
+    prj = Project(fprj)
+    checkpoint = prj.get("checkpoint")
+
+    if checkpoint is None:
+        return False
+
+    params = {"video": row["video"], "mask": parse_mask(row["mask"]), "lumth": int(row["lumth"])}
+
+    return checkpoint["complete"] and (checkpoint["params"] == params)
+
+
+def fmt_time(t):
+    return "skipped" if t is None else "%.1f" % t
+
+
+def show_summary(results, elapsed):
+    sys.stdout.write("\n%-40s %-20s %9s %9s %9s %9s %9s %9s\n" % ("Project", "Status", "Frames", "Detected", "Get (s)", "Get fps", "Proc (s)", "Plot (s)"))
+
+    tracked = 0
+    for r in results:
+        steps = r["steps"]
+        frames = r.get("frames", 0)
+
+        get_t = steps.get("get")
+        if get_t:
+            tracked += frames
+
+        sys.stdout.write("%-40s %-20s %9d %8.1f%% %9s %9s %9s %9s\n" % (
+            r["prj"][-40:], r["status"], frames, r.get("detected", 0.0) * 100.0,
+            fmt_time(get_t) if "get" in steps else "-",
+            "%.1f" % (frames / get_t) if get_t else "-",
+            fmt_time(steps["proc"]) if "proc" in steps else "-",
+            fmt_time(steps["plot"]) if "plot" in steps else "-"))
+
+    failed = len([r for r in results if r["status"] != "ok"])
+
+    sys.stdout.write("\n%d projects (%d failed), %d frames tracked in %.1fs (%.1f frames/s)\n" % (len(results), failed, tracked, elapsed, tracked / max(elapsed, 1e-9)))
+
+
+#
+# Main
+#
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-j", "--jobs",    type=int, help="number of projects processed at the same time", default=multiprocessing.cpu_count())
+parser.add_argument("-o", "--summary", type=str, help="save the summary to a JSON file")
+parser.add_argument("manifest",        type=str, help="CSV or JSON manifest (columns: video, prj, mask, lumth)")
+args = parser.parse_args()
+
+rows = read_manifest(args.manifest)
+
+# check the parameters before starting
+for row in rows:
+    parse_mask(row["mask"])
+
+    if not re.match("^[0-9]+$", row["lumth"]):
+        sys.stderr.write("ERROR: Invalid luminosity threshold '%s' for '%s'.\n" % (row["lumth"], row["prj"]))
+        sys.exit(1)
+
+start = time.time()
+
+# the scripts are not import safe so the workers must be forked
+pool = multiprocessing.get_context("fork").Pool(max(1, args.jobs))
+
+results = []
+for r in pool.imap_unordered(run_project, rows):
+    results.append(r)
+    sys.stdout.write("[%d/%d] %s: %s\n" % (len(results), len(rows), r["prj"], r["status"]))
+    sys.stdout.flush()
+
+pool.close()
+pool.join()
+
+elapsed = time.time() - start
+
+# keep the manifest order
+order = dict((row["prj"], i) for (i, row) in enumerate(rows))
+results.sort(key=lambda r: order[r["prj"]])
+
+show_summary(results, elapsed)
+
+if args.summary is not None:
+    open(args.summary, "w").write(json.dumps({"elapsed": elapsed, "projects": results}, indent=4))
+
+if any(r["status"] != "ok" for r in results):
+    sys.exit(1)
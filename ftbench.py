@@ -0,0 +1,998 @@
+#!/usr/bin/env python
+
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# python standard library
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# the figures are only saved
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+# 3rd party packages
+import cv2
+import numpy as np
+import matplotlib.pyplot as plt
+
+# fish_tracker packages
+from ftlib import *
+from fttrack import *
+from ftsynth import *
+from ftkin import *
+from ftorient import *
+from ftfig import *
+
+# timings of the suite that may get worse before it's flagged (relative)
+SUITE_TOLERANCE = 0.10
+
+# accuracy changes that are flagged: (metric, worse when higher, allowed change)
+SUITE_ACCURACY = [("detection", False, 0.001), ("orientation", False, 0.01), ("trajectory_orientation", False, 0.01), ("head_error", True, 0.25), ("centroid_error", True, 0.25), ("tail_error", True, 0.25)]
+
+
+def load_frames(video, count):
+    capture = cv2.VideoCapture(video)
+
+    frames = []
+    while len(frames) < count:
+        (ret, frame) = capture.read()
+
+        if(not ret):
+            break
+
+        frames.append(frame)
+
+    return frames
+
+
+def legacy_geometry(frame, blob):
+    #
+    # the original ftget.py head, centroid and tail computation
+    #
+    small_mask = np.uint8(np.ones(np.shape(frame)[:2])) * 0
+    cv2.fillConvexPoly(small_mask, blob, 255)
+
+    moments = cv2.moments(small_mask)
+    centroid = (int(moments['m10'] / moments['m00']), int(moments['m01'] / moments['m00']))
+
+    dists = list(map(lambda p: lindist(p[0], centroid), blob))
+    tail = tuple(blob[dists.index(max(dists))][0])
+
+    dists = list(map(lambda p: lindist(p[0], tail), blob))
+    head = tuple(blob[dists.index(max(dists))][0])
+
+    return (head, centroid, tail)
+
+
+def random_blobs(count, width, height, seed):
+    #
+    # elongated, noisy and non convex blobs scattered over a frame
+    #
+    rng = np.random.RandomState(seed)
+
+    blobs = []
+    while len(blobs) < count:
+        img = np.zeros((height, width), dtype=np.uint8)
+
+        (cx, cy) = (rng.randint(0, width), rng.randint(0, height))
+        axes = (rng.randint(10, 120), rng.randint(3, 30))
+        cv2.ellipse(img, (cx, cy), axes, rng.uniform(0, 360), 0, 360, 255, -1)
+
+        # bite some holes in the outline
+        for i in range(rng.randint(0, 6)):
+            cv2.circle(img, (cx + rng.randint(-axes[0], axes[0] + 1), cy + rng.randint(-axes[1], axes[1] + 1)), rng.randint(2, 8), 0, -1)
+
+        (contours, dummy) = cv2.findContours(img, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+        blobs += [c for c in contours if np.size(c) > 100]
+
+    return blobs[:count]
+
+
+def legacy_track(frames, mask, lumth):
+    #
+    # the original ftget.py frame loop, kept as the reference implementation
+    #
+    (mx, my, mw, mh) = mask
+
+    (frame_height, frame_width) = np.shape(frames[0])[:2]
+    full_mask = np.uint8(np.zeros((int(frame_height), int(frame_width))))
+    full_mask[my:my + mh, mx:mx + mw] = 255
+
+    last_head = None
+    last_tail = None
+
+    lines = []
+    for (f, frame) in enumerate(frames):
+        hsv = cv2.cvtColor(frame, cv2.COLOR_RGB2HSV)
+        [hue, sat, lum] = cv2.split(hsv)
+
+        (ret, lum_bin) = cv2.threshold(lum, lumth, 255, cv2.THRESH_BINARY_INV)
+
+        lum_bin = np.bitwise_and(lum_bin, full_mask)
+
+        (blobs, dummy) = cv2.findContours(lum_bin, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+        blobs = sorted(blobs, key=lambda x: -len(x))
+
+        txt = ""
+
+        if (len(blobs) > 0) and (np.size(blobs[0]) > 100):
+            blob = blobs[0]
+
+            (head, centroid, tail) = legacy_geometry(frame, blob)
+
+            if(check_inside(head[0], mx, mw) and check_inside(head[1], my, mh) and check_inside(tail[0], mx, mw) and check_inside(tail[1], my, mh)):
+                body_angle = angle(head, centroid, tail)
+
+                if (last_head is not None) and (lindist(head, last_head) > lindist(head, last_tail)) and (body_angle > 20):
+                    (head, tail) = (tail, head)
+
+            txt = "%d\t1\t%d\t%d\t%d\t%d\t%d\t%d\n" % (f, head[0], head[1], centroid[0], centroid[1], tail[0], tail[1])
+
+            last_head = head
+            last_tail = tail
+
+        if txt == "":
+            last_head = None
+            last_tail = None
+            txt = "%d\t0\t0\t0\t0\t0\t0\t0\n" % f
+
+        lines.append(txt)
+
+    return lines
+
+
+def legacy_angle_histogram(angs):
+    #
+    # the original ftplot.py polar histogram
+    #
+    theta_hist = np.zeros(361)
+
+    for a in angs:
+        a = int(a)
+        if(a < 0):
+            a = 360 + a
+        theta_hist[a] += 1
+
+    return theta_hist
+
+
+def legacy_surface(xs, ys, wnd_size, wnd_weight):
+    #
+    # the original ftplot.py heat surface (before normalization)
+    #
+    xsize = np.max(xs) - np.min(xs)
+    ysize = np.max(ys) - np.min(ys)
+
+    img_size = max(xsize, ysize) + 1
+
+    img = np.zeros((int(img_size), int(img_size)), dtype=np.float64)
+
+    for (x, y) in zip(xs, ys):
+        x, y = int(x), int(y)
+
+        if(wnd_size > 0):
+            img[y - wnd_size:y + wnd_size, x - wnd_size:x + wnd_size] += wnd_weight
+        else:
+            img[y, x] += wnd_weight
+
+    return img
+
+
+def random_track(count, size, seed):
+    #
+    # a random walk inside a square arena (with the head angle)
+    #
+    rng = np.random.RandomState(seed)
+
+    xs = np.clip(np.cumsum(rng.normal(0, 2, count)) % (2 * size), 0, 2 * size)
+    ys = np.clip(np.cumsum(rng.normal(0, 2, count)) % (2 * size), 0, 2 * size)
+    angs = rng.uniform(-180, 180, count)
+
+    # reflect the walk on the walls
+    xs = np.where(xs > size, 2 * size - xs, xs)
+    ys = np.where(ys > size, 2 * size - ys, ys)
+
+    return (xs, ys, angs)
+
+
+def engine_track(frames, mask, lumth):
+    (frame_height, frame_width) = np.shape(frames[0])[:2]
+    tracker = Tracker(frame_width, frame_height, mask, lumth)
+
+    return [format_raw(f, tracker.track(frame)) for (f, frame) in enumerate(frames)]
+
+
+def timed(func, *args):
+    start = time.time()
+    ret = func(*args)
+    return (ret, time.time() - start)
+
+
+def bench_engine(args):
+    mask = parse_mask(args.mask)
+
+    frames = load_frames(args.video, args.frames)
+    if len(frames) == 0:
+        sys.stderr.write("ERROR: No frames read from '%s'.\n" % args.video)
+        sys.exit(1)
+
+    (legacy, legacy_t) = timed(legacy_track, frames, mask, args.lumth)
+    (engine, engine_t) = timed(engine_track, frames, mask, args.lumth)
+
+    sys.stdout.write("Frames:  %d\n" % len(frames))
+    sys.stdout.write("Legacy:  %8.1f fps\n" % (len(frames) / legacy_t))
+    sys.stdout.write("Engine:  %8.1f fps (x%.2f)\n" % (len(frames) / engine_t, legacy_t / engine_t))
+    sys.stdout.write("Raw output identical: %s\n" % ("yes" if legacy == engine else "NO"))
+
+    return legacy == engine
+
+
+def bench_geometry(args):
+    frame = np.zeros((args.height, args.width, 3), dtype=np.uint8)
+    blobs = random_blobs(args.blobs, args.width, args.height, args.seed)
+
+    (legacy, legacy_t) = timed(lambda: [legacy_geometry(frame, b) for b in blobs])
+    (vector, vector_t) = timed(lambda: [blob_geometry(b) for b in blobs])
+
+    diffs = [i for (i, (l, v)) in enumerate(zip(legacy, vector)) if l != v]
+
+    sys.stdout.write("Blobs:   %d (%d points on average)\n" % (len(blobs), np.mean([len(b) for b in blobs])))
+    sys.stdout.write("Legacy:  %8.1f blobs/s\n" % (len(blobs) / legacy_t))
+    sys.stdout.write("Vector:  %8.1f blobs/s (x%.2f)\n" % (len(blobs) / vector_t, legacy_t / vector_t))
+    sys.stdout.write("Geometry identical: %s\n" % ("yes" if len(diffs) == 0 else "NO (%d blobs differ)" % len(diffs)))
+
+    return len(diffs) == 0
+
+
+def bench_plot(args):
+    (xs, ys, angs) = random_track(args.points, args.size, args.seed)
+
+    ok = True
+    for wnd_size in [0, 1, 3]:
+        (legacy, legacy_t) = timed(legacy_surface, xs, ys, wnd_size, 1)
+        (vector, vector_t) = timed(heat_surface, xs, ys, wnd_size, 1)
+
+        same = np.array_equal(legacy, vector)
+        ok = ok and same
+
+        sys.stdout.write("Surface (window %d): legacy %6.2fs, vector %6.2fs (x%.1f), identical: %s\n" % (wnd_size, legacy_t, vector_t, legacy_t / vector_t, "yes" if same else "NO"))
+
+    # the cohort surfaces are windows over grids of counts (the points closer to the
+    # border than the window are left out: heat_surface wraps their windows around)
+    inside = (xs >= 3) & (ys >= 3)
+    for wnd_size in [1, 3]:
+        vector = heat_surface(xs[inside], ys[inside], wnd_size, 1)
+        ((col0, row0), counts) = count_grid(xs[inside], ys[inside])
+
+        grid = np.zeros((row0 + counts.shape[0], col0 + counts.shape[1]))
+        grid[row0:, col0:] = counts
+        size = len(vector)
+
+        same = np.array_equal(window_surface(grid, wnd_size, 1)[:size, :size], vector)
+        ok = ok and same
+
+        sys.stdout.write("Grid surface (window %d) identical: %s\n" % (wnd_size, "yes" if same else "NO"))
+
+    (legacy, legacy_t) = timed(legacy_angle_histogram, angs)
+    (vector, vector_t) = timed(angle_histogram, angs)
+
+    same = np.array_equal(legacy, vector)
+    ok = ok and same
+
+    sys.stdout.write("Angle histogram:     legacy %6.2fs, vector %6.2fs (x%.1f), identical: %s\n" % (legacy_t, vector_t, legacy_t / vector_t, "yes" if same else "NO"))
+
+    return ok
+
+
+def bench_figures(args):
+    (xs, ys, angs) = random_track(args.points, args.size, args.seed)
+    tmp = tempfile.mkdtemp(prefix="ftbench")
+
+    sys.stdout.write("Points:  %d\n" % args.points)
+
+    try:
+        for cell in args.cells:
+            figures = [("svg", lambda f: scatter(xs, ys, False, f, cell)),
+                       ("png", lambda f: scatter(xs, ys, False, f, cell, args.dpi)),
+                       ("fast png", lambda f: raster_scatter(xs, ys, f, cell, args.dpi))]
+
+            times = []
+            for (name, draw) in figures:
+                fname = os.path.join(tmp, "heat.%s" % name.split()[-1])
+                (ret, elapsed) = timed(draw, fname)
+                plt.close("all")
+
+                times.append(elapsed)
+                sys.stdout.write("cell %-5g %-9s %6.2fs %8d KB%s\n" % (cell, name + ":", elapsed, os.path.getsize(fname) // 1024, "" if len(times) == 1 else " (x%.2f)" % (times[0] / elapsed)))
+    finally:
+        shutil.rmtree(tmp)
+
+    return True
+
+
+def random_dat(count, size, fps, seed):
+    #
+    # dat rows of a random walk with gaps (fish not detected) and still
+    # periods, for the kinematics
+    #
+    rng = np.random.RandomState(seed)
+    (xs, ys, angs) = random_track(count, size, seed)
+
+    # the fish stops now and then (for up to a few seconds)
+    still = np.repeat(rng.uniform(size=count // 50 + 1) < 0.3, 50)[:count]
+    xs = np.where(still, xs[np.maximum.accumulate(np.where(still, 0, np.arange(count)))], xs)
+    ys = np.where(still, ys[np.maximum.accumulate(np.where(still, 0, np.arange(count)))], ys)
+
+    dat = np.zeros((count, 9))
+    dat[:, 0] = np.arange(count)
+    dat[:, 1] = np.repeat(rng.uniform(size=count // 20 + 1) > 0.05, 20)[:count]
+    dat[:, 4] = xs
+    dat[:, 5] = ys
+    dat[:, 8] = angs
+    dat[dat[:, 1] == 0, 2:] = 0
+
+    return dat
+
+
+def loop_kinematics(dat, fps, freeze_speed, freeze_frames, zones, extent):
+    # the per frame kinematics of a single fish, one row at a time
+    (x0, y0, width, height) = extent
+    (cols, rows) = zones
+
+    kin = []
+    distance = 0.0
+    last_speed = np.nan
+
+    for (i, row) in enumerate(dat):
+        prev = dat[i - 1] if i > 0 else None
+        speed = acceleration = turn = np.nan
+
+        if (prev is not None) and (row[1] == 1) and (prev[1] == 1) and (row[0] - prev[0] == 1):
+            d = np.hypot(row[4] - prev[4], row[5] - prev[5])
+            distance += d
+            speed = d * fps
+
+            turn = (row[8] - prev[8]) % 360.0
+            turn = (turn - 360.0 if turn > 180.0 else turn) * fps
+
+        acceleration = (speed - last_speed) * fps
+        last_speed = speed
+
+        zone = -1
+        if row[1] == 1:
+            col = min(max(int(np.floor((row[4] - x0) / width * cols)), 0), cols - 1)
+            r = min(max(int(np.floor((row[5] - y0) / height * rows)), 0), rows - 1)
+            zone = r * cols + col
+
+        kin.append([row[0], row[1], speed, acceleration, turn, distance, 0, zone])
+
+    # the slow runs that are long enough are frozen
+    kin = np.array(kin)
+    i = 0
+    while i < len(kin):
+        j = i
+        while (j < len(kin)) and (kin[j, 2] < freeze_speed):
+            j += 1
+
+        if j - i >= freeze_frames:
+            kin[i:j, 6] = 1
+
+        i = max(j, i + 1)
+
+    return kin
+
+
+def bench_kinematics(args):
+    dat = random_dat(args.rows, args.size, args.fps, args.seed)
+    extent = (0.0, 0.0, float(args.size), float(args.size))
+
+    def vector():
+        kinematics = Kinematics(args.fps, extent=extent)
+        blocks = [kinematics.feed(dat[i:i + args.block]) for i in range(0, len(dat), args.block)]
+        return (np.concatenate(blocks + [kinematics.finish()]), kinematics.summary())
+
+    ((kin, summary), vector_t) = timed(vector)
+
+    check = dat[:args.check]
+    (loop, loop_t) = timed(loop_kinematics, check, args.fps, 2.0, int(round(args.fps)), (3, 3), extent)
+
+    # the distances are summed in a different order
+    same = (len(kin) == len(dat)) and np.allclose(kin[:len(check)], loop, rtol=1e-9, atol=1e-6, equal_nan=True)
+    totals = np.isclose(np.sum(summary[:, 4]), kin[-1, 5]) and (np.sum(summary[:, 8]) * args.fps == np.sum(kin[:, 6])) and \
+        np.allclose(np.sum(summary[:, 10:], axis=1), summary[:, 3])
+
+    sys.stdout.write("Rows:    %d (blocks of %d), %d windows\n" % (len(dat), args.block, len(summary)))
+    sys.stdout.write("Vector:  %8.2fs (%.1f Mrows/s)\n" % (vector_t, len(dat) / vector_t / 1e6))
+    sys.stdout.write("Loop:    %8.2fs for %d rows (x%.0f slower per row)\n" % (loop_t, len(check), (loop_t / len(check)) / (vector_t / len(dat))))
+    sys.stdout.write("Per frame metrics identical to the loop: %s\n" % ("yes" if same else "NO"))
+    sys.stdout.write("Window summary matches the per frame metrics: %s\n" % ("yes" if totals else "NO"))
+
+    return same and totals
+
+
+def random_swim(count, size, length, seed):
+    #
+    # raw rows of a fish swimming forward (the head leads the centroid) with
+    # gaps and still periods. The tracker can't tell the head from the tail,
+    # so each frame gets a random orientation. Returns the rows and the true
+    # head of each one.
+    #
+    rng = np.random.RandomState(seed)
+
+    heading = np.cumsum(rng.normal(0, 0.15, count))
+    speed = np.repeat(rng.uniform(0, 4, count // 40 + 1), 40)[:count] * (np.repeat(rng.uniform(size=count // 100 + 1), 100)[:count] > 0.2)
+    (xs, ys) = (np.cumsum(speed * np.cos(heading)), np.cumsum(speed * np.sin(heading)))
+
+    # fold the path inside the arena (the heading folds with it)
+    (fx, fy) = (np.mod(xs, 2 * size) > size, np.mod(ys, 2 * size) > size)
+    xs = np.where(fx, 2 * size - np.mod(xs, 2 * size), np.mod(xs, 2 * size)) + length
+    ys = np.where(fy, 2 * size - np.mod(ys, 2 * size), np.mod(ys, 2 * size)) + length
+    (dx, dy) = (np.where(fx, -1, 1) * np.cos(heading), np.where(fy, -1, 1) * np.sin(heading))
+
+    head = np.round(np.stack((xs + dx * length / 2.0, ys + dy * length / 2.0), axis=1))
+    tail = np.round(np.stack((xs - dx * length / 2.0, ys - dy * length / 2.0), axis=1))
+    flip = rng.uniform(size=count) < 0.5
+
+    raw = np.zeros((count, 8))
+    raw[:, 0] = np.arange(count)
+    raw[:, 1] = np.repeat(rng.uniform(size=count // 20 + 1) > 0.05, 20)[:count]
+    raw[:, 2:4] = np.where(flip[:, None], tail, head)
+    raw[:, 4:6] = np.round(np.stack((xs, ys), axis=1))
+    raw[:, 6:8] = np.where(flip[:, None], head, tail)
+    raw[raw[:, 1] == 0, 2:] = 0
+
+    return (raw, head)
+
+
+def loop_orientation(rows, starts, velocity):
+    # the Viterbi pass of orient_segments, one row at a time
+    states = []
+    (first, n) = (0, len(rows))
+
+    while first < n:
+        last = first + 1
+        while (last < n) and not starts[last]:
+            last += 1
+
+        seg = rows[first:last].tolist()
+        (best, back) = ([0.0, 0.0], [])
+
+        for i in range(len(seg)):
+            (hx, hy, cx, cy, tx, ty) = seg[i][2:8]
+            (px, py) = seg[max(i - 1, 0)][4:6]
+            (nx, ny) = seg[min(i + 1, len(seg) - 1)][4:6]
+            (vx, vy) = (nx - px, ny - py)
+
+            length = math.hypot(hx - tx, hy - ty)
+            along = ((hx - tx) * vx + (hy - ty) * vy) / length if length > 0 else 0.0
+            speed = math.hypot(vx, vy)
+            cost = [velocity * (speed - along) / 2.0, velocity * (speed + along) / 2.0]
+
+            if i == 0:
+                best = cost
+                continue
+
+            (phx, phy, _, _, ptx, pty) = seg[i - 1][2:8]
+            a = math.hypot(hx - phx, hy - phy) + math.hypot(tx - ptx, ty - pty)
+            b = math.hypot(hx - ptx, hy - pty) + math.hypot(tx - phx, ty - phy)
+
+            step = []
+            new = []
+            for s in [0, 1]:
+                (same, other) = (best[s] + a, best[1 - s] + b)
+                step.append(s if same <= other else 1 - s)
+                new.append(min(same, other) + cost[s])
+
+            back.append(step)
+            best = new
+
+        state = 0 if best[0] <= best[1] else 1
+        seg_states = [state]
+        for step in reversed(back):
+            state = step[state]
+            seg_states.append(state)
+
+        states.extend(reversed(seg_states))
+        first = last
+
+    return np.array(states)
+
+
+def greedy_orientation(raw, size):
+    # the frame by frame orientation of ftget.py
+    headtail = HeadTail((0, 0, 4 * size, 4 * size))
+    out = raw.copy()
+
+    for row in out:
+        points = None if row[1] == 0 else (tuple(row[2:4]), tuple(row[4:6]), tuple(row[6:8]))
+
+        # (the body angle is not defined when the head or the tail is on the centroid)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            points = headtail.orient(points)
+
+        if points is not None:
+            row[2:4] = points[0]
+            row[6:8] = points[2]
+
+    return out
+
+
+def head_accuracy(raw, head):
+    # fraction of the detected rows with the head closer to the true head than the tail
+    detected = raw[:, 1] == 1
+    head = head[:len(raw)]
+    (h, t) = (raw[detected, 2:4] - head[detected], raw[detected, 6:8] - head[detected])
+
+    return np.mean(np.hypot(*h.T) < np.hypot(*t.T))
+
+
+def bench_orient(args):
+    (raw, head) = random_swim(args.rows, args.size, args.length, args.seed)
+
+    def vector(raw):
+        orientation = Orientation(velocity=args.velocity)
+        return np.concatenate(list(orientation.stream(raw[i:i + args.block] for i in range(0, len(raw), args.block))))
+
+    (out, vector_t) = timed(vector, raw)
+
+    # the same rows with other random orientations from the tracker
+    rng = np.random.RandomState(args.seed + 1)
+    flipped = raw.copy()
+    flip = rng.uniform(size=len(raw)) < 0.5
+    flipped[flip, 2:8] = flipped[flip][:, [6, 7, 4, 5, 2, 3]]
+
+    # only the segments where the fish moves can be oriented (the others are left as they are)
+    seen = raw[:, 1] == 1
+    segment = np.cumsum(seen & ~np.append(False, seen[:-1]))
+    moved = np.append(False, seen[1:] & seen[:-1] & np.any(np.diff(raw[:, 4:6], axis=0) != 0, axis=1))
+    moving = seen & (np.bincount(segment, weights=moved)[segment] > 0)
+    invariant = np.array_equal(vector(flipped)[moving], out[moving])
+
+    check = raw[:args.check]
+    rows = check[check[:, 1] == 1]
+    detected = check[:, 1] == 1
+    starts = detected & ~np.append(False, detected[:-1])
+
+    (loop, loop_t) = timed(loop_orientation, rows, starts[detected], args.velocity)
+    same = np.array_equal(loop, orient_segments(rows, starts[detected], args.velocity))
+
+    (greedy, greedy_t) = timed(greedy_orientation, check, args.size)
+
+    sys.stdout.write("Rows:    %d (blocks of %d)\n" % (len(raw), args.block))
+    sys.stdout.write("Vector:  %8.2fs (%.1f Mrows/s)\n" % (vector_t, len(raw) / vector_t / 1e6))
+    sys.stdout.write("Loop:    %8.2fs for %d rows (x%.0f slower per row)\n" % (loop_t, len(check), (loop_t / len(check)) / (vector_t / len(raw))))
+    sys.stdout.write("Heads right: tracker %.1f%%, frame by frame %.1f%%, trajectory %.1f%%\n" % (100.0 * head_accuracy(check, head), 100.0 * head_accuracy(greedy, head), 100.0 * head_accuracy(out[:len(check)], head)))
+    sys.stdout.write("Orientation identical to the loop: %s\n" % ("yes" if same else "NO"))
+    sys.stdout.write("Orientation independent of the tracker's (%.1f%% of the rows, with motion): %s\n" % (100.0 * np.mean(moving[raw[:, 1] == 1]), "yes" if invariant else "NO"))
+
+    return same and invariant
+
+
+def stage_profile(video, mask, lumth):
+    #
+    # the ftget.py frame loop, timing each stage separately (seconds)
+    #
+    capture = cv2.VideoCapture(video)
+    frame_width = capture.get(cv2.CAP_PROP_FRAME_WIDTH)
+    frame_height = capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
+
+    metrics = Metrics()
+    tracker = Tracker(frame_width, frame_height, mask, lumth, metrics)
+
+    rows = []
+    f = 0
+    while True:
+        t = metrics.clock()
+        (ret, frame) = capture.read()
+
+        if(not ret):
+            break
+
+        metrics.lap("decode", t)
+        points = tracker.detect(frame)
+
+        t = metrics.clock()
+        points = tracker.headtail.orient(points)
+        t = metrics.lap("orient", t)
+        rows.append(format_raw(f, points))
+        metrics.lap("encode", t)
+
+        f += 1
+
+    capture.release()
+
+    stages = metrics.snapshot()["stages"]
+
+    return (dict((name, stages[name]["total"]) for name in ["decode", "colour", "threshold", "contours", "geometry", "orient", "encode"] if name in stages), rows)
+
+
+def run_script(name, *args):
+    # runs one of the scripts as the users do, returns the elapsed time (None if it failed)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    env = dict(os.environ, MPLBACKEND="Agg")
+
+    start = time.time()
+    ret = subprocess.call([sys.executable, script] + list(map(str, args)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    elapsed = time.time() - start
+
+    if ret != 0:
+        sys.stderr.write("ERROR: %s failed (exit code %d).\n" % (name, ret))
+        return None
+
+    return elapsed
+
+
+def compare_results(results, baseline, tolerance):
+    # lists the measures that got worse than in the baseline
+    regressions = []
+
+    if baseline["config"] != results["config"]:
+        sys.stderr.write("WARNING: The baseline was run with a different configuration.\n")
+
+    for group in ["scripts", "stages"]:
+        for (name, value) in results[group].items():
+            base = baseline.get(group, {}).get(name)
+
+            if (base is not None) and (value is not None) and (value > base * (1.0 + tolerance)):
+                regressions.append("%s %s: %.4fs -> %.4fs (%+.1f%%)" % (group, name, base, value, 100.0 * (value / base - 1.0)))
+
+    for (name, higher, delta) in SUITE_ACCURACY:
+        (base, value) = (baseline["accuracy"].get(name), results["accuracy"][name])
+
+        if (base is not None) and ((value - base > delta) if higher else (base - value > delta)):
+            regressions.append("accuracy %s: %.4f -> %.4f" % (name, base, value))
+
+    return regressions
+
+
+def bench_suite(args):
+    (mx, my, mw, mh) = parse_mask(args.mask) if args.mask else (args.width // 6, args.height // 6, args.width * 2 // 3, args.height * 2 // 3)
+
+    mask = "%dx%d:%dx%d" % (mx, my, mw, mh)
+    config = {"width": args.width, "height": args.height, "frames": args.frames, "mask": mask, "length": args.length, "seed": args.seed}
+
+    tmpdir = tempfile.mkdtemp(prefix="ftbench-")
+
+    try:
+        video = os.path.join(tmpdir, "synth.avi")
+        prj = os.path.join(tmpdir, "synth")
+        fused = os.path.join(tmpdir, "fused")
+
+        sys.stderr.write("Generating a %dx%d video with %d frames...\n" % (args.width, args.height, args.frames))
+        truth = synth_video(video, args.width, args.height, args.frames, (mx, my, mw, mh), args.length, args.seed)
+
+        sys.stderr.write("Profiling the frame loop...\n")
+        (stages, rows) = stage_profile(video, (mx, my, mw, mh), SYNTH_LUMTH)
+
+        sys.stderr.write("Running the scripts...\n")
+        scripts = {
+            "ftget": run_script("ftget.py", "--no-cache", video, prj, mask, SYNTH_LUMTH),
+            "ftproc": run_script("ftproc.py", prj),
+            "ftplot": run_script("ftplot.py", prj),
+            "ftrun": run_script("ftrun.py", "--raw", "--dat", video, fused, mask, SYNTH_LUMTH)
+        }
+
+        if (scripts["ftget"] is None) or (scripts["ftproc"] is None) or (scripts["ftrun"] is None):
+            return False
+
+        raw = read_data(prj + ".raw")
+        same = "".join(rows) == open(prj + ".raw").read()
+
+        # the fused run must write the same files as the separate scripts
+        fused_same = all(open(prj + ext, "rb").read() == open(fused + ext, "rb").read() for ext in [".raw", ".dat"])
+
+        accuracy = track_accuracy(raw, truth)
+
+        # the orientation of ftproc.py -o
+        oriented = np.concatenate(list(Orientation().stream([raw])))
+        accuracy["trajectory_orientation"] = track_accuracy(oriented, truth)["orientation"]
+    finally:
+        if args.keep:
+            sys.stderr.write("Files kept in '%s'.\n" % tmpdir)
+        else:
+            shutil.rmtree(tmpdir)
+
+    results = {
+        "config": config,
+        "scripts": scripts,
+        "stages": stages,
+        "accuracy": accuracy,
+        "system": {"python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__, "machine": platform.machine(), "cpus": os.cpu_count()},
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+    sys.stdout.write("Video:    %dx%d, %d frames, ROI %s\n" % (args.width, args.height, args.frames, mask))
+
+    for (name, elapsed) in scripts.items():
+        sys.stdout.write("%-9s %s\n" % (name + ":", "FAILED" if elapsed is None else "%8.2fs" % elapsed))
+
+    total = sum(stages.values())
+    for (name, elapsed) in stages.items():
+        sys.stdout.write("  %-9s %8.1f us/frame (%4.1f%%)\n" % (name + ":", 1e6 * elapsed / max(len(rows), 1), 100.0 * elapsed / total))
+
+    sys.stdout.write("Accuracy: detection %.1f%%, orientation %.1f%% (along the trajectories %.1f%%), errors (px) head %.2f, centroid %.2f, tail %.2f\n" % (
+        100.0 * accuracy["detection"], 100.0 * accuracy["orientation"], 100.0 * accuracy["trajectory_orientation"], accuracy["head_error"], accuracy["centroid_error"], accuracy["tail_error"]))
+    sys.stdout.write("Frame loop and ftget.py output identical: %s\n" % ("yes" if same else "NO"))
+    sys.stdout.write("ftrun.py and ftget.py + ftproc.py output identical: %s\n" % ("yes" if fused_same else "NO"))
+
+    if args.output:
+        json.dump(results, open(args.output, "w"), indent=4)
+
+    ok = same and fused_same and (None not in scripts.values())
+
+    if args.compare:
+        regressions = compare_results(results, json.load(open(args.compare)), args.tolerance)
+
+        for txt in regressions:
+            sys.stdout.write("REGRESSION: %s\n" % txt)
+
+        if len(regressions) == 0:
+            sys.stdout.write("No regressions against '%s'.\n" % args.compare)
+
+        ok = ok and (len(regressions) == 0)
+
+    return ok
+
+
+def bench_multi(args):
+    (mx, my, mw, mh) = (args.width // 6, args.height // 6, args.width * 2 // 3, args.height * 2 // 3)
+
+    tmpdir = tempfile.mkdtemp(prefix="ftbench-")
+    results = []
+
+    try:
+        for k in args.fish:
+            video = os.path.join(tmpdir, "school%d.avi" % k)
+            truth = synth_school(video, args.width, args.height, args.frames, (mx, my, mw, mh), k, args.length, args.seed)
+
+            frames = load_frames(video, args.frames)
+
+            tracker = Tracker(args.width, args.height, (mx, my, mw, mh), SYNTH_LUMTH)
+            multi = MultiTracker((mx, my, mw, mh), k, args.max_jump)
+
+            # only the tracking is timed, not the decoding
+            start = time.time()
+            school = [multi.update(tracker.detect_many(frame, k)) for frame in frames]
+            elapsed = time.time() - start
+
+            accuracy = identity_accuracy(school, truth)
+            accuracy.update({"fish": k, "fps": len(frames) / elapsed, "new_tracks": multi.new_tracks})
+            results.append(accuracy)
+
+            sys.stdout.write("%3d fish: %8.1f fps, detection %5.1f%%, identity %5.1f%%, %d switches, %d tracks started\n" % (
+                k, accuracy["fps"], 100.0 * accuracy["detection"], 100.0 * accuracy["identity"], accuracy["switches"], multi.new_tracks))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        json.dump({"config": {"width": args.width, "height": args.height, "frames": args.frames, "length": args.length, "seed": args.seed}, "results": results}, open(args.output, "w"), indent=4)
+
+    return True
+
+
+def lag_stats(lags):
+    # mean, 90th percentile and max (seconds) of a list of lags
+    if len(lags) == 0:
+        return {"mean": 0.0, "p90": 0.0, "max": 0.0}
+
+    return {"mean": float(np.mean(lags)), "p90": float(np.percentile(lags, 90)), "max": float(np.max(lags))}
+
+
+def bench_follow(args):
+    (mx, my, mw, mh) = (args.width // 6, args.height // 6, args.width * 2 // 3, args.height * 2 // 3)
+    mask = "%dx%d:%dx%d" % (mx, my, mw, mh)
+
+    tmpdir = tempfile.mkdtemp(prefix="ftbench-")
+
+    try:
+        video = os.path.join(tmpdir, "live.mjpg")
+        prj = os.path.join(tmpdir, "live")
+        fmetrics = os.path.join(tmpdir, "metrics.json")
+
+        # the camera writes the video in real time while it's tracked
+        written = {}
+        camera = threading.Thread(target=synth_camera, args=(video, args.width, args.height, args.frames, (mx, my, mw, mh), args.fps), kwargs={"written": written})
+        camera.start()
+
+        sys.stderr.write("Recording %d frames at %.1f fps...\n" % (args.frames, args.fps))
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ftget.py")
+        ftget = subprocess.Popen([sys.executable, script, "--follow", "--idle", str(args.idle), "-q", "-m", fmetrics, video, prj, mask, str(SYNTH_LUMTH)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # watch the raw file grow (when each frame gets its row) and update the dat file now and then
+        rows = AppendedRows(prj + ".raw")
+        seen = {}
+        procs = []
+        next_proc = time.time() + args.interval
+
+        while True:
+            running = ftget.poll() is None
+
+            if os.path.isfile(prj + ".raw"):
+                for raw in rows:
+                    now = time.time()
+
+                    for f in raw[:, 0]:
+                        seen[int(f)] = now
+
+                if (time.time() >= next_proc) or (not running):
+                    newest = max(seen) if len(seen) > 0 else None
+                    elapsed = run_script("ftproc.py", "-i", prj)
+
+                    if (elapsed is not None) and (newest is not None):
+                        procs.append((elapsed, time.time() - written[newest]))
+
+                    next_proc = time.time() + args.interval
+
+            if not running:
+                break
+
+            time.sleep(0.005)
+
+        camera.join()
+
+        # the incremental dat file must be the one a full run writes
+        shutil.copyfile(prj, prj + "-full")
+        shutil.copyfile(prj + ".raw", prj + "-full.raw")
+        run_script("ftproc.py", prj + "-full")
+        same = open(prj + ".dat", "rb").read() == open(prj + "-full.dat", "rb").read()
+
+        metrics = json.load(open(fmetrics))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    lags = [seen[f] - written[f] for f in seen if f in written]
+    stages = metrics["stages"]
+
+    results = {
+        "config": {"width": args.width, "height": args.height, "frames": args.frames, "fps": args.fps, "interval": args.interval},
+        "frames": len(seen),
+        "raw_lag": lag_stats(lags),
+        "ftget_latency": dict((k, stages["latency"][k]) for k in ["mean", "p90", "max"]) if "latency" in stages else None,
+        "ftget_lag": dict((k, stages["lag"][k]) for k in ["mean", "p90", "max"]) if "lag" in stages else None,
+        "ftproc_runs": len(procs),
+        "ftproc_time": lag_stats([p[0] for p in procs]),
+        "dat_lag": lag_stats([p[1] for p in procs]),
+        "same": same
+    }
+
+    sys.stdout.write("Frames:   %d written, %d tracked\n" % (len(written), len(seen)))
+
+    for (name, label) in [("raw_lag", "raw lag:"), ("ftget_latency", "latency:"), ("ftget_lag", "ftget lag:"), ("ftproc_time", "ftproc -i:"), ("dat_lag", "dat lag:")]:
+        if results[name] is not None:
+            sys.stdout.write("%-11s mean %7.3fs, p90 %7.3fs, max %7.3fs\n" % (label, results[name]["mean"], results[name]["p90"], results[name]["max"]))
+
+    sys.stdout.write("Incremental and full dat files identical: %s\n" % ("yes" if same else "NO"))
+
+    if args.output:
+        json.dump(results, open(args.output, "w"), indent=4)
+
+    return same and (len(seen) == args.frames)
+
+
+#
+# Main
+#
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest="bench")
+subparsers.required = True
+
+p = subparsers.add_parser("engine", help="compare the ROI tracking engine with the original frame loop")
+p.add_argument("-n", "--frames", type=int, help="number of frames to decode and analyse", default=500)
+p.add_argument("video",          type=str, help="input video file")
+p.add_argument("mask",           type=str, help="mask coords (<left>x<top>:<width>x<height>)")
+p.add_argument("lumth",          type=int, help="Luminosity threshold (ex. 200)")
+p.set_defaults(func=bench_engine)
+
+p = subparsers.add_parser("geometry", help="check the vectorized head/centroid/tail geometry against the original code")
+p.add_argument("-n", "--blobs",  type=int, help="number of random blobs", default=2000)
+p.add_argument("-W", "--width",  type=int, help="frame width",  default=1920)
+p.add_argument("-H", "--height", type=int, help="frame height", default=1080)
+p.add_argument("-r", "--seed",   type=int, help="random seed",  default=0)
+p.set_defaults(func=bench_geometry)
+
+p = subparsers.add_parser("plot", help="compare the ftplot.py aggregations with the original loops on a synthetic track")
+p.add_argument("-n", "--points", type=int, help="number of points", default=1000000)
+p.add_argument("-S", "--size",   type=int, help="arena size", default=300)
+p.add_argument("-r", "--seed",   type=int, help="random seed", default=0)
+p.set_defaults(func=bench_plot)
+
+p = subparsers.add_parser("figures", help="time the heat figure of ftplot.py in SVG, in PNG and through the PNG fast path")
+p.add_argument("-n", "--points", type=int, help="number of points", default=1000000)
+p.add_argument("-S", "--size",   type=int, help="arena size", default=300)
+p.add_argument("-c", "--cells",  type=float, nargs="+", help="heat map cell sizes to try", default=[1.0, 0.25, 0.1])
+p.add_argument("-d", "--dpi",    type=int, help="resolution of the PNG figures", default=100)
+p.add_argument("-r", "--seed",   type=int, help="random seed", default=0)
+p.set_defaults(func=bench_figures)
+
+p = subparsers.add_parser("kinematics", help="check the vectorized kinematics against a simple loop and time them on a long random track")
+p.add_argument("-n", "--rows",   type=int, help="number of rows", default=2000000)
+p.add_argument("-b", "--block",  type=int, help="rows per block", default=100000)
+p.add_argument("-c", "--check",  type=int, help="rows checked against the loop", default=100000)
+p.add_argument("-f", "--fps",    type=float, help="frames per second", default=30.0)
+p.add_argument("-S", "--size",   type=int, help="arena size", default=300)
+p.add_argument("-r", "--seed",   type=int, help="random seed", default=0)
+p.set_defaults(func=bench_kinematics)
+
+p = subparsers.add_parser("orient", help="check the trajectory head/tail orientation against a simple loop and time it on a long random track")
+p.add_argument("-n", "--rows",   type=int, help="number of rows", default=2000000)
+p.add_argument("-b", "--block",  type=int, help="rows per block", default=100000)
+p.add_argument("-c", "--check",  type=int, help="rows checked against the loop", default=50000)
+p.add_argument("-S", "--size",   type=int, help="arena size", default=300)
+p.add_argument("-L", "--length", type=int, help="fish length", default=30)
+p.add_argument("-v", "--velocity", type=float, help="weight of the velocity cost", default=1.0)
+p.add_argument("-r", "--seed",   type=int, help="random seed", default=0)
+p.set_defaults(func=bench_orient)
+
+p = subparsers.add_parser("suite", help="time the scripts and the frame loop stages on a synthetic video and check their accuracy")
+p.add_argument("-W", "--width",  type=int, help="frame width",  default=640)
+p.add_argument("-H", "--height", type=int, help="frame height", default=480)
+p.add_argument("-n", "--frames", type=int, help="number of frames", default=1000)
+p.add_argument("-m", "--mask",   type=str, help="ROI (default: the centre two thirds of the frame)", default=None)
+p.add_argument("-L", "--length", type=int, help="fish length (pixels)", default=40)
+p.add_argument("-r", "--seed",   type=int, help="random seed", default=0)
+p.add_argument("-o", "--output", type=str, help="save the results to a JSON file", default=None)
+p.add_argument("-c", "--compare", type=str, help="flag the regressions against the results of a previous run (JSON file)", default=None)
+p.add_argument("-t", "--tolerance", type=float, help="relative slowdown allowed before flagging a timing", default=SUITE_TOLERANCE)
+p.add_argument("-k", "--keep",   action="store_true", help="keep the generated files")
+p.set_defaults(func=bench_suite)
+
+p = subparsers.add_parser("multi", help="time the multi-fish tracking as the number of fish grows and check the identities")
+p.add_argument("-f", "--fish",   type=int, nargs="+", help="numbers of fish to try", default=[1, 5, 10, 20, 40])
+p.add_argument("-W", "--width",  type=int, help="frame width",  default=1280)
+p.add_argument("-H", "--height", type=int, help="frame height", default=960)
+p.add_argument("-n", "--frames", type=int, help="number of frames", default=300)
+p.add_argument("-L", "--length", type=int, help="fish length (pixels)", default=30)
+p.add_argument("-j", "--max-jump", type=float, help="largest distance (pixels) a fish may move between frames", default=50.0)
+p.add_argument("-r", "--seed",   type=int, help="random seed", default=0)
+p.add_argument("-o", "--output", type=str, help="save the results to a JSON file", default=None)
+p.set_defaults(func=bench_multi)
+
+p = subparsers.add_parser("follow", help="track a synthetic recording while it's written and update the dat file as it grows")
+p.add_argument("-W", "--width",  type=int, help="frame width",  default=640)
+p.add_argument("-H", "--height", type=int, help="frame height", default=480)
+p.add_argument("-n", "--frames", type=int, help="number of frames", default=600)
+p.add_argument("-f", "--fps",    type=float, help="frames per second of the recording", default=30.0)
+p.add_argument("-i", "--interval", type=float, help="seconds between the ftproc.py -i runs", default=2.0)
+p.add_argument("--idle",         type=float, help="seconds without new frames before ftget.py stops", default=2.0)
+p.add_argument("-o", "--output", type=str, help="save the results to a JSON file", default=None)
+p.set_defaults(func=bench_follow)
+
+args = parser.parse_args()
+
+if not args.func(args):
+    sys.exit(1)
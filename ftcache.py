@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# python standard library
+import argparse
+import sys
+import time
+
+# fish_tracker packages
+from ftlib import *
+
+
+def parse_size(size):
+    m = re.match(r"^(\d+(?:\.\d+)?)([KMG]?)$", size.upper())
+
+    if m is None:
+        sys.stderr.write("Invalid size: '%s'\n" % size)
+        sys.exit(1)
+
+    return int(float(m.group(1)) * {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[m.group(2)])
+
+
+def show_size(size):
+    for unit in ["B", "K", "M"]:
+        if size < 1024:
+            return "%.1f%s" % (size, unit)
+        size /= 1024.0
+
+    return "%.1fG" % size
+
+
+# parse the script's arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("-c", "--cache", type=str, help="cache directory (default: $FT_CACHE_DIR or ~/.cache/fishtracker)")
+subparsers = parser.add_subparsers(dest="cmd")
+subparsers.required = True
+
+subparsers.add_parser("list", help="list the cached results (most recently used first)")
+
+p = subparsers.add_parser("prune", help="remove the least recently used results")
+p.add_argument("-s", "--size", type=str, help="maximum size of the cache (ex. 500M, 2G); default: the cache limit")
+p.add_argument("-a", "--all",  action="store_true", help="remove all the results")
+
+args = parser.parse_args()
+
+cache = ResultCache(args.cache)
+entries = cache.entries()
+
+if args.cmd == "list":
+    sys.stdout.write("%-40s %8s %5s %-19s %-6s %-16s %5s %s\n" % ("Key", "Size", "Hits", "Last used", "Format", "Mask", "Lumth", "Video"))
+
+    for e in entries:
+        sys.stdout.write("%-40s %8s %5d %-19s %-6s %-16s %5d %s\n" % (e["key"], show_size(e["size"]), e["hits"], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e["last_used"])), e["raw_format"], "%dx%d:%dx%d" % tuple(e["mask"]), e["lumth"], e["video"]))
+
+    sys.stdout.write("\n%d results, %s in '%s' (limit %s)\n" % (len(entries), show_size(sum(e["size"] for e in entries)), cache.path, show_size(cache.max_size)))
+
+elif args.cmd == "prune":
+    max_size = 0 if args.all else (cache.max_size if args.size is None else parse_size(args.size))
+    removed = cache.prune(max_size)
+
+    for e in removed:
+        sys.stdout.write("Removed %s (%s, %s)\n" % (e["key"], show_size(e["size"]), e["video"]))
+
+    sys.stdout.write("%d results removed, %s freed.\n" % (len(removed), show_size(sum(e["size"] for e in removed))))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# python standard library
+import argparse
+import os
+import sys
+
+# fish_tracker packages
+from ftlib import *
+
+# parse the script's arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("-t", "--text", action="store_true", help="convert to text (default is to convert to binary)")
+parser.add_argument("prj",          type=str,            help="project file.")
+args = parser.parse_args()
+
+# get the project data
+prj = Project(args.prj)
+
+binary = not args.text
+fmt = "binary" if binary else "text"
+
+files = [(kind, fname) for (name, mask, lumth) in prj.get_arenas() for (kind, fname) in [("raw", prj.get_raw_fname(name)), ("dat", prj.get_dat_fname(name))]]
+
+for (kind, fname) in files:
+    if not os.path.isfile(fname):
+        continue
+
+    if is_binary(fname) == binary:
+        sys.stdout.write("%s file is already %s.\n" % (kind, fmt))
+    else:
+        # write a new file and replace the old one only when done
+        write_data(fname + ".tmp", read_data(fname), kind, binary, prj.get("raw_extra") if kind == "raw" else None)
+        os.replace(fname + ".tmp", fname)
+
+        sys.stdout.write("%s file converted to %s.\n" % (kind, fmt))
+
+    prj.set("%s_format" % kind, fmt)
+
+prj.save(args.prj)
+
+sys.stdout.write("DONE\n")
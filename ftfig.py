@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# 3rd party packages
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.cm as cm
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import NullFormatter
+
+# fish_tracker packages
+from ftlib import *
+
+#
+# The figures of ftplot.py (also drawn by ftrun.py).
+#
+
+WND_SIZE = 1
+WND_WEIGHT = 1
+
+
+def normalize(data, scale=1.0):
+    min_data = float(np.min(data))
+    max_data = float(np.max(data))
+
+    return((data - min_data) / (max_data - min_data)  * float(scale))
+
+
+def polar_axes(fig, rect, theta_hist, step=1):
+    # theta_hist is the orientation histogram (see angle_histogram)
+    theta = np.arange(len(theta_hist)) * np.radians(step)
+
+    ax = fig.add_axes(rect, polar=True)
+    ax.set_theta_zero_location("W")
+    ax.set_theta_direction(-1)
+    ax.plot(theta, theta_hist)
+
+    return ax
+
+
+def polar(theta_hist, show, fname, step=1, dpi=None):
+    # force square figure and square axes looks better for polar, IMO
+    fig = plt.figure(figsize=(8, 8))
+    polar_axes(fig, [0.1, 0.1, 0.8, 0.8], theta_hist, step)
+    fig.savefig(fname, dpi=dpi)
+
+    if show:
+        plt.show()
+
+
+def surface(xs, ys, cell=1):
+    img = heat_surface(xs, ys, WND_SIZE, WND_WEIGHT, cell)
+
+    return(normalize(img, scale=255.0))
+
+
+def scatter(xs, ys, show, fname, cell=1, dpi=None):
+    img = surface(xs, ys, cell)
+
+    nullfmt   = NullFormatter()         # no labels
+
+    # definitions for the axes
+    left, width = 0.1, 0.65
+    bottom, height = 0.1, 0.65
+    bottom_h = left_h = left + width + 0.02
+
+    rect_scatter = [left, bottom, width, height]
+    rect_histx = [left, bottom_h, width, 0.2]
+    rect_histy = [left_h, bottom, 0.2, height]
+
+    # start with a square Figure
+    fig = plt.figure(figsize=(8, 8))
+
+    axScatter = plt.axes(rect_scatter)
+    axHistx = plt.axes(rect_histx)
+    axHisty = plt.axes(rect_histy)
+
+    # no labels
+    axHistx.xaxis.set_major_formatter(nullfmt)
+    axHisty.yaxis.set_major_formatter(nullfmt)
+
+    # the scatter plot:
+    axScatter.imshow(img, cmap=cm.jet)
+
+    # now determine nice limits by hand:
+    binwidth = 5
+
+    axScatter.set_xlim((1.0, np.size(img, 0)))
+    axScatter.set_ylim((1.0, np.size(img, 1)))
+
+    axHistx.hist(xs, bins=np.arange(np.min(xs), np.max(xs) + binwidth, binwidth))
+    axHisty.hist(ys, bins=np.arange(np.min(ys), np.max(ys) + binwidth, binwidth), orientation='horizontal')
+
+    axHistx.set_xlim(axScatter.get_xlim())
+    axHisty.set_ylim(axScatter.get_ylim())
+    fig.savefig(fname, dpi=dpi)
+
+    if show:
+        plt.show()
+
+
+#
+# Raster fast path: the figures are drawn at a fixed resolution straight to
+# a canvas (no pyplot state). The surface is reduced to the pixels of its
+# axes and coloured here, and the marginal histograms are counted here and
+# drawn as one step patch, so matplotlib neither resamples a large image
+# nor draws one patch per bin.
+#
+
+HEAT_RECTS = [[0.1, 0.1, 0.65, 0.65], [0.1, 0.77, 0.65, 0.2], [0.77, 0.1, 0.2, 0.65]]
+
+
+def reduce_surface(img, size):
+    # adds up the cells of the surface in blocks so it has at most size cells a side
+    k = int(np.ceil(max(img.shape) / float(size))) if img.size > 0 else 1
+
+    if k <= 1:
+        return (img, 1)
+
+    (height, width) = img.shape
+    blocks = np.zeros((-(-height // k) * k, -(-width // k) * k))
+    blocks[:height, :width] = img
+
+    return (blocks.reshape(blocks.shape[0] // k, k, blocks.shape[1] // k, k).sum(axis=(1, 3)), k)
+
+
+def colour_surface(img):
+    # RGBA pixels of the surface with the colour map scaled to its range
+    span = float(np.max(img) - np.min(img)) if img.size > 0 else 0.0
+    img = (img - np.min(img)) / span if span > 0 else np.zeros_like(img)
+
+    return cm.jet(img, bytes=True)
+
+
+def heat_axes(fig, rects, img, extent, xhist, yhist, dpi):
+    # the heat surface (cells of extent = (left, right, bottom, top)) with its marginal
+    # histograms (counts, edges) in the given rects of the figure
+    (axHeat, axHistx, axHisty) = [fig.add_axes(r) for r in rects]
+
+    axHistx.xaxis.set_major_formatter(NullFormatter())
+    axHisty.yaxis.set_major_formatter(NullFormatter())
+
+    # a pixel of the axes shows at least one cell
+    pixels = int(min(rects[0][2] * fig.get_figwidth(), rects[0][3] * fig.get_figheight()) * dpi)
+    (small, k) = reduce_surface(img, pixels)
+    (left, right, bottom, top) = extent
+    (cw, ch) = ((right - left) / max(img.shape[1], 1), (top - bottom) / max(img.shape[0], 1))
+
+    axHeat.imshow(colour_surface(small), origin="lower", interpolation="nearest", aspect="auto",
+                  extent=(left, left + small.shape[1] * k * cw, bottom, bottom + small.shape[0] * k * ch))
+
+    axHistx.stairs(xhist[0], xhist[1], fill=True)
+    axHisty.stairs(yhist[0], yhist[1], fill=True, orientation="horizontal")
+
+    return (axHeat, axHistx, axHisty)
+
+
+def raster_figure(figsize, dpi):
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+
+    return fig
+
+
+def raster_scatter(xs, ys, fname, cell=1, dpi=100):
+    # the figure of scatter() through the fast path
+    img = surface(xs, ys, cell)
+    binwidth = 5
+
+    xhist = np.histogram(xs, bins=np.arange(np.min(xs), np.max(xs) + binwidth, binwidth))
+    yhist = np.histogram(ys, bins=np.arange(np.min(ys), np.max(ys) + binwidth, binwidth))
+
+    fig = raster_figure((8, 8), dpi)
+    (axHeat, axHistx, axHisty) = heat_axes(fig, HEAT_RECTS, img, (-0.5, img.shape[1] - 0.5, -0.5, img.shape[0] - 0.5), xhist, yhist, dpi)
+
+    axHeat.set_xlim((1.0, np.size(img, 0)))
+    axHeat.set_ylim((1.0, np.size(img, 1)))
+    axHistx.set_xlim(axHeat.get_xlim())
+    axHisty.set_ylim(axHeat.get_ylim())
+    fig.savefig(fname)
+
+
+def cohort_figure(img, extent, theta_hist, show, fname, step=1, dpi=100, title=None):
+    # the cohort surface (with its marginal histograms) and orientation histogram side by side.
+    # The marginal histograms are the sums of the surface rows and columns.
+    fig = plt.figure(figsize=(16, 8), dpi=dpi) if show else raster_figure((16, 8), dpi)
+    rects = [[r[0] / 2.0, r[1], r[2] / 2.0, r[3]] for r in HEAT_RECTS]
+
+    (left, right, bottom, top) = extent
+    xhist = (np.sum(img, axis=0), np.linspace(left, right, img.shape[1] + 1))
+    yhist = (np.sum(img, axis=1), np.linspace(bottom, top, img.shape[0] + 1))
+
+    (axHeat, axHistx, axHisty) = heat_axes(fig, rects, img, extent, xhist, yhist, dpi)
+    axHistx.set_xlim(axHeat.get_xlim())
+    axHisty.set_ylim(axHeat.get_ylim())
+
+    polar_axes(fig, [0.55, 0.1, 0.4, 0.8], theta_hist, step)
+
+    if title is not None:
+        fig.suptitle(title)
+
+    fig.savefig(fname)
+
+    if show:
+        plt.show()
@@ -0,0 +1,74 @@
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# 3rd party packages
+import cv2
+import numpy as np
+
+
+#
+# Fish geometry computed straight from a contour (as returned by
+# cv2.findContours). Nothing here allocates frame sized buffers: the blob is
+# only rasterized inside its own bounding box.
+#
+
+def blob_centroid(blob):
+    (x, y, w, h) = cv2.boundingRect(blob)
+
+    # fill the blob in its bounding box (same pixels as filling it in the frame)
+    small_mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.fillConvexPoly(small_mask, blob - np.array((x, y), dtype=blob.dtype), 255)
+
+    moments = cv2.moments(small_mask)
+
+    # shift the moments back to the frame reference
+    m00 = moments['m00']
+    m10 = moments['m10'] + x * m00
+    m01 = moments['m01'] + y * m00
+
+    return (int(m10 / m00), int(m01 / m00))
+
+
+def farthest_point(blob, p):
+    pts = blob.reshape(-1, 2)
+
+    dx = pts[:, 0].astype(np.int64) - int(p[0])
+    dy = pts[:, 1].astype(np.int64) - int(p[1])
+
+    # squared distances keep the same order (and ties) as the euclidean ones
+    return tuple(blob[np.argmax(dx * dx + dy * dy)][0])
+
+
+def blob_geometry(blob):
+    centroid = blob_centroid(blob)
+
+    # the tail is the point farthest from the centroid and the head the point farthest from the tail
+    tail = farthest_point(blob, centroid)
+    head = farthest_point(blob, tail)
+
+    return (head, centroid, tail)
@@ -29,133 +29,394 @@
 
 # python standard library
 import argparse
+import concurrent.futures
+import json
+import os
+import re
 import sys
+import time
 
 # 3rd party packages
 import cv2
-import numpy as np
 
 # fish_tracker packages
 from ftlib import *
+from fttrack import *
+from ftvideo import *
 
 # parse the script's arguments
 parser = argparse.ArgumentParser()
 parser.add_argument("-s", "--show",  action="store_true", help="show the video while processing.")
 parser.add_argument("-d", "--delay", type=int,            help="set the delay between frames (ms)", default=1)
+parser.add_argument("-w", "--workers", type=int,          help="number of worker processes (splits the video in chunks)", default=1)
+parser.add_argument("-b", "--binary", action="store_true", help="write a binary raw file")
+parser.add_argument("-r", "--resume", action="store_true", help="resume an interrupted run from its last checkpoint")
+parser.add_argument("--stride", type=int,               help="analyse one frame every N (the others are interpolated)", default=1)
+parser.add_argument("--gate", type=float,               help="skip the frames where less than this fraction of the ROI changed (ex. 0.002)", default=0.0)
+parser.add_argument("--window", type=int,               help="search the fish in a window of this size around its predicted position (pixels)", default=0)
+parser.add_argument("-m", "--metrics", type=str,         help="save the tracking metrics (per stage timings, fps, detection rate) to a JSON file", default=None)
+parser.add_argument("--metrics-lines", type=str,         help="write the metrics as JSON lines to a file ('-' for stdout) while running", default=None)
+parser.add_argument("--metrics-interval", type=float,    help="seconds between metrics lines", default=10.0)
+parser.add_argument("-q", "--quiet", action="store_true", help="don't show the progress")
+parser.add_argument("-i", "--index", action="store_true", help="index the video (true frame count and keyframes) if it's not indexed yet")
+parser.add_argument("-f", "--fish", type=int,            help="track up to this number of fish (keeping their identities)", default=1)
+parser.add_argument("--max-jump", type=float,            help="farthest a fish can be from its predicted position (pixels)", default=50.0)
+parser.add_argument("--max-missing", type=int,           help="frames a fish can be missing before its identity is released", default=25)
+parser.add_argument("-a", "--arena", nargs=3, action="append", metavar=("NAME", "MASK", "LUMTH"), help="track one more arena (instead of the mask and lumth arguments)")
+parser.add_argument("-t", "--threads", type=int,         help="number of threads analysing the arenas (default: one per arena)", default=0)
+parser.add_argument("--no-cache",     action="store_true", help="don't use the results cache")
+parser.add_argument("--follow",       action="store_true", help="track a video that is still being written (or a named pipe) as it grows")
+parser.add_argument("--idle", type=float,                 help="seconds without new frames before a followed video ends", default=10.0)
 parser.add_argument("video",         type=str,            help="input video file")
 parser.add_argument("prj",           type=str,            help="project info file")
-parser.add_argument("mask",          type=str,            help="mask coords (<left>x<top>:<width>x<height>)")
-parser.add_argument("lumth",         type=int,            help="Luminosity threshold (ex. 200)")
+parser.add_argument("mask",          type=str, nargs="?", help="mask coords (<left>x<top>:<width>x<height>)")
+parser.add_argument("lumth",         type=int, nargs="?", help="Luminosity threshold (ex. 200)")
 args = parser.parse_args()
 
-# open the video file
-capture = cv2.VideoCapture(args.video)
+if (args.arena is None) == ((args.mask is None) or (args.lumth is None)):
+    sys.stderr.write("ERROR: Give either the mask and lumth arguments or one or more arenas.\n")
+    sys.exit(1)
+
+if (args.arena is not None) and (args.show or args.resume or (args.workers > 1) or (args.stride > 1) or (args.gate > 0)):
+    sys.stderr.write("ERROR: The arena option can't be used with the show, resume, workers, stride or gate options.\n")
+    sys.exit(1)
+
+if args.show and (args.workers > 1):
+    sys.stderr.write("ERROR: The show option can't be used with more than one worker.\n")
+    sys.exit(1)
+
+if args.resume and (args.show or (args.workers > 1)):
+    sys.stderr.write("ERROR: The resume option can't be used with the show option or more than one worker.\n")
+    sys.exit(1)
+
+if (args.stride < 1) or (args.gate < 0):
+    sys.stderr.write("ERROR: The stride must be at least 1 and the gate can't be negative.\n")
+    sys.exit(1)
+
+if args.follow and (args.resume or (args.workers > 1) or args.index):
+    sys.stderr.write("ERROR: The follow option can't be used with the resume, workers or index options.\n")
+    sys.exit(1)
+
+# frames that are not analysed are interpolated and flagged in the raw file
+skipping = (args.stride > 1) or (args.gate > 0)
+
+if (args.fish > 1) and ((args.arena is not None) or args.resume or (args.workers > 1) or skipping or (args.window > 0)):
+    sys.stderr.write("ERROR: The fish option can't be used with the arena, resume, workers, stride, gate or window options.\n")
+    sys.exit(1)
+
+if args.fish < 1:
+    sys.stderr.write("ERROR: The number of fish must be at least 1.\n")
+    sys.exit(1)
+
+if skipping and (args.workers > 1):
+    sys.stderr.write("ERROR: The stride and gate options can't be used with more than one worker.\n")
+    sys.exit(1)
+
+# open the video file (a followed video has no known length)
+if args.follow:
+    capture = FollowCapture(args.video, args.idle)
+
+    if not capture.isOpened():
+        sys.stderr.write("ERROR: Can't follow the video '%s'.\n" % args.video)
+        sys.exit(1)
+else:
+    capture = cv2.VideoCapture(args.video)
+
 frame_height = capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
 frame_width  = capture.get(cv2.CAP_PROP_FRAME_WIDTH)
-frame_count  = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+frame_count  = 0 if args.follow else capture.get(cv2.CAP_PROP_FRAME_COUNT)
+frame_rate   = capture.get(cv2.CAP_PROP_FPS)
+
+# the stages are only timed when the metrics are saved
+metrics = Metrics(enabled=(args.metrics is not None) or (args.metrics_lines is not None))
+
+if args.metrics_lines is not None:
+    metrics.renderers.append(MetricsLines(sys.stdout if args.metrics_lines == "-" else open(args.metrics_lines, "a"), args.metrics_interval))
+
+
+def record_lag(pipeline):
+    # how far behind the recording the tracking is (seconds of video not analysed yet)
+    if args.follow and metrics.enabled:
+        metrics.record("lag", (capture.pending() + pipeline.backlog()) / (frame_rate if frame_rate > 0 else 30.0))
+
+# followed videos write each frame at once
+batch = 1 if args.follow else 500
+
+# track several arenas from a single decode of the video
+if args.arena is not None:
+    arenas = []
+
+    for (name, mask, lumth) in args.arena:
+        if (re.match("^[A-Za-z0-9_-]+$", name) is None) or (name in [a["name"] for a in arenas]) or (not lumth.isdigit()):
+            sys.stderr.write("ERROR: Invalid arena '%s %s %s' (names must be unique letters, digits, '_' or '-').\n" % (name, mask, lumth))
+            sys.exit(1)
+
+        arenas.append({"name": name, "mask": parse_mask(mask), "lumth": int(lumth)})
 
-# create the square mask
+    prj = Project()
+    prj.set("video", args.video)
+    prj.set("arenas", arenas)
+    prj.set("raw_format", "binary" if args.binary else "text")
+    prj.set("fps", frame_rate)
+    prj.save(args.prj)
+
+    # one tracker (with its own metrics) and one raw data file per arena
+    trackers = [Tracker(frame_width, frame_height, a["mask"], a["lumth"], Metrics(enabled=metrics.enabled)) for a in arenas]
+    detectors = [LocalSearch(t, args.window) if args.window > 0 else t for t in trackers]
+    fraws = [open_data(prj.get_raw_fname(a["name"]), "raw", args.binary) for a in arenas]
+    encode_raw = pack_raw if args.binary else format_raw
+
+    # OpenCV releases the GIL, so the arenas are analysed in parallel threads
+    pool = concurrent.futures.ThreadPoolExecutor(args.threads if args.threads > 0 else min(len(arenas), os.cpu_count() or 1))
+    pipeline = FramePipeline(capture, fraws, batch=batch, metrics=metrics)
+
+    if not args.quiet:
+        metrics.renderers.append(TimeCount(frame_count))
+
+    for (f, frame) in pipeline.frames():
+        record_lag(pipeline)
+        points = list(pool.map(lambda d: d.track(frame), detectors))
+
+        pipeline.write([encode_raw(f, p) for p in points])
+        metrics.frame(f, sum(p is not None for p in points) / float(len(points)))
+
+    pipeline.close()
+    pool.shutdown()
+
+    for fraw in fraws:
+        fraw.close()
+
+    for t in trackers:
+        metrics.merge(t.metrics)
+    metrics.finish()
+
+    if args.metrics is not None:
+        metrics.save(args.metrics)
+
+    sys.stderr.write("\n")
+    pipeline.show_stats()
+    sys.stderr.write("\nDONE\n")
+    sys.exit(0)
+
+# create the tracker for the square mask
 (mx, my, mw, mh) = parse_mask(args.mask)
-mask = np.uint8(np.zeros((int(frame_height), int(frame_width))))
-mask[my:my + mh, mx:mx + mw] = 255
+video_tracker = VideoTracker(frame_width, frame_height, (mx, my, mw, mh), args.lumth, metrics, args.window, args.stride, args.gate, args.fish, args.max_jump, args.max_missing)
+tracker = video_tracker.tracker
 
-# create the project file
-prj = Project()
-prj.set("video", args.video)
-prj.set("mask", (mx, my, mw, mh))
-prj.set("lumth", args.lumth)
-prj.save(args.prj)
+# the parameters must be the same to resume a run
+params = {"video": args.video, "mask": [mx, my, mw, mh], "lumth": args.lumth}
 
-# open the raw data file
-fraw = open(prj.get_raw_fname(), "w")
+if skipping:
+    params.update(stride=args.stride, gate=args.gate)
 
-# start the counter
-tcount = TimeCount(frame_count)
+if args.window > 0:
+    params.update(window=args.window)
 
-if args.show:
-    sys.stderr.write("\nPress 'Q' or 'q' to terminate.\n")
+if args.fish > 1:
+    params.update(fish=args.fish, max_jump=args.max_jump, max_missing=args.max_missing)
 
-last_head = None
-last_tail = None
+first = 0
 
-f = -1
-while True:
-    f += 1
+if args.resume:
+    prj = Project(args.prj)
+    checkpoint = prj.get("checkpoint")
 
-    (ret, frame) = capture.read()
+    if checkpoint is None:
+        sys.stderr.write("ERROR: The project '%s' has no checkpoint.\n" % args.prj)
+        sys.exit(1)
 
-    if(not ret):
-        break
+    if checkpoint["params"] != params:
+        sys.stderr.write("ERROR: The parameters don't match the checkpoint (%s).\n" % json.dumps(checkpoint["params"]))
+        sys.exit(1)
 
-    if(f % 100 == 0):
-        tcount.show(f)
+    if checkpoint["complete"]:
+        sys.stderr.write("Nothing to resume, the run is complete.\n")
+        sys.exit(0)
 
-    hsv = cv2.cvtColor(frame, cv2.COLOR_RGB2HSV)
-    [hue, sat, lum] = cv2.split(hsv)
+    if not os.path.isfile(prj.get_raw_fname()):
+        sys.stderr.write("ERROR: File not found '%s'.\n" % prj.get_raw_fname())
+        sys.exit(1)
 
-    (ret, lum_bin) = cv2.threshold(lum, args.lumth, 255, cv2.THRESH_BINARY_INV)
+    # carry on from the last complete row (it can't be behind the checkpoint)
+    args.binary = (prj.get("raw_format") == "binary")
+    last = truncate_data(prj.get_raw_fname())
 
-    lum_bin = np.bitwise_and(lum_bin, mask)
+    if (last is None) or (int(last[0]) < checkpoint["frame"]):
+        sys.stderr.write("ERROR: The raw file is behind the checkpoint.\n")
+        sys.exit(1)
 
-    if args.show:
-        cv2.imshow("binary", lum_bin)
+    first = int(last[0]) + 1
+
+    if int(last[1]) == 1:
+        tracker.headtail.last_head = (int(last[2]), int(last[3]))
+        tracker.headtail.last_tail = (int(last[6]), int(last[7]))
+
+        video_tracker.filler = GapFiller((int(last[0]), tuple((int(last[i]), int(last[i + 1])) for i in (2, 4, 6))))
+    else:
+        video_tracker.filler = GapFiller((int(last[0]), None))
+
+    capture.set(cv2.CAP_PROP_POS_FRAMES, first)
+    sys.stderr.write("Resuming from frame %d.\n" % first)
+else:
+    # create the project file
+    prj = Project()
+    prj.set("video", args.video)
+    prj.set("mask", (mx, my, mw, mh))
+    prj.set("lumth", args.lumth)
+    prj.set("raw_format", "binary" if args.binary else "text")
+    prj.set("fps", frame_rate)
 
-    (blobs, dummy) = cv2.findContours(lum_bin, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
-    blobs = sorted(blobs, key=lambda x: -len(x))
+    if skipping:
+        prj.set("raw_extra", RAW_EXTRA)
 
-    body_length = 0
-    txt = ""
+    if args.fish > 1:
+        prj.set("fish", args.fish)
+        prj.set("raw_extra", RAW_FISH)
 
-    if (len(blobs) > 0) and (np.size(blobs[0]) > 100):
-        blob = blobs[0]
+    prj.save(args.prj)
 
-        small_mask = np.uint8(np.ones(np.shape(frame)[:2])) * 0
-        cv2.fillConvexPoly(small_mask, blob, 255)
+# the index (if any) gives the true frame count and the keyframes
+index = None if args.follow else VideoIndex.load(prj.get_index_fname())
 
-        moments = cv2.moments(small_mask)
-        centroid = (int(moments['m10'] / moments['m00']), int(moments['m01'] / moments['m00']))
+if ((index is None) or (not index.fresh(args.video))) and args.index:
+    sys.stderr.write("Indexing the video...\n")
+    index = build_index(args.video)
+    index.save(prj.get_index_fname())
 
-        dists = list(map(lambda p: lindist(p[0], centroid), blob))
-        tail = tuple(blob[dists.index(max(dists))][0])
+if (index is not None) and index.fresh(args.video):
+    prj.set("index", prj.get_index_fname())
+    prj.save(args.prj)
 
-        dists = list(map(lambda p: lindist(p[0], tail), blob))
-        head = tuple(blob[dists.index(max(dists))][0])
+    frame_count = index.frame_count
+else:
+    index = None
 
-        # doesn't consider when the fish touches the limits
-        if(check_inside(head[0], mx, mw) and check_inside(head[1], my, mh) and check_inside(tail[0], mx, mw) and check_inside(tail[1], my, mh)):
-            body_angle = angle(head, centroid, tail)
 
-            # swap the head and the tail when needed
-            if (last_head is not None) and (lindist(head, last_head) > lindist(head, last_tail)) and (body_angle > 20):
-                (head, tail) = (tail, head)
+def save_checkpoint(state, offset, complete=False):
+    (f, last_head, last_tail) = state
 
-        txt = "%d\t1\t%d\t%d\t%d\t%d\t%d\t%d\n" % (f, head[0], head[1], centroid[0], centroid[1], tail[0], tail[1])
+    prj.set("checkpoint", {
+        "frame": int(f),
+        "offset": offset,
+        "last_head": None if last_head is None else list(map(int, last_head)),
+        "last_tail": None if last_tail is None else list(map(int, last_tail)),
+        "params": params,
+        "complete": complete
+    })
+    prj.save(args.prj)
 
-        # store the head and tail for the next frame
-        last_head = head
-        last_tail = tail
+
+# look for the same tracking in the cache (interactive and resumed runs are never cached)
+cache = None if (args.show or args.resume or args.follow or args.no_cache) else ResultCache()
+
+if cache is not None:
+    # the key depends on the video contents, not on its name
+    cache_params = {"mask": [mx, my, mw, mh], "lumth": args.lumth, "raw_format": prj.get("raw_format"), "version": TRACKER_VERSION}
+
+    if skipping:
+        cache_params.update(stride=args.stride, gate=args.gate)
+
+    if args.window > 0:
+        cache_params.update(window=args.window)
+
+    if args.fish > 1:
+        cache_params.update(fish=args.fish, max_jump=args.max_jump, max_missing=args.max_missing, raw_extra=RAW_FISH)
+    cache_key = cache.key(args.video, cache_params)
+    cache_info = dict(cache_params, video=os.path.abspath(args.video))
+
+    if cache.get(cache_key, prj.get_raw_fname()):
+        last = truncate_data(prj.get_raw_fname())
+
+        if last is not None:
+            state = (last[0], last[2:4], last[6:8]) if int(last[1]) == 1 else (last[0], None, None)
+            save_checkpoint(state, os.path.getsize(prj.get_raw_fname()), complete=True)
+
+        sys.stderr.write("Raw data found in the cache (%s).\n\nDONE\n" % cache_key)
+        sys.exit(0)
+
+# open the raw data file
+fraw = open_data(prj.get_raw_fname(), "raw", args.binary, append=args.resume, extra=RAW_EXTRA if skipping else RAW_FISH if args.fish > 1 else [])
+encode_raw = pack_raw if args.binary else format_raw
+
+
+def encode_rows(rows):
+    # rows are (frame, points), (frame, points, measured) or (frame, points, None, fish)
+    return ("" if not args.binary else b"").join(encode_raw(*row) for row in rows)
+
+# track the video chunks in parallel and merge them
+# (when the chunks don't line up, because of an inexact seek or a short read, the video is tracked in a single process)
+if args.workers > 1:
+    capture.release()
+
+    start = time.time()
+    results = track_parallel(args.video, (mx, my, mw, mh), args.lumth, frame_count, args.workers, args.window, None if index is None else index.keyframes)
+    problem = check_chunks(results)
+
+    if problem is not None:
+        sys.stderr.write("WARNING: The chunks don't line up (%s), tracking the video in a single process.\n" % problem)
+        capture = cv2.VideoCapture(args.video)
+
+if (args.workers > 1) and (problem is None):
+    state = None
+    for (f, points) in merge_chunks(results, (mx, my, mw, mh)):
+        fraw.write(encode_raw(f, points))
+        state = (f, None, None) if points is None else (f, points[0], points[2])
+        metrics.frame(f, points is not None)
+    fraw.close()
+    metrics.finish()
+
+    if args.metrics is not None:
+        metrics.save(args.metrics)
+
+    if state is not None:
+        save_checkpoint(state, os.path.getsize(prj.get_raw_fname()), complete=True)
+
+        if cache is not None:
+            cache.put(cache_key, prj.get_raw_fname(), cache_info)
+
+    show_parallel_stats(results, time.time() - start)
+    sys.stderr.write("\nDONE\n")
+    sys.exit(0)
+
+# start the counter
+if not args.quiet:
+    metrics.renderers.append(TimeCount(frame_count, first))
+
+if args.show:
+    sys.stderr.write("\nPress 'Q' or 'q' to terminate.\n")
+
+# decode, analyse and write in parallel
+# (interactive runs change the parameters and followed runs can't be resumed, so they are not checkpointed)
+pipeline = FramePipeline(capture, fraw, batch=batch, first=first, checkpoint=None if (args.show or args.follow) else save_checkpoint, stride=args.stride, metrics=metrics)
+complete = True
+
+for (f, frame) in pipeline.frames():
+    record_lag(pipeline)
+    rows = video_tracker.analyse(f, frame)
 
     if args.show:
+        cv2.imshow("binary", tracker.get_binary())
+
         cv2.putText(frame, "%d" % f, (0, 100), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255))
         cv2.rectangle(frame, (mx, my), (mx + mw, my + mh), (0, 0, 255), 1)
-        cv2.putText(frame, "%dx%d:%dx%d (%d)" % (mx, my, mw, mh, args.lumth), (mx, my+20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
+        cv2.putText(frame, "%dx%d:%dx%d (%d)" % (mx, my, mw, mh, tracker.lumth), (mx, my+20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
+
+        found = [(i, p) for (i, p) in enumerate(video_tracker.points) if p is not None]
 
-        if(txt == ""):
+        if len(found) == 0:
             cv2.line(frame, (mx, my), (mx + mw, my + mh), (0, 255, 0), 1)
             cv2.line(frame, (mx, my + mh), (mx + mw, my), (0, 255, 0), 1)
-        else:
+
+        for (i, (head, centroid, tail)) in found:
             cv2.circle(frame, centroid, 2, (0, 255, 0), -1)
             cv2.circle(frame, tail, 2, (255, 0, 0), -1)
             cv2.circle(frame, head, 2, (0, 0, 255), -1)
             cv2.line(frame, centroid, head, (0, 255, 0), 1)
 
-    if txt == "":
-        last_head = None
-        last_tail = None
-        txt = "%d\t0\t0\t0\t0\t0\t0\t0\n" % f
+            if args.fish > 1:
+                cv2.putText(frame, "%d" % (i + 1), (centroid[0] + 5, centroid[1] - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 255))
 
-    fraw.write(txt)
-    fraw.flush()
+    pipeline.write(encode_rows(rows), video_tracker.state(f))
 
     if args.show:
         cv2.imshow("video", frame)
@@ -163,11 +424,12 @@ while True:
 
         if key > 0:
             if key in QUIT_KEYS:
-                sys.stderr.write("\n\nFinal parameters: %dx%d:%dx%d %d\n" % (mx, my, mw, mh, args.lumth))
+                sys.stderr.write("\n\nFinal parameters: %dx%d:%dx%d %d\n" % (mx, my, mw, mh, tracker.lumth))
+                complete = False
                 break
 
             if key in [LUMTH_UP, LUMTH_DOWN]:
-                args.lumth = max(0, args.lumth - 1) if key == LUMTH_DOWN else min(args.lumth + 1, 255)
+                tracker.lumth = max(0, tracker.lumth - 1) if key == LUMTH_DOWN else min(tracker.lumth + 1, 255)
 
             if key in MOVE_SQUARE_KEYS.keys():
                 mx += MOVE_SQUARE_KEYS[key][0]
@@ -175,8 +437,35 @@ while True:
                 mw += MOVE_SQUARE_KEYS[key][2]
                 mh += MOVE_SQUARE_KEYS[key][3]
 
-                mask[:, :] = 0
-                mask[my:my + mh, mx:mx + mw] = 255
+                video_tracker.set_mask((mx, my, mw, mh))
+
+# the frames after the last analysed one keep its position
+if skipping and complete and (pipeline.frames_read > 0):
+    pipeline.write(encode_rows(video_tracker.finish(pipeline.frames_read)), video_tracker.state(pipeline.frames_read - 1))
+
+pipeline.close()
+metrics.finish()
+
+if args.metrics is not None:
+    metrics.save(args.metrics)
+
+if complete and (not args.show) and (prj.get("checkpoint") is not None):
+    checkpoint = prj.get("checkpoint")
+    save_checkpoint((checkpoint["frame"], checkpoint["last_head"], checkpoint["last_tail"]), fraw.tell(), complete=True)
+    fraw.close()
+
+    if cache is not None:
+        cache.put(cache_key, prj.get_raw_fname(), cache_info)
+else:
+    fraw.close()
+
+sys.stderr.write("\n")
+
+if skipping and (pipeline.frames_read > first):
+    sys.stderr.write("Analysed %d of %d frames (%.1f%%)\n" % (video_tracker.analysed, pipeline.frames_read - first, 100.0 * video_tracker.analysed / (pipeline.frames_read - first)))
+
+pipeline.show_stats()
 
-fraw.close()
+if video_tracker.detector is not tracker:
+    video_tracker.detector.show_stats()
 sys.stderr.write("\nDONE\n")
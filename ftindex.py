@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# python standard library
+import argparse
+import os
+import sys
+import time
+
+# 3rd party packages
+import cv2
+
+# fish_tracker packages
+from ftlib import *
+from ftvideo import *
+
+# parse the script's arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("-f", "--force", action="store_true", help="rebuild the index even if it's up to date")
+parser.add_argument("prj",           type=str,            help="project file.")
+args = parser.parse_args()
+
+# get the project data
+prj = Project(args.prj)
+video = prj.get("video")
+
+if not os.path.isfile(video):
+    sys.stderr.write("ERROR: Video file '%s' not found.\n" % video)
+    sys.exit(1)
+
+index = None if args.force else project_index(prj)
+
+if index is not None:
+    sys.stdout.write("The index is up to date.\n")
+else:
+    start = time.time()
+    index = build_index(video)
+
+    index.save(prj.get_index_fname())
+    prj.set("index", prj.get_index_fname())
+    prj.save(args.prj)
+
+    sys.stdout.write("Video scanned in %.1fs.\n" % (time.time() - start))
+
+capture = cv2.VideoCapture(video)
+sys.stdout.write("Frames:    %d (the container says %d)\n" % (index.frame_count, capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+capture.release()
+
+if len(index.keyframes) > 0:
+    sys.stdout.write("Keyframes: %d (at most %d frames apart)\n" % (len(index.keyframes), index.max_gap()))
+else:
+    sys.stdout.write("Keyframes: unknown (the video backend can't tell them)\n")
+
+sys.stdout.write("DONE\n")
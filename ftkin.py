@@ -0,0 +1,231 @@
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# 3rd party packages
+import numpy as np
+
+
+#
+# Kinematics and behaviour metrics of the dat rows: speed, acceleration,
+# turning rate, distance travelled, freezing and the zone of the ROI the fish
+# is in, per frame and summed over time windows. Everything is computed on
+# whole blocks of rows at once, the few values that depend on the previous
+# block are carried over. Units are the dat file units and seconds.
+#
+
+KIN_COLUMNS = ["frame", "detected", "speed", "acceleration", "turn_rate", "distance", "frozen", "zone"]
+
+
+def wrap_angle(degs):
+    # angle differences in ]-180, 180]
+    return 180.0 - np.mod(180.0 - degs, 360.0)
+
+
+def run_lengths(flags, carry):
+    #
+    # length of the run of true flags ending at each row, along the first axis
+    # (runs that started in the previous block go on from 'carry')
+    #
+    idx = np.arange(len(flags))[:, None]
+    last = np.maximum.accumulate(np.where(flags, -1, idx), axis=0)
+
+    return np.where(last < 0, idx + 1 + carry, idx - last)
+
+
+class Kinematics(object):
+    #
+    # Takes blocks of dat rows (with 'fish' rows per frame) and gives the rows
+    # of the per frame metrics (KIN_COLUMNS, in the same order as the dat
+    # rows). Speeds need the previous frame, so the first frame after a gap
+    # (or a missing frame) has no speed, acceleration nor turning rate (NaN).
+    # The fish freezes when it moves slower than 'freeze_speed' for at least
+    # 'freeze_time' seconds: the rows of the end of a block may still start a
+    # freezing bout, so they are held back until the next block.
+    #
+    def __init__(self, fps, fish=1, freeze_speed=2.0, freeze_time=1.0, window=60.0, zones=(3, 3), extent=(0.0, 0.0, 1.0, 1.0)):
+        self.fps = float(fps)
+        self.fish = fish
+        self.freeze_speed = freeze_speed
+        self.freeze_frames = max(int(round(freeze_time * fps)), 1)
+        self.window_frames = max(int(round(window * fps)), 1)
+        self.zones = zones
+        self.extent = extent
+
+        # the last row given (and its values the next rows depend on)
+        self._last = None
+        self._speed = np.full(fish, np.nan)
+        self._distance = np.zeros(fish)
+        self._run = np.zeros(fish, dtype=np.int64)
+        self._frozen = np.zeros(fish, dtype=bool)
+
+        # rows held back (frames x fish x columns)
+        self._pending = np.zeros((0, fish, 9))
+
+        # per window sums: window -> columns x fish
+        self._windows = {}
+
+    def zone(self, xs, ys):
+        # zones are numbered by rows from the bottom left corner of the ROI
+        (x0, y0, width, height) = self.extent
+        (cols, rows) = self.zones
+
+        col = np.clip(np.floor((xs - x0) / width * cols), 0, cols - 1).astype(np.int64)
+        row = np.clip(np.floor((ys - y0) / height * rows), 0, rows - 1).astype(np.int64)
+
+        return row * cols + col
+
+    def feed(self, dat, final=False):
+        dat = np.concatenate((self._pending, np.asarray(dat, dtype=np.float64).reshape(-1, self.fish, 9)))
+        n = len(dat)
+
+        (frame, detected) = (dat[:, :, 0], dat[:, :, 1] == 1)
+
+        # the previous row of each row
+        if self._last is None:
+            before = np.concatenate((np.zeros((1, self.fish, 9)), dat[:-1]))
+        else:
+            before = np.concatenate((self._last[None], dat[:-1]))
+
+        step = detected & (before[:, :, 1] == 1) & (frame - before[:, :, 0] == 1)
+
+        dist = np.where(step, np.hypot(dat[:, :, 4] - before[:, :, 4], dat[:, :, 5] - before[:, :, 5]), 0.0)
+        speed = np.where(step, dist * self.fps, np.nan)
+        acceleration = (speed - np.concatenate((self._speed[None], speed[:-1]))) * self.fps
+        turn_rate = np.where(step, wrap_angle(dat[:, :, 8] - before[:, :, 8]) * self.fps, np.nan)
+        distance = self._distance + np.cumsum(dist, axis=0)
+
+        # a row is frozen when its run of slow rows (back and forth) is long enough
+        slow = step & (speed < self.freeze_speed)
+        back = run_lengths(slow, self._run)
+        ahead = run_lengths(slow[::-1], 0)[::-1]
+        frozen = slow & (back + ahead - 1 >= self.freeze_frames)
+
+        # keep the rows that may still be part of a bout that starts here
+        done = n if final else max(n - (self.freeze_frames - 1), 0)
+
+        zone = np.where(detected, self.zone(dat[:, :, 4], dat[:, :, 5]), -1)
+
+        kin = np.stack((frame, dat[:, :, 1], speed, acceleration, turn_rate, distance, frozen, zone), axis=2)[:done]
+
+        if done > 0:
+            self._summarize(kin, dist[:done], np.concatenate((self._frozen[None], frozen[:done - 1])))
+
+            self._last = dat[done - 1]
+            self._speed = speed[done - 1]
+            self._distance = distance[done - 1]
+            self._run = back[done - 1]
+            self._frozen = frozen[done - 1]
+
+        self._pending = dat[done:]
+
+        return kin.reshape(-1, len(KIN_COLUMNS))
+
+    def finish(self):
+        # the rows still held back
+        return self.feed(np.zeros((0, 9)), final=True)
+
+    def stream(self, blocks, kin):
+        # streaming stage: passes the blocks of dat rows on, kin(rows) is called with the metrics of each one
+        for dat in blocks:
+            kin(self.feed(dat))
+
+            yield dat
+
+        kin(self.finish())
+
+    def _summarize(self, kin, dist, frozen_before):
+        (cols, rows) = self.zones
+        windows = (kin[:, :, 0] // self.window_frames).astype(np.int64)
+        first = windows[0, 0]
+        index = windows - first
+        count = index[-1, 0] + 1
+
+        speed = kin[:, :, 2]
+        turn = np.abs(kin[:, :, 4])
+        frozen = kin[:, :, 6] == 1
+        detected = kin[:, :, 1] == 1
+
+        # columns: frames, detected, distance, speed sum, speed count, max speed, turn sum, turn count, frozen frames, bouts, zone frames...
+        sums = np.zeros((count, 10 + cols * rows, self.fish))
+        key = (index * self.fish + np.arange(self.fish)).ravel()
+
+        def total(values, keys=key, size=count * self.fish):
+            return np.bincount(keys, weights=np.ravel(values), minlength=size)
+
+        sums[:, 0] = total(np.ones(index.shape)).reshape(count, self.fish)
+        sums[:, 1] = total(detected).reshape(count, self.fish)
+        sums[:, 2] = total(dist).reshape(count, self.fish)
+        sums[:, 3] = total(np.nan_to_num(speed)).reshape(count, self.fish)
+        sums[:, 4] = total(~np.isnan(speed)).reshape(count, self.fish)
+        sums[:, 6] = total(np.nan_to_num(turn)).reshape(count, self.fish)
+        sums[:, 7] = total(~np.isnan(turn)).reshape(count, self.fish)
+        sums[:, 8] = total(frozen).reshape(count, self.fish)
+        sums[:, 9] = total(frozen & ~frozen_before).reshape(count, self.fish)
+
+        # the rows of each fish are in window order
+        for f in range(self.fish):
+            starts = np.flatnonzero(np.diff(index[:, f], prepend=-1))
+            sums[index[starts, f], 5, f] = np.maximum.reduceat(np.nan_to_num(speed[:, f]), starts)
+
+        zone = kin[:, :, 7].astype(np.int64)
+        zones = total(np.ones(np.count_nonzero(detected)), key.reshape(index.shape)[detected] * cols * rows + zone[detected], count * self.fish * cols * rows)
+        sums[:, 10:] = zones.reshape(count, self.fish, cols * rows).transpose(0, 2, 1)
+
+        for i in range(count):
+            w = first + i
+
+            if w in self._windows:
+                old = self._windows[w]
+                top = np.maximum(old[5], sums[i, 5])
+                old += sums[i]
+                old[5] = top
+            else:
+                self._windows[w] = sums[i]
+
+    def summary(self):
+        #
+        # rows of the per window summary (see summary_columns): times in
+        # seconds, distances in the dat units and speeds per second
+        #
+        out = []
+
+        for w in sorted(self._windows):
+            s = self._windows[w]
+
+            for f in range(self.fish):
+                out.append([w * self.window_frames, f, s[0, f] / self.fps, s[1, f] / self.fps, s[2, f],
+                    s[3, f] / s[4, f] if s[4, f] > 0 else np.nan, s[5, f],
+                    s[6, f] / s[7, f] if s[7, f] > 0 else np.nan, s[8, f] / self.fps, s[9, f]] + list(s[10:, f] / self.fps))
+
+        return np.array(out, dtype=np.float64).reshape(-1, len(self.summary_columns()))
+
+    def summary_columns(self):
+        (cols, rows) = self.zones
+
+        return ["first_frame", "fish", "time", "detected_time", "distance", "mean_speed", "max_speed", "mean_turn_rate", "frozen_time", "freezing_bouts"] + \
+            ["zone_%d" % z for z in range(cols * rows)]
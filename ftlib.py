@@ -25,14 +25,27 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import bisect
+import collections
+import hashlib
+import itertools
 import json
+import math
+import mmap
 import os
 import re
+import shutil
+import struct
 import sys
+import threading
 import time
 
 import numpy as np
 
+from ftagg import *
+from ftkin import *
+from ftorient import *
+
 
 MOVE_SQUARE_KEYS = {
     65363:   (1, 0, 0, 0),      # move square left (arrow left)
@@ -58,17 +71,200 @@ QUIT_KEYS = [113, 65617]
 LUMTH_UP = 108
 LUMTH_DOWN = 65612
 
+# binary data files: magic, header size and a JSON description of the columns followed by fixed width rows
+DATA_MAGIC = b"FTDATA01"
+DATA_ALIGN = 64
+
+DATA_COLUMNS = {
+    "raw": ("<i4", ["frame", "detected", "head_x", "head_y", "centroid_x", "centroid_y", "tail_x", "tail_y"]),
+    "dat": ("<f8", ["frame", "detected", "head_x", "head_y", "centroid_x", "centroid_y", "tail_x", "tail_y", "theta"]),
+    "kin": ("<f8", KIN_COLUMNS)
+}
+
+# optional raw columns: 1 if the frame was analysed, 0 if it was interpolated
+RAW_EXTRA = ["measured"]
+
+# optional raw column of the multi-fish runs: the identity of the fish (1 to the number of fish)
+RAW_FISH = ["fish"]
+
+# timings histograms: log scale bins from 0.1us to 100s (10 per decade)
+METRICS_BINS = 90
+METRICS_MIN = -7
+
+
+class Metrics(object):
+    #
+    # Per stage timings (as log histograms), frame rate and detection rate.
+    # Stages are timed with clock() and lap():
+    #
+    #     t = metrics.clock()
+    #     ...
+    #     t = metrics.lap("threshold", t)
+    #
+    # When disabled both are no-ops, so the instrumented code costs almost
+    # nothing. The renderers are told about every frame (see TimeCount).
+    # The stages may be recorded by other threads (the decoder and the writer
+    # of the pipeline) while a renderer takes a snapshot, so they're locked.
+    #
+    def __init__(self, enabled=True, renderers=[]):
+        self.enabled = enabled
+        self.renderers = list(renderers)
+
+        self.frames = 0
+        self.detected = 0
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+        if not enabled:
+            self.clock = self._no_clock
+            self.lap = self._no_lap
+
+    def _no_clock(self):
+        return 0
+
+    def _no_lap(self, stage, start):
+        return 0
+
+    def clock(self):
+        return time.perf_counter()
+
+    def lap(self, stage, start):
+        now = time.perf_counter()
+        self.record(stage, now - start)
+        return now
+
+    def record(self, stage, seconds):
+        i = int((math.log10(seconds) - METRICS_MIN) * 10) if seconds > 0 else 0
+
+        with self._lock:
+            if stage not in self.stages:
+                # count, total, max and histogram
+                self.stages[stage] = [0, 0.0, 0.0, [0] * METRICS_BINS]
+
+            s = self.stages[stage]
+            s[0] += 1
+            s[1] += seconds
+            s[2] = max(s[2], seconds)
+            s[3][min(max(i, 0), METRICS_BINS - 1)] += 1
+
+    def merge(self, other):
+        # adds the stage timings recorded by another instance (e.g. in another thread)
+        with other._lock:
+            stages = [(stage, list(s[:3]) + [list(s[3])]) for (stage, s) in other.stages.items()]
+
+        with self._lock:
+            for (stage, (count, total, top, hist)) in stages:
+                if stage not in self.stages:
+                    self.stages[stage] = [0, 0.0, 0.0, [0] * METRICS_BINS]
+
+                s = self.stages[stage]
+                s[0] += count
+                s[1] += total
+                s[2] = max(s[2], top)
+                s[3] = [a + b for (a, b) in zip(s[3], hist)]
+
+    def frame(self, f, detected):
+        self.frames += 1
+        self.detected += detected
+
+        for r in self.renderers:
+            r.update(self, f)
+
+    def finish(self):
+        for r in self.renderers:
+            r.finish(self)
+
+    def percentile(self, stage, p):
+        # upper limit of the histogram bin holding the percentile
+        (count, total, top, hist) = self.stages[stage]
+
+        acc = 0
+        for (i, n) in enumerate(hist):
+            acc += n
+
+            if acc >= p * count / 100.0:
+                return min(10 ** ((i + 1) / 10.0 + METRICS_MIN), top)
+
+        return top
+
+    def snapshot(self):
+        elapsed = time.time() - self._start
+
+        stages = {}
+        with self._lock:
+            for (name, (count, total, top, hist)) in list(self.stages.items()):
+                stages[name] = {
+                    "count": count,
+                    "total": total,
+                    "mean": total / max(count, 1),
+                    "p50": self.percentile(name, 50),
+                    "p90": self.percentile(name, 90),
+                    "p99": self.percentile(name, 99),
+                    "max": top
+                }
+
+        return {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "elapsed": elapsed,
+            "frames": self.frames,
+            "fps": self.frames / elapsed if elapsed > 0 else 0.0,
+            "detection_rate": float(self.detected) / max(self.frames, 1),
+            "stages": stages
+        }
+
+    def save(self, fname):
+        json.dump(self.snapshot(), open(fname, "w"), indent=4)
+
+
+class MetricsLines(object):
+    #
+    # Metrics renderer: a JSON line with a snapshot every 'interval' seconds (and a final one)
+    #
+    def __init__(self, fout, interval=10.0):
+        self._fout = fout
+        self._interval = interval
+        self._next = time.time() + interval
+
+    def _write(self, metrics, final):
+        self._fout.write(json.dumps(dict(metrics.snapshot(), final=final)) + "\n")
+        self._fout.flush()
+
+    def update(self, metrics, f):
+        if time.time() >= self._next:
+            self._write(metrics, False)
+            self._next = time.time() + self._interval
+
+    def finish(self, metrics):
+        self._write(metrics, True)
+
+
 class TimeCount(object):
-    def __init__(self, total):
+    #
+    # Progress on the console (frame, elapsed and expected time). It can also
+    # be used as a Metrics renderer.
+    #
+    def __init__(self, total, first=0, step=100):
         self._total = total
+        self._first = first
+        self._step = step
+        self._shown = first - step
         self._start = time.time()
 
+    def update(self, metrics, f):
+        if f - self._shown >= self._step:
+            self.show(f)
+            self._shown = f - f % self._step
+
+    def finish(self, metrics):
+        pass
+
     def show(self, count):
         if count == 0:
             count += 1
 
         deltat = time.time() - self._start
-        stept = deltat / float(count)
+        stept = deltat / float(max(count - self._first, 1))
         finalt = float(self._total - count) * stept
 
         back = "\b" * 75
@@ -76,6 +272,12 @@ class TimeCount(object):
         deltats = time.strftime("%H:%M:%S", time.gmtime(deltat))
         finalts = time.strftime("%H:%M:%S", time.gmtime(finalt))
 
+        # the length of a video that is still being recorded is not known
+        if self._total <= 0:
+            sys.stderr.write("%sFrame: %5d, Ellap: %s" % (back, count, deltats))
+            sys.stderr.flush()
+            return
+
         sys.stderr.write("%sFrame: %5d/%5d (%5.2f%%), Ellap: %s, Expec: %s" % (back, count, self._total, (float(count) / float(self._total)) * 100.0, deltats, finalts))
         sys.stderr.flush()
 
@@ -94,16 +296,34 @@ class Project(object):
     def get(self, key):
         return self._data.get(key, None)
 
-    def get_raw_fname(self):
-        return self._fname + ".raw"
+    def get_raw_fname(self, arena=None):
+        return self._fname + ("" if arena is None else "." + arena) + ".raw"
+
+    def get_dat_fname(self, arena=None):
+        return self._fname + ("" if arena is None else "." + arena) + ".dat"
+
+    def get_arenas(self):
+        # (name, mask, lumth) of each arena, single arena projects have one with no name
+        if self.get("arenas") is None:
+            return [(None, self.get("mask"), self.get("lumth"))]
 
-    def get_dat_fname(self):
-        return self._fname + ".dat"
+        return [(a["name"], a["mask"], a["lumth"]) for a in self.get("arenas")]
+
+    def get_kin_fname(self, arena=None):
+        return self._fname + ("" if arena is None else "." + arena) + ".kin"
+
+    def get_sum_fname(self, arena=None):
+        return self._fname + ("" if arena is None else "." + arena) + ".sum"
+
+    def get_index_fname(self):
+        return self._fname + ".idx"
 
     def save(self, fname):
         self._fname = fname
 
-        open(fname, "w").write(json.dumps(self._data, indent=4))
+        # write a new file and replace the old one, so a crash never leaves a broken project
+        open(fname + ".tmp", "w").write(json.dumps(self._data, indent=4))
+        os.replace(fname + ".tmp", fname)
 
     def load(self, fname):
         try:
@@ -119,6 +339,233 @@ class Project(object):
             sys.exit(1)
 
 
+class ResultCache(object):
+    #
+    # On disk cache of raw data files, keyed on the video fingerprint and the tracking parameters.
+    # Each entry is a copy of the raw file plus a JSON file with its description. When the cache
+    # grows over its size limit the least recently used entries are removed.
+    #
+    def __init__(self, path=None, max_size=None):
+        if path is None:
+            path = os.environ.get("FT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "fishtracker"))
+
+        if max_size is None:
+            max_size = int(float(os.environ.get("FT_CACHE_SIZE", 10 * 1024)) * 1024 * 1024)
+
+        self.path = path
+        self.max_size = max_size
+
+    def key(self, video, params):
+        info = {"video": video_fingerprint(video), "params": params}
+        return hashlib.sha1(json.dumps(info, sort_keys=True).encode("ascii")).hexdigest()
+
+    def _fname(self, key, ext):
+        return os.path.join(self.path, key + ext)
+
+    def _save_info(self, key, info):
+        fname = self._fname(key, ".json")
+
+        open(fname + ".tmp", "w").write(json.dumps(info, indent=4))
+        os.replace(fname + ".tmp", fname)
+
+    def get(self, key, fname):
+        try:
+            info = json.loads(open(self._fname(key, ".json")).read())
+            shutil.copyfile(self._fname(key, ".raw"), fname)
+        except (IOError, ValueError):
+            return False
+
+        info["last_used"] = time.time()
+        info["hits"] = info.get("hits", 0) + 1
+        self._save_info(key, info)
+
+        return True
+
+    def put(self, key, fname, info):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # copy first and describe after, so a half copied entry is never used
+        shutil.copyfile(fname, self._fname(key, ".raw.tmp"))
+        os.replace(self._fname(key, ".raw.tmp"), self._fname(key, ".raw"))
+
+        info = dict(info, key=key, size=os.path.getsize(fname), created=time.time(), last_used=time.time(), hits=0)
+        self._save_info(key, info)
+
+        self.prune(self.max_size)
+
+    def remove(self, key):
+        for ext in [".json", ".raw"]:
+            if os.path.isfile(self._fname(key, ext)):
+                os.remove(self._fname(key, ext))
+
+    def entries(self):
+        if not os.path.isdir(self.path):
+            return []
+
+        ret = []
+        for fname in sorted(os.listdir(self.path)):
+            if not fname.endswith(".json"):
+                continue
+
+            try:
+                ret.append(json.loads(open(os.path.join(self.path, fname)).read()))
+            except (IOError, ValueError):
+                continue
+
+        # most recently used first
+        return sorted(ret, key=lambda e: -e["last_used"])
+
+    def prune(self, max_size):
+        removed = []
+        total = 0
+
+        for e in self.entries():
+            total += e["size"]
+
+            if total > max_size:
+                self.remove(e["key"])
+                removed.append(e)
+
+        return removed
+
+
+class TextRows(object):
+    #
+    # Rows of a text data file read on demand. One pass counting the line
+    # breaks (no parsing) finds the number of rows and where the lines start
+    # every 'block' bytes; a row is found from the closest of these offsets
+    # and read in a chunk of 'chunk' rows (the last chunks are kept).
+    #
+    def __init__(self, fname, block=65536, chunk=1024, keep=8):
+        self._fin = open(fname, "rb")
+        self._chunk = chunk
+        self._keep = keep
+        self._chunks = collections.OrderedDict()
+
+        size = os.fstat(self._fin.fileno()).st_size
+        self._mm = mmap.mmap(self._fin.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+
+        # line number and offset of the first line starting in each block
+        self._lines = [0]
+        self._offsets = [0]
+
+        count = 0
+        pos = 0
+        while pos < size:
+            count += self._mm[pos:pos + block].count(b"\n")
+            pos = min(pos + block, size)
+
+            nl = self._mm.find(b"\n", pos - 1)
+
+            if (pos >= size) or (nl < 0):
+                break
+
+            self._lines.append(count + (1 if nl >= pos else 0))
+            self._offsets.append(nl + 1)
+
+        # a partially written last line is not a row
+        self._length = count
+
+    def __len__(self):
+        return self._length
+
+    def _find(self, row):
+        # offset of the start of a row
+        i = bisect.bisect_right(self._lines, row) - 1
+        offset = self._offsets[i]
+
+        for n in range(row - self._lines[i]):
+            offset = self._mm.find(b"\n", offset) + 1
+
+        return offset
+
+    def _read(self, first):
+        start = self._find(first)
+        end = start
+
+        for n in range(min(self._chunk, self._length - first)):
+            end = self._mm.find(b"\n", end) + 1
+
+        lines = self._mm[start:end].decode("ascii")
+        ncols = len(lines[:lines.find("\n")].split("\t"))
+
+        return np.array(lines.split(), dtype=np.float64).reshape(-1, ncols)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self._length
+
+        if (row < 0) or (row >= self._length):
+            raise IndexError("row %d out of range" % row)
+
+        first = row - row % self._chunk
+
+        if first not in self._chunks:
+            self._chunks[first] = self._read(first)
+
+            if len(self._chunks) > self._keep:
+                self._chunks.popitem(last=False)
+
+        self._chunks.move_to_end(first)
+
+        return self._chunks[first][row - first]
+
+
+class AppendedRows(object):
+    #
+    # Iterates over the complete rows of a data file from a byte offset (0
+    # for the start) in blocks of rows. The file may still be growing: a
+    # partially written last row is left for later. 'offset' follows the
+    # rows given so far, so the next run can carry on from there.
+    #
+    def __init__(self, fname, offset=0, rows=100000):
+        self.fname = fname
+        self.offset = offset
+        self.rows = rows
+
+    def __iter__(self):
+        header = read_header(self.fname)
+        fin = open(self.fname, "rb")
+
+        if header is not None:
+            (info, size) = header
+            dtype = np.dtype(info["dtype"])
+            ncols = len(info["columns"])
+            rowsize = dtype.itemsize * ncols
+
+            self.offset = max(self.offset, size)
+            end = self.offset + (os.fstat(fin.fileno()).st_size - self.offset) // rowsize * rowsize
+            fin.seek(self.offset)
+
+            while self.offset < end:
+                data = fin.read(min(self.rows * rowsize, end - self.offset))
+                self.offset += len(data)
+
+                yield np.frombuffer(data, dtype=dtype).reshape(-1, ncols).astype(np.float64)
+
+            fin.close()
+            return
+
+        fin.seek(self.offset)
+
+        while True:
+            lines = list(itertools.islice(fin, self.rows))
+
+            if (len(lines) > 0) and (not lines[-1].endswith(b"\n")):
+                lines.pop()
+
+            if len(lines) == 0:
+                break
+
+            self.offset += sum(map(len, lines))
+            ncols = len(lines[0].split(b"\t"))
+
+            yield np.array(b"".join(lines).split(), dtype=np.float64).reshape(-1, ncols)
+
+        fin.close()
+
+
 def angle(p1, p2, p3):
     (u, v, w) = np.array(p1), np.array(p2), np.array(p3)
 
@@ -131,10 +578,145 @@ def check_inside(c, f, t):
     return((c - f > 1) and (c - f < (t - 1)))
 
 
+def data_header(kind, extra=[]):
+    (dtype, columns) = DATA_COLUMNS[kind]
+    columns = columns + extra
+
+    info = json.dumps({"kind": kind, "dtype": dtype, "columns": columns}).encode("ascii")
+    size = len(DATA_MAGIC) + 4 + len(info)
+    size += (DATA_ALIGN - size % DATA_ALIGN) % DATA_ALIGN
+
+    return (DATA_MAGIC + struct.pack("<I", size) + info).ljust(size, b" ")
+
+
+def format_dat(row):
+    if row[1] == 0:
+        # if the row has no data fill up with zeros
+        return "%d\t0\t0\t0\t0\t0\t0\t0\t0\n" % row[0]
+
+    row1 = list(map(lambda x: "%d" % int(x), row[:2]))
+    row2 = list(map(lambda x: "%5.2f" % x, row[2:]))
+    return "%s\n" % "\t".join(row1 + row2)
+
+
+def format_dat_rows(rows):
+    #
+    # formats a block of dat rows at once (same output as format_dat)
+    #
+    if len(rows) == 0:
+        return ""
+
+    detected = rows[:, 1] != 0
+
+    # rows with no data only take the frame number
+    values = rows[np.column_stack([np.ones(len(rows), dtype=bool)] + [detected] * (rows.shape[1] - 1))]
+
+    fmt1 = "%d\t%d" + "\t%5.2f" * (rows.shape[1] - 2) + "\n"
+    fmt0 = "%d" + "\t0" * (rows.shape[1] - 1) + "\n"
+
+    return "".join(np.where(detected, fmt1, fmt0)) % tuple(values.tolist())
+
+
+def format_kin_rows(rows):
+    # formats a block of kinematics rows (undefined values are written as nan)
+    return ("%d\t%d\t%.3f\t%.3f\t%.3f\t%.3f\t%d\t%d\n" * len(rows)) % tuple(np.ravel(rows).tolist())
+
+
+def format_raw(f, points, measured=None, fish=None):
+    # the measured column (1 if the frame was analysed, 0 if interpolated) is only there when frames are skipped
+    # and the fish column when several fish are tracked
+    extra = ("" if measured is None else "\t%d" % measured) + ("" if fish is None else "\t%d" % fish)
+
+    if points is None:
+        return "%d\t0\t0\t0\t0\t0\t0\t0%s\n" % (f, extra)
+
+    (head, centroid, tail) = points
+    return "%d\t1\t%d\t%d\t%d\t%d\t%d\t%d%s\n" % (f, head[0], head[1], centroid[0], centroid[1], tail[0], tail[1], extra)
+
+
+def is_binary(fname):
+    return read_header(fname) is not None
+
+
+def iter_data(fname, rows=100000):
+    #
+    # reads a data file in blocks of rows, so memory doesn't depend on the file size
+    #
+    try:
+        header = read_header(fname)
+
+        if header is not None:
+            data = read_binary(fname, header)
+
+            for i in range(0, len(data), rows):
+                yield np.array(data[i:i + rows], dtype=np.float64)
+            return
+
+        fin = open(fname)
+    except IOError:
+        sys.stderr.write("ERROR: File not found '%s'." % fname)
+        sys.exit(1)
+
+    while True:
+        lines = list(itertools.islice(fin, rows))
+
+        if len(lines) == 0:
+            break
+
+        ncols = len(lines[0].split("\t"))
+        yield np.array("".join(lines).split(), dtype=np.float64).reshape(-1, ncols)
+
+    fin.close()
+
+
 def lindist(p1, p2):
     return np.linalg.norm((p1[0] - p2[0], p1[1] - p2[1]))
 
 
+def open_data(fname, kind, binary, append=False, extra=[]):
+    if not binary:
+        return open(fname, "a" if append else "w")
+
+    if append:
+        return open(fname, "ab")
+
+    fout = open(fname, "wb")
+    fout.write(data_header(kind, extra))
+
+    return fout
+
+
+def open_rows(fname):
+    #
+    # random access to the rows of a data file without reading it all: binary
+    # files are memory mapped and text files are read around the rows used
+    #
+    try:
+        header = read_header(fname)
+
+        if header is not None:
+            return read_binary(fname, header)
+
+        return TextRows(fname)
+    except IOError:
+        sys.stderr.write("ERROR: File not found '%s'." % fname)
+        sys.exit(1)
+
+
+def pack_raw(f, points, measured=None, fish=None):
+    extra = (b"" if measured is None else struct.pack("<i", measured)) + (b"" if fish is None else struct.pack("<i", fish))
+
+    if points is None:
+        return struct.pack("<8i", f, 0, 0, 0, 0, 0, 0, 0) + extra
+
+    (head, centroid, tail) = points
+    return struct.pack("<8i", f, 1, head[0], head[1], centroid[0], centroid[1], tail[0], tail[1]) + extra
+
+
+def pack_rows(kind, rows):
+    return np.ascontiguousarray(rows, dtype=DATA_COLUMNS[kind][0]).tobytes()
+
+
 def parse_mask(mask):
     pat = "^(\d+)x(\d+):(\d+)x(\d+)$"
 
@@ -147,11 +729,212 @@ def parse_mask(mask):
     return list(map(int, m.groups()))
 
 
+def process_blocks(blocks, mask, xscale=1.0, yscale=1.0, hshift=0.0, vshift=0.0):
+    # streaming stage: blocks of raw rows in, blocks of dat rows out
+    for raw in blocks:
+        yield process_raw(raw, mask, xscale, yscale, hshift, vshift)
+
+
+def process_raw(raw, mask, xscale=1.0, yscale=1.0, hshift=0.0, vshift=0.0):
+    #
+    # turns raw rows into dat rows: coordinates in the ROI reference (scaled,
+    # shifted and with the Y axis pointing up) plus the orientation angle
+    #
+    (mx, my, mw, mh) = mask
+
+    XX = mx
+    YY = my + mh
+
+    dat = np.zeros((len(raw), 9), dtype=np.float64)
+    dat[:, :2] = raw[:, :2]
+
+    dat[:, 2:8:2] = ((raw[:, 2:8:2] - XX) * xscale) + hshift    # scale and shift the X coords
+    dat[:, 3:8:2] = ((YY - raw[:, 3:8:2]) * yscale) + vshift    # scale, swap and shift the Y coords
+
+    # compute the angles
+    dat[:, 8] = -np.degrees(np.arctan2(dat[:, 5] - dat[:, 3], dat[:, 4] - dat[:, 2]))
+
+    # rows with no data are filled up with zeros
+    dat[dat[:, 1] == 0, 2:] = 0
+
+    return dat
+
+
+def raw_record(f, points, measured=None, fish=None):
+    # a raw row as numbers (same values as format_raw)
+    extra = ([] if measured is None else [measured]) + ([] if fish is None else [fish])
+
+    if points is None:
+        return [f, 0, 0, 0, 0, 0, 0, 0] + extra
+
+    (head, centroid, tail) = points
+    return [f, 1, head[0], head[1], centroid[0], centroid[1], tail[0], tail[1]] + extra
+
+
+def read_binary(fname, header):
+    (info, offset) = header
+
+    dtype = np.dtype(info["dtype"])
+    ncols = len(info["columns"])
+
+    # ignore a partially written last row
+    nrows = (os.path.getsize(fname) - offset) // (dtype.itemsize * ncols)
+
+    if nrows == 0:
+        return np.zeros((0, ncols), dtype=dtype)
+
+    return np.memmap(fname, dtype=dtype, mode="r", offset=offset, shape=(nrows, ncols))
+
+
 def read_data(fname):
     try:
+        header = read_header(fname)
+
+        if header is not None:
+            return read_binary(fname, header)
+
         ret = np.array(list(map(lambda s: list(map(float, s.split("\t"))), open(fname).read().strip().split("\n"))))
     except IOError:
         sys.stderr.write("ERROR: File not found '%s'." % fname)
         sys.exit(1)
 
     return ret
+
+
+def read_header(fname):
+    fin = open(fname, "rb")
+    magic = fin.read(len(DATA_MAGIC) + 4)
+
+    if (len(magic) < len(DATA_MAGIC) + 4) or (magic[:len(DATA_MAGIC)] != DATA_MAGIC):
+        fin.close()
+        return None
+
+    (size, ) = struct.unpack("<I", magic[len(DATA_MAGIC):])
+    info = json.loads(fin.read(size - len(magic)).decode("ascii"))
+    fin.close()
+
+    return (info, size)
+
+
+def record_blocks(records, rows=100000):
+    #
+    # streaming stage: groups the tracker records, (frame, points),
+    # (frame, points, measured) or (frame, points, None, fish), into blocks
+    # of raw rows like iter_data's
+    #
+    block = []
+
+    for record in records:
+        block.append(raw_record(*record))
+
+        if len(block) >= rows:
+            yield np.array(block, dtype=np.float64)
+            block = []
+
+    if len(block) > 0:
+        yield np.array(block, dtype=np.float64)
+
+
+def truncate_data(fname):
+    #
+    # drops a partially written last row and returns the last complete one (None if there's none)
+    #
+    header = read_header(fname)
+
+    if header is not None:
+        (info, offset) = header
+        rowsize = np.dtype(info["dtype"]).itemsize * len(info["columns"])
+        nrows = (os.path.getsize(fname) - offset) // rowsize
+
+        fout = open(fname, "rb+")
+        fout.truncate(offset + nrows * rowsize)
+        fout.close()
+
+        if nrows == 0:
+            return None
+
+        return read_binary(fname, header)[-1].tolist()
+
+    fout = open(fname, "rb+")
+    end = fout.seek(0, os.SEEK_END)
+
+    # look backwards for the end of the last complete line
+    while end > 0:
+        start = max(end - 4096, 0)
+        fout.seek(start)
+        i = fout.read(end - start).rfind(b"\n")
+
+        if i >= 0:
+            end = start + i + 1
+            break
+
+        end = start
+
+    fout.truncate(end)
+
+    if end == 0:
+        fout.close()
+        return None
+
+    # the lines are short, the last one is surely in the last block
+    start = max(end - 4096, 0)
+    fout.seek(start)
+    line = fout.read(end - start).split(b"\n")[-2]
+    fout.close()
+
+    return list(map(float, line.decode("ascii").split("\t")))
+
+
+def video_fingerprint(fname, blocks=16, block_size=65536):
+    #
+    # a quick fingerprint of a video: its size, modification time and a hash of some blocks spread over the file
+    #
+    stat = os.stat(fname)
+
+    sha1 = hashlib.sha1()
+    fin = open(fname, "rb")
+
+    for i in range(blocks):
+        fin.seek(max(stat.st_size - block_size, 0) * i // max(blocks - 1, 1))
+        sha1.update(fin.read(block_size))
+
+    fin.close()
+
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sample": sha1.hexdigest()}
+
+
+def write_blocks(blocks, fout, binary):
+    # streaming stage: writes the blocks of dat rows to an open dat file and passes them on
+    for dat in blocks:
+        fout.write(pack_rows("dat", dat) if binary else format_dat_rows(dat))
+
+        yield dat
+
+
+def write_data(fname, data, kind, binary, extra=None):
+    # raw files of runs that skipped frames have the measured column (and the
+    # ones of multi-fish runs the fish column, see the project's raw_extra)
+    if extra is None:
+        extra = RAW_EXTRA[:np.shape(data)[1] - len(DATA_COLUMNS[kind][1])] if kind == "raw" else []
+
+    fout = open_data(fname, kind, binary, extra=extra)
+
+    if binary:
+        fout.write(pack_rows(kind, data))
+    elif kind == "raw":
+        fmt = "\t".join(["%d"] * np.shape(data)[1]) + "\n"
+        fout.write("".join(map(lambda r: fmt % tuple(r), data)))
+    else:
+        fout.write("".join(map(format_dat, data)))
+
+    fout.close()
+
+
+def write_records(records, fout, binary):
+    # streaming stage: writes the tracker records to an open raw file (as ftget.py does) and passes them on
+    encode = pack_raw if binary else format_raw
+
+    for record in records:
+        fout.write(encode(*record))
+
+        yield record
@@ -0,0 +1,255 @@
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# 3rd party packages
+import numpy as np
+
+
+#
+# Head/tail orientation of whole trajectories. Each detected frame of a fish
+# is in one of two states: the head and the tail as found by the tracker, or
+# swapped. The states of a segment (the frames between two frames with no
+# detection) are chosen together by minimising the sum of:
+# - the continuity cost: how far the head and the tail moved since the
+#   previous frame (so the head doesn't jump to the tail's place),
+# - the velocity cost: how much the fish would be swimming backwards (the
+#   body against the direction the centroid moves, weighted by the speed).
+# The optimisation is a Viterbi pass. With two states only the difference
+# between the best costs of the states matters, and each frame maps the
+# previous difference to the new one with a clipped affine function: these
+# functions (and the backtracking maps of the states) compose into functions
+# of the same kind, so both passes are scans over whole arrays (see
+# segmented_scan) instead of loops over the frames.
+#
+
+def segmented_scan(items, starts, combine, chunk=32):
+    #
+    # inclusive scan of a tuple of arrays along the first axis, starting over
+    # at the starts: out[i] = combine(...combine(items[s], items[s + 1])...,
+    # items[i]) where s is the last start <= i (the first item is a start).
+    # The arrays are cut in chunks, scanned by a loop over the positions in
+    # the chunks (all the chunks at once), the chunks are then scanned by
+    # doubling and each one gets the result of the chunks before it.
+    #
+    n = len(starts)
+    if n == 0:
+        return [np.array(x) for x in items]
+
+    m = -(-n // chunk)
+    pad = m * chunk - n
+
+    # the padding items are starts, so they don't change the others
+    out = [np.concatenate((x, np.repeat(x[-1:], pad))).reshape(m, chunk) for x in items]
+    reset = np.concatenate((starts, np.ones(pad, dtype=bool))).reshape(m, chunk)
+    reset[0, 0] = True
+
+    for j in range(1, chunk):
+        new = combine([x[:, j - 1] for x in out], [x[:, j] for x in out])
+
+        for (x, y) in zip(out, new):
+            x[:, j] = np.where(reset[:, j], x[:, j], y)
+
+    reset = np.logical_or.accumulate(reset, axis=1)
+
+    # the scan of the chunks (the first one always has a start)
+    done = reset[:, -1].copy()
+    totals = [x[:, -1].copy() for x in out]
+    step = 1
+
+    while not np.all(done):
+        new = combine([x[:-step] for x in totals], [x[step:] for x in totals])
+        totals = [np.concatenate((x[:step], np.where(done[step:], x[step:], y))) for (x, y) in zip(totals, new)]
+
+        done[step:] |= done[:-step].copy()
+        step *= 2
+
+    carry = [np.concatenate((x[:1], x[:-1]))[:, None] for x in totals]
+    new = combine(carry, out)
+
+    return [np.where(reset, x, y).ravel()[:n] for (x, y) in zip(out, new)]
+
+
+def compose_clips(f, g):
+    #
+    # g(f(x)) for functions x -> c + clip(s * x, lo, hi) given as (s, c, lo, hi)
+    # with s = 1 or -1 (f is applied first)
+    #
+    (fs, fc, flo, fhi) = f
+    (gs, gc, glo, ghi) = g
+
+    shift = gs * fc
+    (lo, hi) = (np.where(gs > 0, flo, -fhi), np.where(gs > 0, fhi, -flo))
+
+    return (gs * fs, gc + shift, np.clip(lo, glo - shift, ghi - shift), np.clip(hi, glo - shift, ghi - shift))
+
+
+def compose_maps(f, g):
+    # g(f(s)) for maps of the states given as (f(0), f(1)) (f is applied first)
+    (f0, f1) = f
+    (g0, g1) = g
+
+    return (np.where(f0, g1, g0), np.where(f1, g1, g0))
+
+
+def orient_segments(rows, starts, velocity=1.0):
+    #
+    # the states (1 = swap the head and the tail) of detected raw rows of one
+    # fish, in frame order, where the starts flag the first row of each segment
+    #
+    starts = np.array(starts, dtype=bool)
+    starts[:1] = True
+    ends = np.append(starts[1:], True)
+
+    (hx, hy, cx, cy, tx, ty) = np.array(rows[:, 2:8].T)
+
+    def before(x):
+        return np.where(starts, x, np.concatenate((x[:1], x[:-1])))
+
+    def after(x):
+        return np.where(ends, x, np.concatenate((x[1:], x[-1:])))
+
+    # continuity: the cost of keeping (a) or changing (b) the state of the previous row
+    (phx, phy, ptx, pty) = (before(hx), before(hy), before(tx), before(ty))
+    a = np.hypot(hx - phx, hy - phy) + np.hypot(tx - ptx, ty - pty)
+    b = np.hypot(hx - ptx, hy - pty) + np.hypot(tx - phx, ty - phy)
+
+    # velocity: the centroid motion v (central differences inside the segment) along the body.
+    # Swimming forward costs nothing and backwards the speed: the costs of the states are
+    # (|v| - along) / 2 and (|v| + along) / 2, only their difference matters.
+    (vx, vy) = (after(cx) - before(cx), after(cy) - before(cy))
+    length = np.hypot(hx - tx, hy - ty)
+    along = np.where(length > 0, ((hx - tx) * vx + (hy - ty) * vy) / np.where(length > 0, length, 1.0), 0.0)
+
+    # forward pass: d = best cost of the swapped state - best cost of the kept one. A row maps
+    # the d of the previous row to velocity * along + clip(+-d, -|b - a|, |b - a|) (the sign is
+    # negative when changing the state is cheaper) and the first row of a segment to velocity * along.
+    sign = np.where(b >= a, 1.0, -1.0)
+    margin = np.where(starts, 0.0, np.abs(b - a))
+    (_, d, lo, hi) = segmented_scan((sign, velocity * along, -margin, margin), starts, compose_clips)
+    d = d + np.clip(0.0, lo, hi)
+
+    # the best previous state of each state (ties keep the state)
+    prev = before(d)
+    back0 = a - b > prev
+    back1 = prev <= b - a
+
+    # backtracking: the last row of a segment takes its best state, the others the one the
+    # next row points to (scanned from the end)
+    last = d < 0
+    map0 = np.where(ends, last, np.append(back0[1:], False))
+    map1 = np.where(ends, last, np.append(back1[1:], True))
+    (states, _) = segmented_scan((map0[::-1], map1[::-1]), ends[::-1], compose_maps)
+
+    return states[::-1].astype(np.int64)
+
+
+class Orientation(object):
+    #
+    # Takes blocks of raw rows (with 'fish' rows per frame) and gives them
+    # back with the head and the tail of each fish oriented along its whole
+    # segments. A segment is only oriented when it ends, so the rows from the
+    # first frame of a segment still open at the end of a block are held back
+    # (the rows of a long segment stay in memory until it ends).
+    #
+    def __init__(self, fish=1, velocity=1.0):
+        self.fish = fish
+        self.velocity = velocity
+        self.swaps = 0
+
+        # rows held back (frames x fish x columns)
+        self._pending = None
+
+    def feed(self, raw, final=False):
+        raw = np.asarray(raw, dtype=np.float64)
+        raw = raw.reshape(-1, self.fish, raw.shape[-1])
+
+        if self._pending is not None:
+            raw = np.concatenate((self._pending, raw))
+
+        (frame, detected) = (raw[:, :, 0], raw[:, :, 1] == 1)
+        follows = np.zeros_like(detected)
+        follows[1:] = detected[1:] & detected[:-1] & (frame[1:] - frame[:-1] == 1)
+        starts = detected & ~follows
+
+        # the rows can be oriented up to a frame where no segment goes on
+        done = len(raw) if final else self._open(detected, starts)
+
+        if done < len(raw):
+            cut = np.flatnonzero(np.all(~follows[:done + 1], axis=1))
+            done = cut[-1] if len(cut) > 0 else 0
+
+        out = raw[:done].copy()
+
+        for f in range(self.fish):
+            rows = np.flatnonzero(detected[:done, f])
+
+            if len(rows) == 0:
+                continue
+
+            swap = orient_segments(out[rows, f], starts[rows, f], self.velocity) == 1
+            swapped = rows[swap]
+
+            out[swapped, f, 2:8] = out[swapped, f][:, [6, 7, 4, 5, 2, 3]]
+            self.swaps += len(swapped)
+
+        self._pending = raw[done:]
+
+        return out.reshape(-1, raw.shape[-1])
+
+    def _open(self, detected, starts):
+        # the first row of the segments that may still go on in the next block
+        n = len(detected)
+
+        if (n == 0) or not np.any(detected[-1]):
+            return n
+
+        first = n
+        for f in np.flatnonzero(detected[-1]):
+            first = min(first, np.flatnonzero(starts[:, f])[-1])
+
+        return first
+
+    def finish(self):
+        # the rows still held back
+        if self._pending is None:
+            return np.zeros((0, 8))
+
+        return self.feed(self._pending[:0].reshape(0, self._pending.shape[-1]), final=True)
+
+    def stream(self, blocks):
+        # streaming stage: blocks of raw rows in, blocks of oriented raw rows out
+        for raw in blocks:
+            out = self.feed(raw)
+
+            if len(out) > 0:
+                yield out
+
+        out = self.finish()
+
+        if len(out) > 0:
+            yield out
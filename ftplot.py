@@ -28,121 +28,61 @@
 #
 
 import argparse
+import multiprocessing
 import os
 import sys
+import time
 
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-from matplotlib.ticker import NullFormatter
 
 from ftlib import *
+from ftfig import *
 
-WND_SIZE = 1
-WND_WEIGHT = 1
 
-SURF_WIDTH = 100
-SURF_HEIGHT = 100
+def load_track(task):
+    #
+    # cohort worker: aggregates the dat file of an arena into its orientation
+    # histogram and its grid of centroid counts. Errors are given back to the
+    # parent (a worker that exits would hang the pool).
+    #
+    (fprj, name, fdat, step, cell) = task
+    start = time.time()
 
+    summary = TrackSummary(step)
 
-def shiftZero_old(data):
-    return data - np.min(data)
+    try:
+        for dat in iter_data(fdat):
+            summary.feed(dat)
+    except (SystemExit, IOError, ValueError):
+        return {"prj": fprj, "arena": name, "error": "Can't read the data file '%s'." % fdat}
 
+    (origin, counts) = count_grid(*summary.centroids(), cell=cell)
 
-def normalize(data, scale=1.0):
-    min_data = float(np.min(data))
-    max_data = float(np.max(data))
+    return {"prj": fprj, "arena": name, "rows": summary.rows, "valid": summary.valid,
+            "theta_hist": summary.theta_hist, "origin": origin, "counts": counts, "load": time.time() - start}
 
-    return((data - min_data) / (max_data - min_data)  * float(scale))
 
+def cohort_surface(tracks):
+    # each track adds its fraction of time in each cell to a square grid shared by all of them
+    # and the orientation fractions to the histogram, and both are averaged over the tracks
+    tracks = [t for t in tracks if t["valid"] > 0]
 
-def polar(data, show, fname):
-    angs = data[:, 8]
+    col0 = min(t["origin"][0] for t in tracks)
+    row0 = min(t["origin"][1] for t in tracks)
+    size = max(max(t["origin"][0] + t["counts"].shape[1] - col0, t["origin"][1] + t["counts"].shape[0] - row0) for t in tracks)
 
-    step = np.pi / 180.0
-    theta = np.arange(0, 2 * np.pi + step, step)
-    theta_hist = np.zeros(361)
+    grid = np.zeros((size, size))
+    theta_hist = np.zeros_like(tracks[0]["theta_hist"])
 
-    for a in angs:
-        a = int(a)
-        if(a < 0):
-            a = 360 + a
-        theta_hist[a] += 1
+    for t in tracks:
+        (c, r) = (t["origin"][0] - col0, t["origin"][1] - row0)
+        (h, w) = t["counts"].shape
 
-    # force square figure and square axes looks better for polar, IMO
-    fig = plt.figure(figsize=(8, 8))
-    ax = fig.add_axes([0.1, 0.1, 0.8, 0.8], polar=True)
-    ax.set_theta_zero_location("W")
-    ax.set_theta_direction(-1)
-    ax.plot(theta, theta_hist)
-    fig.savefig(fname)
+        grid[r:r + h, c:c + w] += t["counts"] / float(t["valid"])
+        theta_hist += t["theta_hist"] / float(t["valid"])
 
-    if show:
-        plt.show()
-
-
-def surface(xs, ys):
-    xsize = np.max(xs) - np.min(xs)
-    ysize = np.max(ys) - np.min(ys)
-
-    img_size = max(xsize, ysize) + 1  # we want the surface to be square (!!)
-
-    img = np.zeros((int(img_size), int(img_size)), dtype=np.float64)
-
-    for (x, y) in zip(xs, ys):
-        x, y = int(x), int(y)
-
-        if(WND_SIZE > 0):
-            img[y - WND_SIZE:y + WND_SIZE, x - WND_SIZE:x + WND_SIZE] += WND_WEIGHT
-        else:
-            img[y, x] += WND_WEIGHT
-
-    return(normalize(img, scale=255.0))
-
-
-def scatter(xs, ys, show, fname):
-    img = surface(xs, ys)
-
-    nullfmt   = NullFormatter()         # no labels
-
-    # definitions for the axes
-    left, width = 0.1, 0.65
-    bottom, height = 0.1, 0.65
-    bottom_h = left_h = left + width + 0.02
-
-    rect_scatter = [left, bottom, width, height]
-    rect_histx = [left, bottom_h, width, 0.2]
-    rect_histy = [left_h, bottom, 0.2, height]
-
-    # start with a square Figure
-    fig = plt.figure(figsize=(8, 8))
-
-    axScatter = plt.axes(rect_scatter)
-    axHistx = plt.axes(rect_histx)
-    axHisty = plt.axes(rect_histy)
-
-    # no labels
-    axHistx.xaxis.set_major_formatter(nullfmt)
-    axHisty.yaxis.set_major_formatter(nullfmt)
-
-    # the scatter plot:
-    axScatter.imshow(img, cmap=cm.jet)
-
-    # now determine nice limits by hand:
-    binwidth = 5
-
-    axScatter.set_xlim((1.0, np.size(img, 0)))
-    axScatter.set_ylim((1.0, np.size(img, 1)))
-
-    axHistx.hist(xs, bins=np.arange(np.min(xs), np.max(xs) + binwidth, binwidth))
-    axHisty.hist(ys, bins=np.arange(np.min(ys), np.max(ys) + binwidth, binwidth), orientation='horizontal')
-
-    axHistx.set_xlim(axScatter.get_xlim())
-    axHisty.set_ylim(axScatter.get_ylim())
-    fig.savefig(fname)
-
-    if show:
-        plt.show()
+    return ((col0, row0), grid / len(tracks), theta_hist / len(tracks))
 
 
 #
@@ -151,27 +91,102 @@ def scatter(xs, ys, show, fname):
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-s", "--show", action="store_true", help="Do not show the graphics while saving.")
-parser.add_argument("prj",            type=str, help="project file.")
+parser.add_argument("-a", "--angle-bin", type=int, help="angle histogram bin size (degrees, must divide 360)", default=1)
+parser.add_argument("-c", "--cell",      type=float, help="heat map cell size (same units as the data)", default=1.0)
+parser.add_argument("-F", "--format",    type=str, choices=["svg", "png"], help="format of the figures", default="svg")
+parser.add_argument("-d", "--dpi",       type=int, help="resolution of the PNG figures (dots per inch)", default=100)
+parser.add_argument("-C", "--cohort",    type=str, help="plot all the projects together in one figure saved with this prefix", default=None)
+parser.add_argument("-j", "--jobs",      type=int, help="number of projects loaded at the same time (cohort)", default=multiprocessing.cpu_count())
+parser.add_argument("prj",            type=str, nargs="+", help="project files.")
 args = parser.parse_args()
 
+if (args.angle_bin <= 0) or (360 % args.angle_bin != 0):
+    sys.stderr.write("ERROR: The angle bin size must divide 360.\n")
+    sys.exit(1)
+
+if (args.cohort is None) and (len(args.prj) > 1):
+    sys.stderr.write("ERROR: Several projects can only be plotted together (see the --cohort option).\n")
+    sys.exit(1)
+
+if args.cohort is not None:
+    tasks = []
+    for fprj in args.prj:
+        prj = Project(fprj)
+        tasks += [(fprj, name, prj.get_dat_fname(name), args.angle_bin, args.cell) for (name, mask, lumth) in prj.get_arenas()]
+
+    # check the data files before starting the workers
+    for (fprj, name, fdat, step, cell) in tasks:
+        if not os.path.isfile(fdat):
+            sys.stderr.write("ERROR: File not found '%s'.\n" % fdat)
+            sys.exit(1)
+
+    # the scripts are not import safe so the workers must be forked
+    start = time.time()
+    pool = multiprocessing.get_context("fork").Pool(max(1, min(args.jobs, len(tasks))))
+    tracks = pool.map(load_track, tasks)
+    pool.close()
+    pool.join()
+    load_t = time.time() - start
+
+    errors = [t["error"] for t in tracks if "error" in t]
+
+    if len(errors) > 0:
+        for e in errors:
+            sys.stderr.write("ERROR: %s\n" % e)
+        sys.exit(1)
+
+    for t in tracks:
+        label = t["prj"] if t["arena"] is None else "%s (%s)" % (t["prj"], t["arena"])
+        sys.stdout.write("%s: %d rows, %d valid (%.1f%%).\n" % (label, t["rows"], t["valid"], (100.0 * t["valid"] / t["rows"]) if t["rows"] > 0 else 0.0))
+
+    if all(t["valid"] == 0 for t in tracks):
+        sys.stderr.write("ERROR: No valid rows in the projects.\n")
+        sys.exit(1)
+
+    start = time.time()
+    ((col0, row0), grid, theta_hist) = cohort_surface(tracks)
+    img = window_surface(grid, WND_SIZE, WND_WEIGHT)
+    aggregate_t = time.time() - start
+
+    start = time.time()
+    extent = (col0 * args.cell, (col0 + img.shape[1]) * args.cell, row0 * args.cell, (row0 + img.shape[0]) * args.cell)
+    fcohort = "%s.plt_cohort.%s" % (args.cohort, args.format)
+    cohort_figure(img, extent, theta_hist, args.show, fcohort, args.angle_bin, args.dpi, "%d tracks" % len(tracks))
+    render_t = time.time() - start
+
+    sys.stdout.write("Load: %.3fs (%.3fs in the workers), aggregate: %.3fs, render: %.3fs.\n" % (load_t, sum(t["load"] for t in tracks), aggregate_t, render_t))
+    sys.exit(0)
+
 # get the project data
-prj = Project(args.prj)
+prj = Project(args.prj[0])
+
+# plot each arena
+for (name, mask, lumth) in prj.get_arenas():
+    summary = TrackSummary(args.angle_bin)
+
+    for dat in iter_data(prj.get_dat_fname(name)):
+        summary.feed(dat)
 
-# read data
-dat = read_data(prj.get_dat_fname())
+    count_rows = float(summary.rows)
+    count_valid = float(summary.valid)
 
-count_rows = float(len(dat))
+    if name is not None:
+        sys.stdout.write("Arena %s:\n" % name)
 
-dat = np.array(list(filter(lambda d: d[1] == 1, dat)), dtype=np.float64)
-count_valid = float(len(dat))
+    sys.stdout.write("Total rows in file: %d.\n" % count_rows)
+    sys.stdout.write("Valid rows in file: %d (%.1f%%).\n" % (count_valid, (count_valid / count_rows) * 100.0))
 
-sys.stdout.write("Total rows in file: %d.\n" % count_rows)
-sys.stdout.write("Valid rows in file: %d (%.1f%%).\n" % (count_valid, (count_valid / count_rows) * 100.0))
+    (xs, ys) = summary.centroids()
 
-(xs, ys) = (dat[:, 4], dat[:, 5])
+    prefix = args.prj[0] if name is None else "%s.%s" % (args.prj[0], name)
+    fscatter = prefix + ".plt_heat." + args.format
+    fpolar   = prefix + ".plt_polar." + args.format
 
-fscatter = args.prj + ".plt_heat.svg"
-fpolar   = args.prj + ".plt_polar.svg"
+    if (args.format == "png") and not args.show:
+        raster_scatter(xs, ys, fscatter, args.cell, args.dpi)
+        polar(summary.theta_hist, False, fpolar, args.angle_bin, args.dpi)
+    else:
+        scatter(xs, ys, args.show, fscatter, args.cell, args.dpi if args.format == "png" else None)
+        polar(summary.theta_hist, args.show, fpolar, args.angle_bin, args.dpi if args.format == "png" else None)
 
-scatter(xs, ys, args.show, fscatter)
-polar(dat, args.show, fpolar)
+    plt.close("all")
@@ -29,10 +29,10 @@
 
 # python standard library
 import argparse
+import os
+import re
 import sys
-
-# 3rd party packages
-import numpy as np
+import time
 
 # fish_tracker packages
 from ftlib import *
@@ -43,49 +43,131 @@ parser.add_argument("-x", "--xscale", type=float, help="X scale factor",
 parser.add_argument("-y", "--yscale", type=float, help="Y scale factor",                   default=1.0)
 parser.add_argument("-H", "--hshift", type=float, help="Horizontal shift (after scaling)", default=0.0)
 parser.add_argument("-V", "--vshift", type=float, help="Vertical shift (after scaling)",   default=0.0)
+parser.add_argument("-b", "--binary", action="store_true", help="write a binary dat file (default when the raw file is binary)")
+parser.add_argument("-r", "--rows",   type=int,   help="number of rows processed at a time", default=100000)
+parser.add_argument("-i", "--incremental", action="store_true", help="only process the raw rows added since the last run (e.g. while ftget.py --follow is running)")
+parser.add_argument("-k", "--kinematics", action="store_true", help="also write the kinematics (speed, acceleration, turning rate, ...) and their summary per time window")
+parser.add_argument("--fps",          type=float, help="frames per second of the video (default: the one found by ftget.py)", default=None)
+parser.add_argument("--freeze-speed", type=float, help="the fish freezes below this speed (dat units per second)", default=2.0)
+parser.add_argument("--freeze-time",  type=float, help="for at least this time (seconds)", default=1.0)
+parser.add_argument("--summary",      type=float, help="time window of the summary (seconds)", default=60.0)
+parser.add_argument("--zones",        type=str,   help="zones of the ROI (<columns>x<rows>)", default="3x3")
+parser.add_argument("-o", "--orient", action="store_true", help="orient the head and the tail along whole trajectories instead of frame by frame")
+parser.add_argument("--velocity",     type=float, help="weight of the swimming direction when orienting (0: continuity only)", default=1.0)
 parser.add_argument("prj",            type=str,   help="project file.")
 args = parser.parse_args()
 
 # get the project data
 prj = Project(args.prj)
 
-# read the RAW data
-raw = read_data(prj.get_raw_fname())
+if args.kinematics:
+    fps = args.fps or prj.get("fps")
+    zones = re.match("^([0-9]+)x([0-9]+)$", args.zones)
+
+    if args.incremental:
+        sys.stderr.write("ERROR: The kinematics can't be computed incrementally.\n")
+        sys.exit(1)
+
+    if (fps is None) or (fps <= 0):
+        sys.stderr.write("ERROR: The project has no frame rate, give it with the --fps option.\n")
+        sys.exit(1)
+
+    if (zones is None) or (int(zones.group(1)) < 1) or (int(zones.group(2)) < 1):
+        sys.stderr.write("ERROR: Invalid zones '%s'.\n" % args.zones)
+        sys.exit(1)
+
+    zones = (int(zones.group(1)), int(zones.group(2)))
+
+if args.orient and args.incremental:
+    sys.stderr.write("ERROR: The trajectories can't be oriented incrementally.\n")
+    sys.exit(1)
 
-# get the mask coordinates
-(mx, my, mw, mh) = prj.get("mask")
+# the rows of each frame (one per fish) are processed together
+fish = prj.get("fish") or 1
 
-XX = mx
-YY = my + mh
+binary = args.binary or (prj.get("raw_format") == "binary")
 
-# process the raw data
-raw[:, 2] = ((raw[:, 2] - XX) * args.xscale) + args.hshift   # scale and shift the X coord
-raw[:, 4] = ((raw[:, 4] - XX) * args.xscale) + args.hshift   # scale and shift the X coord
-raw[:, 6] = ((raw[:, 6] - XX) * args.xscale) + args.hshift   # scale and shift the X coord
+# where the last run stopped in each raw file (and the size of the dat file it left)
+params = {"xscale": args.xscale, "yscale": args.yscale, "hshift": args.hshift, "vshift": args.vshift, "binary": binary, "orient": args.orient}
+state = prj.get("proc")
 
-raw[:, 3] = ((YY - raw[:, 3]) * args.yscale) + args.vshift   # scale, swap and shift the Y coords
-raw[:, 5] = ((YY - raw[:, 5]) * args.yscale) + args.vshift   # scale, swap and shift the Y coords
-raw[:, 7] = ((YY - raw[:, 7]) * args.yscale) + args.vshift   # scale, swap and shift the Y coords
+if (not args.incremental) or (state is None) or (state["params"] != params):
+    state = {"params": params, "arenas": {}}
 
-# compute the angles
-thetas = -np.degrees(np.arctan2(raw[:, 5] - raw[:, 3], raw[:, 4] - raw[:, 2]))
+# process the raw data of each arena in blocks and write each block at once
+for (name, mask, lumth) in prj.get_arenas():
+    (raw_fname, dat_fname) = (prj.get_raw_fname(name), prj.get_dat_fname(name))
+    (offset, size) = state["arenas"].get(name or "", (0, 0))
 
-sys.stdout.write("Writing dat file >   0%")
-sys.stdout.flush()
+    if not os.path.isfile(raw_fname):
+        sys.stderr.write("ERROR: File not found '%s'.\n" % raw_fname)
+        sys.exit(1)
 
-fdat = open(prj.get_dat_fname(), "w")
-for (i, (row, theta)) in enumerate(zip(raw, thetas)):
-    # output something nice to the terminal
-    sys.stdout.write("%s%3d%%" % ("\b\b\b\b", int(float(i) / len(raw) * 100)))
+    # start again if the files changed since the last run
+    if (offset > os.path.getsize(raw_fname)) or (not os.path.isfile(dat_fname)) or (os.path.getsize(dat_fname) != size):
+        (offset, size) = (0, 0)
+
+    fdat = open_data(dat_fname, "dat", binary, append=offset > 0)
+    start = time.time()
+
+    # when the newest raw rows were written (to tell how far the dat file is behind them)
+    written = os.path.getmtime(raw_fname)
+    done = 0
+
+    sys.stdout.write("Writing %sdat file > %10d rows" % ("" if name is None else name + " ", done))
     sys.stdout.flush()
 
-    if row[1] == 0:
-        # if the row has no data fill up with zeros
-        fdat.write("%d\t0\t0\t0\t0\t0\t0\t0\t0\n" % row[0])
-    else:
-        row1 = list(map(lambda x: "%d" % int(x), row[:2]))
-        row2 = list(map(lambda x: "%5.2f" % x, row[2:]))
-        fdat.write("%s\t%5.2f\n" % ("\t".join(row1 + row2), theta))
-fdat.close()
+    appended = AppendedRows(raw_fname, offset, max(args.rows - args.rows % fish, fish))
+    raw_blocks = appended
+
+    if args.orient:
+        orientation = Orientation(fish, args.velocity)
+        raw_blocks = orientation.stream(appended)
+
+    blocks = write_blocks(process_blocks(raw_blocks, mask, args.xscale, args.yscale, args.hshift, args.vshift), fdat, binary)
+    last = None
+
+    if args.kinematics:
+        # the ROI in the dat reference
+        (mx, my, mw, mh) = mask
+        kinematics = Kinematics(fps, fish, args.freeze_speed, args.freeze_time, args.summary, zones, (args.hshift, args.vshift, mw * args.xscale, mh * args.yscale))
+
+        fkin = open_data(prj.get_kin_fname(name), "kin", binary)
+        blocks = kinematics.stream(blocks, lambda kin: fkin.write(pack_rows("kin", kin) if binary else format_kin_rows(kin)))
+
+    for dat in blocks:
+        # output something nice to the terminal
+        done += len(dat)
+        last = dat[-1, 0]
+        sys.stdout.write("%s%10d rows" % ("\b" * 15, done))
+        sys.stdout.flush()
+
+    fdat.close()
+    sys.stdout.write("\n")
+
+    if args.orient:
+        sys.stdout.write("Head and tail swapped in %d rows.\n" % orientation.swaps)
+
+    if args.kinematics:
+        fkin.close()
+
+        # the summary is a small table, always in text
+        columns = kinematics.summary_columns()
+        fsum = open(prj.get_sum_fname(name), "w")
+        fsum.write("\t".join(columns) + "\n")
+        fmt = "\t".join("%d" if c in ("first_frame", "fish", "freezing_bouts") else "%.3f" for c in columns) + "\n"
+        fsum.write("".join(fmt % tuple(row) for row in kinematics.summary().tolist()))
+        fsum.close()
+
+    state["arenas"][name or ""] = (appended.offset, os.path.getsize(dat_fname))
+
+    if args.incremental:
+        # how long the new rows took, the last frame now in the dat file and how long ago
+        # (at most) its raw row was written: the lag of the dat file behind the tracking
+        sys.stdout.write("%d new rows in %.3fs, last frame %s, lag %.3fs\n" % (done, time.time() - start, "-" if last is None else "%d" % last, time.time() - written))
+
+prj.set("dat_format", "binary" if binary else "text")
+prj.set("proc", state)
+prj.save(args.prj)
 
-sys.stdout.write("\b\b\b\b100%\nDONE\n")
+sys.stdout.write("DONE\n")
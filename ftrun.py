@@ -0,0 +1,175 @@
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# python standard library
+import argparse
+import sys
+
+# 3rd party packages
+import cv2
+import matplotlib.pyplot as plt
+
+# fish_tracker packages
+from ftlib import *
+from ftfig import *
+from fttrack import *
+
+#
+# Runs ftget.py, ftproc.py and ftplot.py in a single process: the tracker
+# records flow through the processing and the plot aggregations as they are
+# made, so the trajectory is never written and read back. The raw and dat
+# files are only written when asked for.
+#
+
+# parse the script's arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("--raw", action="store_true",       help="write the raw data file")
+parser.add_argument("--dat", action="store_true",       help="write the dat file")
+parser.add_argument("-b", "--binary", action="store_true", help="write binary raw and dat files")
+parser.add_argument("--no-plot", action="store_true",   help="don't draw the plots")
+parser.add_argument("--stride", type=int,               help="analyse one frame every N (the others are interpolated)", default=1)
+parser.add_argument("--gate", type=float,               help="skip the frames where less than this fraction of the ROI changed (ex. 0.002)", default=0.0)
+parser.add_argument("--window", type=int,               help="search the fish in a window of this size around its predicted position (pixels)", default=0)
+parser.add_argument("-f", "--fish", type=int,           help="track up to this number of fish (keeping their identities)", default=1)
+parser.add_argument("--max-jump", type=float,           help="farthest a fish can be from its predicted position (pixels)", default=50.0)
+parser.add_argument("--max-missing", type=int,          help="frames a fish can be missing before its identity is released", default=25)
+parser.add_argument("-x", "--xscale", type=float,       help="X scale factor",                   default=1.0)
+parser.add_argument("-y", "--yscale", type=float,       help="Y scale factor",                   default=1.0)
+parser.add_argument("-H", "--hshift", type=float,       help="Horizontal shift (after scaling)", default=0.0)
+parser.add_argument("-V", "--vshift", type=float,       help="Vertical shift (after scaling)",   default=0.0)
+parser.add_argument("-a", "--angle-bin", type=int,      help="angle histogram bin size (degrees, must divide 360)", default=1)
+parser.add_argument("-c", "--cell", type=float,         help="heat map cell size (same units as the data)", default=1.0)
+parser.add_argument("-r", "--rows", type=int,           help="number of rows processed at a time", default=10000)
+parser.add_argument("-m", "--metrics", type=str,        help="save the tracking metrics (per stage timings, fps, detection rate) to a JSON file", default=None)
+parser.add_argument("-q", "--quiet", action="store_true", help="don't show the progress")
+parser.add_argument("video",          type=str,         help="input video file")
+parser.add_argument("prj",            type=str,         help="project info file")
+parser.add_argument("mask",           type=str,         help="mask coords (<left>x<top>:<width>x<height>)")
+parser.add_argument("lumth",          type=int,         help="Luminosity threshold (ex. 200)")
+args = parser.parse_args()
+
+if (args.stride < 1) or (args.gate < 0):
+    sys.stderr.write("ERROR: The stride must be at least 1 and the gate can't be negative.\n")
+    sys.exit(1)
+
+skipping = (args.stride > 1) or (args.gate > 0)
+
+if (args.fish < 1) or ((args.fish > 1) and (skipping or (args.window > 0))):
+    sys.stderr.write("ERROR: The number of fish must be at least 1 and several fish can't be tracked with the stride, gate or window options.\n")
+    sys.exit(1)
+
+if (args.angle_bin <= 0) or (360 % args.angle_bin != 0):
+    sys.stderr.write("ERROR: The angle bin size must divide 360.\n")
+    sys.exit(1)
+
+# open the video file
+capture = cv2.VideoCapture(args.video)
+
+if not capture.isOpened():
+    sys.stderr.write("ERROR: Can't open the video '%s'.\n" % args.video)
+    sys.exit(1)
+
+frame_height = capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
+frame_width  = capture.get(cv2.CAP_PROP_FRAME_WIDTH)
+frame_count  = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+
+mask = parse_mask(args.mask)
+
+# the project file (the later scripts can use the files written)
+prj = Project()
+prj.set("video", args.video)
+prj.set("mask", mask)
+prj.set("lumth", args.lumth)
+prj.set("raw_format", "binary" if args.binary else "text")
+prj.set("fps", capture.get(cv2.CAP_PROP_FPS))
+prj.set("dat_format", "binary" if args.binary else "text")
+
+if skipping:
+    prj.set("raw_extra", RAW_EXTRA)
+
+if args.fish > 1:
+    prj.set("fish", args.fish)
+    prj.set("raw_extra", RAW_FISH)
+
+prj.save(args.prj)
+
+metrics = Metrics(enabled=args.metrics is not None)
+
+if not args.quiet:
+    metrics.renderers.append(TimeCount(frame_count))
+
+video_tracker = VideoTracker(frame_width, frame_height, mask, args.lumth, metrics, args.window, args.stride, args.gate, args.fish, args.max_jump, args.max_missing)
+
+# chain the stages, writing the files in between when asked
+fraw = open_data(prj.get_raw_fname(), "raw", args.binary, extra=RAW_EXTRA if skipping else RAW_FISH if args.fish > 1 else []) if args.raw else None
+fdat = open_data(prj.get_dat_fname(), "dat", args.binary) if args.dat else None
+
+records = video_tracker.records(capture)
+
+if fraw is not None:
+    records = write_records(records, fraw, args.binary)
+
+blocks = process_blocks(record_blocks(records, args.rows), mask, args.xscale, args.yscale, args.hshift, args.vshift)
+
+if fdat is not None:
+    blocks = write_blocks(blocks, fdat, args.binary)
+
+summary = TrackSummary(args.angle_bin)
+
+for dat in summary.stream(blocks):
+    pass
+
+for fout in [fraw, fdat]:
+    if fout is not None:
+        fout.close()
+
+capture.release()
+metrics.finish()
+
+if args.metrics is not None:
+    metrics.save(args.metrics)
+
+sys.stderr.write("\n")
+
+if skipping and (summary.rows > 0):
+    sys.stderr.write("Analysed %d of %d frames (%.1f%%)\n" % (video_tracker.analysed, summary.rows, 100.0 * video_tracker.analysed / summary.rows))
+
+if video_tracker.detector is not video_tracker.tracker:
+    video_tracker.detector.show_stats()
+
+sys.stdout.write("Total rows: %d.\n" % summary.rows)
+sys.stdout.write("Valid rows: %d (%.1f%%).\n" % (summary.valid, 100.0 * summary.valid / max(summary.rows, 1)))
+
+if (not args.no_plot) and (summary.valid > 0):
+    (xs, ys) = summary.centroids()
+
+    scatter(xs, ys, False, args.prj + ".plt_heat.svg", args.cell)
+    polar(summary.theta_hist, False, args.prj + ".plt_polar.svg", args.angle_bin)
+    plt.close("all")
+
+sys.stdout.write("DONE\n")
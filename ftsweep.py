@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# python standard library
+import argparse
+import sys
+import time
+
+# 3rd party packages
+import cv2
+import numpy as np
+
+# fish_tracker packages
+from ftlib import *
+from fttrack import *
+from ftvideo import *
+
+
+def parse_lumths(txt):
+    # "200", "180,190,200" or "150:250:10" (first:last:step)
+    try:
+        if ":" in txt:
+            (first, last, step) = map(int, txt.split(":"))
+            return list(range(first, last + 1, step))
+
+        return list(map(int, txt.split(",")))
+    except ValueError:
+        sys.stderr.write("Invalid thresholds: '%s'\n" % txt)
+        sys.exit(1)
+
+
+def union_box(masks, frame_width, frame_height):
+    x0 = max(min(m[0] for m in masks), 0)
+    y0 = max(min(m[1] for m in masks), 0)
+    x1 = min(max(m[0] + m[2] for m in masks), frame_width)
+    y1 = min(max(m[1] + m[3] for m in masks), frame_height)
+
+    return (x0, y0, max(x1 - x0, 0), max(y1 - y0, 0))
+
+
+def sample_segments(frame_count, segments, length):
+    # segments of consecutive frames (needed for the head/tail swaps) spread over the video
+    segments = max(1, min(segments, int(frame_count) // max(length, 1)))
+    step = int(frame_count) // segments
+
+    return [(i * step, length) for i in range(segments)]
+
+
+def decode_samples(video, box, segments, index=None):
+    #
+    # decodes the sampled frames once and keeps only the luminosity of the masks' area.
+    # The video may end before the frame count says so: the segments that are
+    # given back have the number of frames that were really decoded.
+    #
+    (bx, by, bw, bh) = box
+    total = sum(length for (first, length) in segments)
+
+    lums = np.zeros((total, bh, bw), dtype=np.uint8)
+    chans = [np.empty((bh, bw), dtype=np.uint8) for c in range(3)]
+
+    capture = cv2.VideoCapture(video)
+
+    decoded = []
+
+    i = 0
+    for (first, length) in segments:
+        # with an index, seek to the keyframe before the segment and decode forward (exact)
+        start = first if index is None else index.keyframe_before(first)
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+        ret = True
+        for f in range(start, first):
+            ret = ret and capture.grab()
+
+        n = 0
+        while ret and (n < length):
+            (ret, frame) = capture.read()
+
+            if(not ret):
+                break
+
+            cv2.split(frame[by:by + bh, bx:bx + bw], chans)
+            cv2.max(chans[0], chans[1], dst=lums[i])
+            cv2.max(lums[i], chans[2], dst=lums[i])
+            i += 1
+            n += 1
+
+        if n > 0:
+            decoded.append((first, n))
+
+    capture.release()
+
+    return (lums[:i], decoded)
+
+
+def load_samples(args, box, segments, index):
+    info = {"video": video_fingerprint(args.video), "box": list(box), "segments": [list(s) for s in segments]}
+
+    # reuse the frames cache when it was made from the same video and samples
+    # (there's no cache the first time, a cache that can't be read is reported and made again)
+    if args.cache is not None:
+        try:
+            cached = json.loads(open(args.cache + ".json").read())
+
+            if dict((k, cached.get(k)) for k in info) == info:
+                return (np.load(args.cache, mmap_mode="r"), [tuple(s) for s in cached["decoded"]])
+
+            sys.stderr.write("The frames cache '%s' was made from other samples, decoding them again.\n" % args.cache)
+        except FileNotFoundError:
+            pass
+        except (IOError, ValueError, KeyError) as e:
+            sys.stderr.write("WARNING: The frames cache '%s' can't be read (%s), decoding the samples again.\n" % (args.cache, e))
+
+    (lums, decoded) = decode_samples(args.video, box, segments, index)
+
+    if args.cache is not None:
+        np.save(args.cache, lums)
+        info["decoded"] = [list(s) for s in decoded]
+        open(args.cache + ".json", "w").write(json.dumps(info))
+
+    return (lums, decoded)
+
+
+def evaluate(lums, segments, box, mask, lumth):
+    (bx, by, bw, bh) = box
+    (mx, my, mw, mh) = mask
+
+    # the samples are cropped to the box: move the mask to the same reference
+    tracker = Tracker(bw, bh, (mx - bx, my - by, mw, mh), lumth)
+
+    detected = 0
+    areas = []
+    swaps = 0
+
+    i = 0
+    for (first, length) in segments:
+        # each segment starts a new head/tail history
+        tracker.headtail = HeadTail(tracker.mask)
+
+        for lum in lums[i:i + length]:
+            points = tracker.headtail.orient(tracker.detect(lum))
+
+            if points is not None:
+                detected += 1
+                areas.append(cv2.contourArea(tracker.blob))
+
+        swaps += tracker.headtail.swaps
+        i += length
+
+    areas = np.array(areas)
+
+    return {
+        "mask": list(mask),
+        "lumth": lumth,
+        "detected": float(detected) / max(len(lums), 1),
+        "area": float(np.mean(areas)) if len(areas) > 0 else 0.0,
+        "area_fraction": float(np.mean(areas)) / max(mw * mh, 1) if len(areas) > 0 else 0.0,
+        "area_cv": float(np.std(areas) / np.mean(areas)) if (len(areas) > 0) and (np.mean(areas) > 0) else 0.0,
+        "swaps": swaps
+    }
+
+
+#
+# Main
+#
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-l", "--lumths",   type=str, help="thresholds to try: list (180,190,200) or range (150:250:10)", default="100:250:10")
+parser.add_argument("-n", "--segments", type=int, help="number of sampled segments of the video", default=20)
+parser.add_argument("-L", "--length",   type=int, help="number of consecutive frames in each segment", default=25)
+parser.add_argument("-c", "--cache",    type=str, help="keep the sampled frames in this .npy file (memory mapped)")
+parser.add_argument("-o", "--output",   type=str, help="save the results to a JSON file")
+parser.add_argument("-i", "--index",    type=str, help="index of the video (made by ftindex.py) with its true frame count")
+parser.add_argument("video",            type=str, help="input video file")
+parser.add_argument("masks",            type=str, nargs="+", help="candidate masks (<left>x<top>:<width>x<height>)")
+args = parser.parse_args()
+
+# np.save adds the extension when it's missing: the cache, its description and np.load use the same name
+if (args.cache is not None) and (not args.cache.endswith(".npy")):
+    args.cache += ".npy"
+
+masks = [tuple(parse_mask(m)) for m in args.masks]
+lumths = parse_lumths(args.lumths)
+
+capture = cv2.VideoCapture(args.video)
+frame_width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+frame_height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+capture.release()
+
+# the frame count of the container is often wrong, the index has the true one
+index = None
+
+if args.index is not None:
+    index = VideoIndex.load(args.index)
+
+    if (index is None) or (not index.fresh(args.video)):
+        sys.stderr.write("WARNING: The index '%s' is missing or out of date, using the frame count of the video.\n" % args.index)
+        index = None
+    else:
+        frame_count = index.frame_count
+
+box = union_box(masks, frame_width, frame_height)
+segments = sample_segments(frame_count, args.segments, args.length)
+
+start = time.time()
+(lums, segments) = load_samples(args, box, segments, index)
+decode_t = time.time() - start
+
+if len(lums) == 0:
+    sys.stderr.write("ERROR: No frames could be read from '%s'.\n" % args.video)
+    sys.exit(1)
+
+sys.stderr.write("Sampled %d frames (%d segments) in %.1fs.\n" % (len(lums), len(segments), decode_t))
+
+start = time.time()
+results = [evaluate(lums, segments, box, mask, lumth) for mask in masks for lumth in lumths]
+sweep_t = time.time() - start
+
+sys.stderr.write("Evaluated %d combinations in %.1fs.\n\n" % (len(results), sweep_t))
+
+# the best combinations detect the fish often, with a stable size and few swaps
+results.sort(key=lambda r: (-r["detected"], r["area_cv"], r["swaps"]))
+
+sys.stdout.write("%-20s %5s %9s %9s %7s %8s %6s\n" % ("Mask", "Lumth", "Detected", "Area", "Mask %", "Area CV", "Swaps"))
+for r in results:
+    sys.stdout.write("%-20s %5d %8.1f%% %9.1f %6.1f%% %8.3f %6d\n" % ("%dx%d:%dx%d" % tuple(r["mask"]), r["lumth"], r["detected"] * 100.0, r["area"], r["area_fraction"] * 100.0, r["area_cv"], r["swaps"]))
+
+if args.output is not None:
+    open(args.output, "w").write(json.dumps({"frames": len(lums), "segments": segments, "results": results}, indent=4))
@@ -0,0 +1,259 @@
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# python standard library
+import time
+
+# 3rd party packages
+import cv2
+import numpy as np
+
+
+#
+# Synthetic fish videos with a known ground truth: an elongated dark blob (a
+# body with a thicker head) swimming along a smooth path inside the ROI over a
+# bright textured background. Everything is drawn from a seeded random
+# generator, so the same arguments always give the same video.
+#
+
+SYNTH_BACKGROUND = 220
+SYNTH_FISH = 40
+SYNTH_LUMTH = 128
+
+
+def synth_path(frames, roi, length, seed=0):
+    #
+    # centres and headings (radians) of a Lissajous-like path that keeps the
+    # whole fish inside the ROI
+    #
+    rng = np.random.RandomState(seed)
+    (rx, ry, rw, rh) = roi
+
+    t = np.arange(frames, dtype=np.float64)
+    (fx, fy) = rng.uniform(0.002, 0.01, 2) * 2 * np.pi
+    (px, py) = rng.uniform(0, 2 * np.pi, 2)
+
+    margin = length * 0.75
+    xs = rx + rw / 2.0 + (rw / 2.0 - margin) * np.sin(fx * t + px)
+    ys = ry + rh / 2.0 + (rh / 2.0 - margin) * np.sin(fy * t + py)
+
+    # the fish heads where it's going
+    headings = np.arctan2(np.gradient(ys), np.gradient(xs))
+
+    return (xs, ys, headings)
+
+
+def draw_fish(img, center, heading, length, offset=(0, 0)):
+    # draws the fish in an image whose top left corner is at 'offset' in the frame, returns its head and tail
+    (dx, dy) = (np.cos(heading), np.sin(heading))
+    (cx, cy) = center
+    (ox, oy) = offset
+    width = max(length / 5.0, 2.0)
+
+    head = (int(round(cx + dx * length / 2.0)), int(round(cy + dy * length / 2.0)))
+    tail = (int(round(cx - dx * length / 2.0)), int(round(cy - dy * length / 2.0)))
+
+    body = (int(round(cx)) - ox, int(round(cy)) - oy)
+    bump = (int(round(cx + dx * length / 4.0)) - ox, int(round(cy + dy * length / 4.0)) - oy)
+
+    cv2.ellipse(img, body, (int(length / 2.0), int(width / 2.0)), np.degrees(heading), 0, 360, SYNTH_FISH, -1)
+    cv2.circle(img, bump, int(round(width * 0.6)), SYNTH_FISH, -1)
+
+    return (head, tail)
+
+
+def fish_centroid(center, heading, length):
+    # centroid of the fish drawn alone (same rounding as the tracker)
+    (x0, y0) = (int(center[0]) - int(length), int(center[1]) - int(length))
+    canvas = np.full((2 * int(length) + 1, 2 * int(length) + 1), 255, dtype=np.uint8)
+
+    (head, tail) = draw_fish(canvas, center, heading, length, (x0, y0))
+
+    moments = cv2.moments(np.uint8(canvas < SYNTH_LUMTH) * 255)
+
+    return (head, (int(moments['m10'] / moments['m00']) + x0, int(moments['m01'] / moments['m00']) + y0), tail)
+
+
+def synth_frames(width, height, frames, roi, fish=1, length=40, seed=0, gap=5, period=100):
+    #
+    # generates the frames of a synthetic video with their ground truth: one
+    # raw row per fish (frame, detected, head XY, centroid XY, tail XY). Each
+    # fish swims its own path (they may cross) and all leave the scene for
+    # 'gap' frames every 'period' frames. The frame is reused between calls.
+    #
+    rng = np.random.RandomState(seed)
+
+    # a static textured background, with some dark spots outside the ROI (that must be ignored)
+    background = np.uint8(np.clip(rng.normal(SYNTH_BACKGROUND, 4, (height, width)), 0, 255))
+    (rx, ry, rw, rh) = roi
+
+    for i in range(20):
+        (x, y) = (rng.randint(0, width), rng.randint(0, height))
+
+        if not ((rx - length <= x < rx + rw + length) and (ry - length <= y < ry + rh + length)):
+            cv2.circle(background, (x, y), int(length / 4) + 1, SYNTH_FISH, -1)
+
+    paths = [synth_path(frames, roi, length, seed + j) for j in range(fish)]
+
+    img = np.empty_like(background)
+
+    for f in range(frames):
+        img[:, :] = background
+
+        truth = np.zeros((fish, 8), dtype=np.int64)
+        truth[:, 0] = f
+
+        if (period == 0) or (f % period < period - gap):
+            for (j, (xs, ys, headings)) in enumerate(paths):
+                (head, centroid, tail) = fish_centroid((xs[f], ys[f]), headings[f], length)
+                draw_fish(img, (xs[f], ys[f]), headings[f], length)
+
+                truth[j, 1:] = (1, ) + head + centroid + tail
+
+        yield (img, truth)
+
+
+def synth_school(fname, width, height, frames, roi, fish=1, length=40, seed=0, fps=30, gap=5, period=100):
+    # writes the video and returns its ground truth (one row per frame and fish, see synth_frames)
+    writer = cv2.VideoWriter(fname, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height), False)
+
+    if not writer.isOpened():
+        raise IOError("can't write the video '%s'" % fname)
+
+    truth = np.zeros((frames, fish, 8), dtype=np.int64)
+
+    for (f, (img, rows)) in enumerate(synth_frames(width, height, frames, roi, fish, length, seed, gap, period)):
+        writer.write(img)
+        truth[f] = rows
+
+    writer.release()
+
+    return truth
+
+
+def synth_camera(fname, width, height, frames, roi, fps=30, fish=1, length=40, seed=0, written=None):
+    #
+    # stands in for a camera recording: appends the frames to a MJPEG stream
+    # in real time (one JPEG image per frame, flushed at once). The time each
+    # frame was written is stored in 'written' (a dict) if given.
+    #
+    fout = open(fname, "wb")
+    start = time.time()
+
+    for (f, (img, rows)) in enumerate(synth_frames(width, height, frames, roi, fish, length, seed)):
+        fout.write(cv2.imencode(".jpg", img)[1].tobytes())
+        fout.flush()
+
+        if written is not None:
+            written[f] = time.time()
+
+        time.sleep(max(start + (f + 1) / float(fps) - time.time(), 0))
+
+    fout.close()
+
+
+def synth_video(fname, width, height, frames, roi, length=40, seed=0, fps=30, gap=5, period=100):
+    # a video with a single fish, the ground truth has one row per frame
+    return synth_school(fname, width, height, frames, roi, 1, length, seed, fps, gap, period)[:, 0]
+
+
+def track_accuracy(raw, truth):
+    #
+    # compares raw rows with the ground truth: detection agreement, mean errors
+    # (pixels) of the points and how often the head and tail are not swapped
+    #
+    raw = np.asarray(raw, dtype=np.float64)[:len(truth), :8]
+    truth = np.asarray(truth, dtype=np.float64)[:len(raw)]
+
+    both = (raw[:, 1] == 1) & (truth[:, 1] == 1)
+
+    def error(i):
+        return float(np.mean(np.hypot(*(raw[both, i:i + 2] - truth[both, i:i + 2]).T))) if both.any() else 0.0
+
+    # the head is right when it's closer to the real head than to the real tail
+    to_head = np.hypot(*(raw[both, 2:4] - truth[both, 2:4]).T)
+    to_tail = np.hypot(*(raw[both, 2:4] - truth[both, 6:8]).T)
+
+    return {
+        "frames": len(raw),
+        "detection": float(np.mean(raw[:, 1] == truth[:, 1])) if len(raw) > 0 else 0.0,
+        "head_error": error(2),
+        "centroid_error": error(4),
+        "tail_error": error(6),
+        "orientation": float(np.mean(to_head <= to_tail)) if both.any() else 0.0
+    }
+
+
+def identity_accuracy(school, truth, radius=10):
+    #
+    # how well the identities of a multi-fish track follow the real fish:
+    # each tracked point is labelled with the real fish whose centroid is
+    # within 'radius' pixels and each slot is scored against the fish it
+    # followed most often. 'school' has the points (or None) of the k slots
+    # of each frame, 'truth' comes from synth_school.
+    #
+    labels = []
+
+    for (points, real) in zip(school, truth):
+        row = []
+
+        for p in points:
+            label = -1
+
+            if p is not None:
+                d = np.hypot(real[:, 4] - p[1][0], real[:, 5] - p[1][1])
+                d[real[:, 1] == 0] = np.inf
+
+                if d.min() <= radius:
+                    label = int(np.argmin(d))
+
+            row.append(label)
+
+        labels.append(row)
+
+    labels = np.array(labels, dtype=np.int64).reshape(len(labels), -1)
+
+    kept = 0
+    switches = 0
+
+    for slot in labels.T:
+        seen = slot[slot >= 0]
+
+        if len(seen) > 0:
+            kept += np.max(np.bincount(seen))
+            switches += int(np.sum(seen[1:] != seen[:-1]))
+
+    found = int(np.sum(labels >= 0))
+    present = int(np.sum(truth[:, :, 1] == 1))
+
+    return {
+        "frames": len(labels),
+        "detection": float(found) / present if present > 0 else 0.0,
+        "identity": float(kept) / found if found > 0 else 0.0,
+        "switches": switches
+    }
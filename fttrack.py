@@ -0,0 +1,896 @@
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# python standard library
+import bisect
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+# 3rd party packages
+import cv2
+import numpy as np
+
+# fish_tracker packages
+from ftassign import *
+from ftgeom import *
+from ftlib import *
+
+# must change whenever the tracking results change (invalidates the cached results)
+TRACKER_VERSION = 1
+
+
+class HeadTail(object):
+    #
+    # Keeps the head and the tail of the fish consistent between frames.
+    #
+    def __init__(self, mask):
+        self.mask = tuple(mask)
+
+        self.last_head = None
+        self.last_tail = None
+        self.swaps = 0
+
+    def orient(self, points):
+        (mx, my, mw, mh) = self.mask
+
+        if points is None:
+            self.last_head = None
+            self.last_tail = None
+            return None
+
+        (head, centroid, tail) = points
+
+        # doesn't consider when the fish touches the limits
+        if(check_inside(head[0], mx, mw) and check_inside(head[1], my, mh) and check_inside(tail[0], mx, mw) and check_inside(tail[1], my, mh)):
+            body_angle = angle(head, centroid, tail)
+
+            # swap the head and the tail when needed
+            if (self.last_head is not None) and (lindist(head, self.last_head) > lindist(head, self.last_tail)) and (body_angle > 20):
+                (head, tail) = (tail, head)
+                self.swaps += 1
+
+        # store the head and tail for the next frame
+        self.last_head = head
+        self.last_tail = tail
+
+        return (head, centroid, tail)
+
+
+class Tracker(object):
+    #
+    # Tracks one fish inside a rectangular ROI.
+    #
+    # Only the ROI is ever touched: the frame is cropped before any colour work
+    # and the luminosity (the HSV value channel, i.e. the max over the colour
+    # channels) is computed into ROI sized buffers that are reused between
+    # frames. Contours are found in the crop and shifted back into frame
+    # coordinates so the results match a full frame analysis. A smaller search
+    # window inside the ROI can be set to analyse even fewer pixels.
+    #
+    def __init__(self, frame_width, frame_height, mask, lumth, metrics=None):
+        self._frame_width = int(frame_width)
+        self._frame_height = int(frame_height)
+
+        self.metrics = Metrics(enabled=False) if metrics is None else metrics
+        self.lumth = lumth
+        self.blob = None
+        self.headtail = HeadTail(mask)
+        self.set_mask(mask)
+
+    def set_mask(self, mask):
+        (mx, my, mw, mh) = mask
+        self.mask = (mx, my, mw, mh)
+        self.headtail.mask = self.mask
+
+        # clip the ROI to the frame limits
+        x0 = min(max(mx, 0), self._frame_width)
+        y0 = min(max(my, 0), self._frame_height)
+        x1 = min(max(mx + mw, x0), self._frame_width)
+        y1 = min(max(my + mh, y0), self._frame_height)
+        self.roi = (x0, y0, x1, y1)
+
+        # buffers for each crop shape in use (the ROI and the search windows)
+        self._buffers = {}
+        self.set_window(None)
+
+    def set_window(self, window):
+        # restricts the analysis to a window (left, top, width, height) inside the ROI, None for the whole ROI
+        (x0, y0, x1, y1) = self.roi
+
+        if window is not None:
+            (wx, wy, ww, wh) = window
+            (x0, x1) = (min(max(wx, x0), x1), max(min(wx + ww, x1), x0))
+            (y0, y1) = (min(max(wy, y0), y1), max(min(wy + wh, y1), y0))
+
+        (self._x0, self._y0, self._x1, self._y1) = (x0, y0, x1, y1)
+
+        shape = (y1 - y0, x1 - x0)
+
+        if shape not in self._buffers:
+            self._buffers[shape] = ([np.empty(shape, dtype=np.uint8) for c in range(3)], np.empty(shape, dtype=np.uint8), np.empty(shape, dtype=np.uint8))
+
+        (self._chans, self._lum, self._bin) = self._buffers[shape]
+
+    def get_window(self):
+        return (self._x0, self._y0, self._x1 - self._x0, self._y1 - self._y0)
+
+    def get_binary(self):
+        return self._bin
+
+    def threshold(self, frame):
+        t = self.metrics.clock()
+        roi = frame[self._y0:self._y1, self._x0:self._x1]
+
+        if roi.ndim == 2:
+            # single channel frames are already the luminosity
+            lum = roi
+        else:
+            # the HSV value channel is just the max over the colour channels
+            cv2.split(roi, self._chans)
+            cv2.max(self._chans[0], self._chans[1], dst=self._lum)
+            cv2.max(self._lum, self._chans[2], dst=self._lum)
+            lum = self._lum
+
+        t = self.metrics.lap("colour", t)
+        cv2.threshold(lum, self.lumth, 255, cv2.THRESH_BINARY_INV, dst=self._bin)
+        self.metrics.lap("threshold", t)
+
+        return self._bin
+
+    def contours(self):
+        # blobs of the last thresholded frame (largest first)
+        if self._bin.size == 0:
+            return []
+
+        t = self.metrics.clock()
+        (blobs, dummy) = cv2.findContours(self._bin, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE, offset=(self._x0, self._y0))
+        blobs = sorted(blobs, key=lambda x: -len(x))
+        self.metrics.lap("contours", t)
+
+        return blobs
+
+    def find_blobs(self, frame):
+        self.threshold(frame)
+
+        return self.contours()
+
+    def detect(self, frame):
+        return self.select(self.find_blobs(frame))
+
+    def select(self, blobs):
+        if (len(blobs) == 0) or (np.size(blobs[0]) <= 100):
+            self.blob = None
+            return None
+
+        self.blob = blobs[0]
+
+        t = self.metrics.clock()
+        points = blob_geometry(blobs[0])
+        self.metrics.lap("geometry", t)
+
+        return points
+
+    def track(self, frame):
+        return self.headtail.orient(self.detect(frame))
+
+    def detect_many(self, frame, k):
+        # geometry of the k largest blobs (the ones large enough)
+        blobs = [b for b in self.find_blobs(frame)[:k] if np.size(b) > 100]
+        self.blob = blobs[0] if len(blobs) > 0 else None
+
+        t = self.metrics.clock()
+        points = [blob_geometry(b) for b in blobs]
+        self.metrics.lap("geometry", t)
+
+        return points
+
+
+class FishTrack(object):
+    #
+    # One identity of a MultiTracker: where it was last seen, its velocity
+    # (pixels per frame), for how long it's been missing and its head/tail state.
+    #
+    def __init__(self, mask, points):
+        self.centroid = np.array(points[1], dtype=np.float64)
+        self.velocity = np.zeros(2)
+        self.missing = 0
+        self.headtail = HeadTail(mask)
+
+    def predict(self):
+        return self.centroid + self.velocity * (self.missing + 1)
+
+    def update(self, points):
+        centroid = np.array(points[1], dtype=np.float64)
+
+        self.velocity = (centroid - self.centroid) / (self.missing + 1)
+        self.centroid = centroid
+        self.missing = 0
+
+        # the head and tail of each fish follow its previous ones
+        return self.headtail.orient(points)
+
+
+class MultiTracker(object):
+    #
+    # Keeps the identities of up to k fish. The detections of each frame are
+    # assigned to the positions predicted for the known fish (see ftassign),
+    # the rest start new identities in the free slots. A fish missing for
+    # more than 'max_missing' frames frees its slot.
+    #
+    def __init__(self, mask, k, max_jump=50, max_missing=25):
+        self.mask = mask
+        self.max_jump = max_jump
+        self.max_missing = max_missing
+
+        self.slots = [None] * k
+        self.new_tracks = 0
+
+    def update(self, detections):
+        active = [i for (i, s) in enumerate(self.slots) if s is not None]
+
+        predicted = [self.slots[i].predict() for i in active]
+        pairs = assign(predicted, [p[1] for p in detections], self.max_jump)
+
+        points = [None] * len(self.slots)
+
+        for (r, c) in pairs:
+            points[active[r]] = self.slots[active[r]].update(detections[c])
+
+        # the fish not found this time
+        for i in set(active) - set(active[r] for (r, c) in pairs):
+            self.slots[i].missing += 1
+
+            if self.slots[i].missing > self.max_missing:
+                self.slots[i] = None
+
+        # new fish take the free slots (the largest first)
+        found = set(c for (r, c) in pairs)
+        free = [i for (i, s) in enumerate(self.slots) if s is None]
+
+        for (i, c) in zip(free, [c for c in range(len(detections)) if c not in found]):
+            self.slots[i] = FishTrack(self.mask, detections[c])
+            points[i] = self.slots[i].update(detections[c])
+            self.new_tracks += 1
+
+        return points
+
+
+class LocalSearch(object):
+    #
+    # Looks for the fish in a small window around the position predicted from the
+    # last centroid and velocity, falling back to the whole ROI when there's no
+    # prediction or the blob is lost or touches the edges of the window.
+    #
+    def __init__(self, tracker, size):
+        self.tracker = tracker
+        self.size = size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._last = None
+        self._velocity = (0, 0)
+
+    def window(self):
+        if self._last is None:
+            return None
+
+        (cx, cy) = (self._last[0] + self._velocity[0], self._last[1] + self._velocity[1])
+        return (cx - self.size // 2, cy - self.size // 2, self.size, self.size)
+
+    def inside(self, blob):
+        (bx, by, bw, bh) = cv2.boundingRect(blob)
+        (wx, wy, ww, wh) = self.tracker.get_window()
+        (x0, y0, x1, y1) = self.tracker.roi
+
+        # the sides shared with the ROI are not edges of the window
+        return ((wx == x0) or check_inside(bx, wx, ww)) and ((wx + ww == x1) or check_inside(bx + bw - 1, wx, ww)) and \
+            ((wy == y0) or check_inside(by, wy, wh)) and ((wy + wh == y1) or check_inside(by + bh - 1, wy, wh))
+
+    def detect(self, frame):
+        window = self.window()
+        points = None
+
+        if window is not None:
+            self.tracker.set_window(window)
+            points = self.tracker.detect(frame)
+
+            if (points is not None) and self.inside(self.tracker.blob):
+                self.hits += 1
+            else:
+                self.misses += 1
+                points = None
+
+        if points is None:
+            self.tracker.set_window(None)
+            points = self.tracker.detect(frame)
+
+        # predict the next centroid
+        if points is None:
+            self._last = None
+            self._velocity = (0, 0)
+        else:
+            centroid = points[1]
+            self._velocity = (0, 0) if self._last is None else (centroid[0] - self._last[0], centroid[1] - self._last[1])
+            self._last = centroid
+
+        return points
+
+    def track(self, frame):
+        return self.tracker.headtail.orient(self.detect(frame))
+
+    def show_stats(self):
+        tries = self.hits + self.misses
+
+        if tries > 0:
+            sys.stderr.write("search window: %d of %d frames found in the window (%.1f%%)\n" % (self.hits, tries, 100.0 * self.hits / tries))
+
+
+class MotionGate(object):
+    #
+    # Tells if the thresholded ROI changed since the last analysed frame, comparing
+    # downscaled versions of the binary images (a cheap test to skip static frames).
+    #
+    def __init__(self, threshold, scale=4):
+        self.threshold = threshold
+        self.scale = scale
+
+        self._small = None
+        self._last = None
+
+    def changed(self, binary):
+        (h, w) = binary.shape
+        size = (max(w // self.scale, 1), max(h // self.scale, 1))
+
+        if (self._small is None) or (self._small.shape != (size[1], size[0])):
+            self._small = np.empty((size[1], size[0]), dtype=np.uint8)
+            self._last = None
+
+        cv2.resize(binary, size, dst=self._small, interpolation=cv2.INTER_AREA)
+
+        if self._last is None:
+            return True
+
+        # fraction of the (downscaled) pixels that changed a lot
+        diff = cv2.absdiff(self._small, self._last)
+        return np.count_nonzero(diff > 64) > self.threshold * diff.size
+
+    def update(self):
+        # the current frame becomes the reference
+        if self._last is None:
+            self._last = self._small.copy()
+        else:
+            self._last[:, :] = self._small
+
+
+def interpolate_points(p0, p1, t):
+    if (p0 is None) or (p1 is None):
+        return None
+
+    return tuple(tuple(int(np.floor(a + (b - a) * t + 0.5)) for (a, b) in zip(q0, q1)) for (q0, q1) in zip(p0, p1))
+
+
+class GapFiller(object):
+    #
+    # Fills the frames that were not analysed, interpolating the positions between the analysed frames
+    # around them (frames with no fish on either side are left empty). Returns (frame, points, measured).
+    #
+    def __init__(self, last=None):
+        self._last = last
+
+    def feed(self, f, points):
+        rows = []
+
+        if self._last is not None:
+            (f0, p0) = self._last
+
+            for g in range(f0 + 1, f):
+                rows.append((g, interpolate_points(p0, points, float(g - f0) / (f - f0)), 0))
+
+        rows.append((f, points, 1))
+        self._last = (f, points)
+
+        return rows
+
+    def hold(self, f):
+        # the frame didn't change, so the fish is where it was in the last analysed frame
+        rows = self.feed(f, None if self._last is None else self._last[1])
+        rows[-1] = rows[-1][:2] + (0,)
+
+        return rows
+
+    def finish(self, count):
+        # the last frames keep the last analysed position
+        if self._last is None:
+            return []
+
+        (f0, p0) = self._last
+
+        return [(g, p0, 0) for g in range(f0 + 1, count)]
+
+
+#
+# Decode / analyse / write pipeline
+#
+# A decoder thread reads the frames into a ring of reusable buffers and a
+# writer thread writes the raw data in batches, so the analysis (that runs in
+# the caller's thread) overlaps with both. OpenCV releases the GIL while
+# decoding and in most image operations.
+#
+
+class StageStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.stall = 0.0
+        self.depth = 0
+        self.samples = 0
+        self.max_depth = 0
+
+    def sample(self, q):
+        depth = q.qsize()
+
+        self.depth += depth
+        self.samples += 1
+        self.max_depth = max(self.max_depth, depth)
+
+    def mean_depth(self):
+        return float(self.depth) / max(self.samples, 1)
+
+
+class FramePipeline(object):
+    def __init__(self, capture, fout, buffers=16, batch=500, first=0, checkpoint=None, stride=1, metrics=None):
+        self._metrics = Metrics(enabled=False) if metrics is None else metrics
+        self._capture = capture
+        self._multi = isinstance(fout, list)
+        self._fouts = fout if self._multi else [fout]
+        self._first = first
+        self._stride = stride
+        self.frames_read = first
+        self._checkpoint = checkpoint
+        self._batch_size = batch
+        self._batch = []
+        self._stamps = []
+        self._stamp = 0
+        self._state = None
+        self._stop = False
+
+        # an exception in the decoder or the writer thread, raised again in the caller's thread
+        self._error = None
+
+        self._free = queue.Queue()
+        self._full = queue.Queue(maxsize=buffers)
+        self._lines = queue.Queue(maxsize=buffers)
+
+        # the ring starts empty: the first reads allocate the buffers
+        for i in range(buffers):
+            self._free.put(None)
+
+        self.decode_stats = StageStats("decode")
+        self.analyse_stats = StageStats("analyse")
+        self.write_stats = StageStats("write")
+
+        self._decoder = threading.Thread(target=self._decode)
+        self._writer = threading.Thread(target=self._write)
+        self._decoder.daemon = True
+        self._writer.daemon = True
+        self._decoder.start()
+        self._writer.start()
+
+    def _get(self, q, stats):
+        stats.sample(q)
+
+        t0 = time.time()
+        item = q.get()
+        stats.stall += time.time() - t0
+
+        return item
+
+    def _put(self, q, item, stats):
+        t0 = time.time()
+        q.put(item)
+        stats.stall += time.time() - t0
+
+    def _decode(self):
+        try:
+            self._decode_frames()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(self._full, None, self.decode_stats)
+
+    def _decode_frames(self):
+        f = self._first
+        while not self._stop:
+            # frames out of the stride are only grabbed (never converted nor copied)
+            if f % self._stride != 0:
+                if not self._capture.grab():
+                    break
+
+                f += 1
+                self.frames_read = f
+                continue
+
+            buf = self._get(self._free, self.decode_stats)
+
+            t = self._metrics.clock()
+            (ret, frame) = self._capture.read(buf)
+            self._metrics.lap("decode", t)
+
+            if(not ret) or self._stop:
+                break
+
+            self._put(self._full, (f, frame, self._metrics.clock()), self.decode_stats)
+            f += 1
+            self.frames_read = f
+
+    def _write(self):
+        try:
+            self._write_lines()
+        except Exception as e:
+            self._error = e
+
+            # keep taking the batches so the caller never blocks on a full queue
+            while self._lines.get() is not None:
+                pass
+
+    def _write_lines(self):
+        while True:
+            item = self._get(self._lines, self.write_stats)
+
+            if item is None:
+                break
+
+            (txts, state, stamps) = item
+
+            t = self._metrics.clock()
+            for (fout, txt) in zip(self._fouts, txts):
+                fout.write(txt)
+                fout.flush()
+            t = self._metrics.lap("write", t)
+
+            # latency: from the frame decoded to its rows written
+            if self._metrics.enabled:
+                for stamp in stamps:
+                    self._metrics.record("latency", t - stamp)
+
+            # the checkpoint must never be ahead of the data on disk
+            if (self._checkpoint is not None) and (state is not None):
+                for fout in self._fouts:
+                    os.fsync(fout.fileno())
+
+                offsets = [fout.tell() for fout in self._fouts]
+                self._checkpoint(state, offsets if self._multi else offsets[0])
+
+    def _check(self):
+        # raises (once) the exception of a failed thread
+        if self._error is not None:
+            (error, self._error) = (self._error, None)
+            raise error
+
+    def frames(self):
+        while True:
+            self._check()
+            item = self._get(self._full, self.analyse_stats)
+
+            if item is None:
+                self._check()
+                break
+
+            self._stamp = item[2]
+            yield item[:2]
+
+            # the caller is done with the frame, give the buffer back to the decoder
+            self._free.put(item[1])
+
+    def backlog(self):
+        # frames decoded and waiting to be analysed
+        return self._full.qsize()
+
+    def _join(self):
+        # lines are text or packed binary rows (one batch per output file)
+        batches = [(b"" if isinstance(lines[0], bytes) else "").join(lines) for lines in zip(*self._batch)]
+        stamps = self._stamps
+
+        self._batch = []
+        self._stamps = []
+
+        return (batches, self._state, stamps)
+
+    def write(self, txt, state=None):
+        # with several output files txt is a list (a line for each one)
+        # the state (if any) is passed to the checkpoint once the lines are on disk
+        self._check()
+        self._batch.append(txt if self._multi else [txt])
+        self._stamps.append(self._stamp)
+        self._state = state
+
+        if len(self._batch) >= self._batch_size:
+            self._put(self._lines, self._join(), self.analyse_stats)
+
+    def close(self):
+        # stop the decoder (it may be waiting for a free buffer)
+        self._stop = True
+        self._free.put(None)
+
+        while self._decoder.is_alive():
+            try:
+                self._full.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._decoder.join()
+
+        # write whatever is left
+        if len(self._batch) > 0:
+            self._lines.put(self._join())
+
+        self._lines.put(None)
+        self._writer.join()
+        self._check()
+
+    def show_stats(self):
+        for stats in [self.decode_stats, self.analyse_stats, self.write_stats]:
+            sys.stderr.write("%-8s stall: %7.2fs, input queue depth: %5.1f avg, %3d max\n" % (stats.name + ":", stats.stall, stats.mean_depth(), stats.max_depth))
+
+#
+# Streaming tracker
+#
+# The ftget.py analysis as an importable object: each analysed frame gives
+# the raw rows of the frames it completes (one per fish), either one frame
+# at a time (analyse) or as a generator over a whole video (records).
+#
+
+class VideoTracker(object):
+    def __init__(self, frame_width, frame_height, mask, lumth, metrics=None, window=0, stride=1, gate=0.0, fish=1, max_jump=50, max_missing=25):
+        self.metrics = Metrics(enabled=False) if metrics is None else metrics
+        self.tracker = Tracker(frame_width, frame_height, mask, lumth, self.metrics)
+        self.detector = LocalSearch(self.tracker, window) if window > 0 else self.tracker
+
+        # several fish keep their identities (one raw row per fish in each frame)
+        self.fish = fish
+        self.multi = MultiTracker(self.tracker.mask, fish, max_jump, max_missing) if fish > 1 else None
+
+        # the frames that are not analysed are filled
+        self.stride = stride
+        self.skipping = (stride > 1) or (gate > 0)
+        self.gate = MotionGate(gate) if gate > 0 else None
+        self.filler = GapFiller()
+        self.analysed = 0
+
+        # the points found in the last analysed frame (one per fish, None if missing)
+        self.points = [None] * fish
+
+    def set_mask(self, mask):
+        self.tracker.set_mask(mask)
+
+        if self.multi is not None:
+            self.multi.mask = self.tracker.mask
+
+    def state(self, f):
+        # what a checkpoint needs to carry on after frame f
+        if self.multi is not None:
+            return (f, None, None)
+
+        return (f, self.tracker.headtail.last_head, self.tracker.headtail.last_tail)
+
+    def analyse(self, f, frame):
+        # rows are (frame, points), (frame, points, measured) when frames are skipped
+        # or (frame, points, None, fish) when there are several fish
+        tracker = self.tracker
+
+        if self.multi is not None:
+            self.points = self.multi.update(tracker.detect_many(frame, self.fish))
+            rows = [(f, p, None, i + 1) for (i, p) in enumerate(self.points)]
+        elif not self.skipping:
+            self.points = [self.detector.track(frame)]
+            rows = [(f, self.points[0])]
+        else:
+            if self.gate is not None:
+                tracker.set_window(None)
+                tracker.threshold(frame)
+
+            if (self.gate is None) or self.gate.changed(tracker.get_binary()):
+                # the whole ROI is already thresholded for the gate
+                if (self.gate is None) or (self.detector is not tracker):
+                    self.points = [self.detector.track(frame)]
+                else:
+                    self.points = [tracker.headtail.orient(tracker.select(tracker.contours()))]
+
+                rows = self.filler.feed(f, self.points[0])
+                self.analysed += 1
+
+                if self.gate is not None:
+                    self.gate.update()
+            else:
+                rows = self.filler.hold(f)
+
+        if self.multi is not None:
+            self.metrics.frame(f, sum(p is not None for p in self.points) / float(self.fish))
+        else:
+            self.metrics.frame(f, self.points[0] is not None)
+
+        return rows
+
+    def finish(self, count):
+        # the rows of the frames after the last analysed one (count is the number of frames read)
+        return self.filler.finish(count) if self.skipping else []
+
+    def records(self, capture, first=0):
+        # generator of the raw rows of a whole video (decoded in a separate thread)
+        pipeline = FramePipeline(capture, [], first=first, stride=self.stride, metrics=self.metrics)
+
+        try:
+            for (f, frame) in pipeline.frames():
+                for row in self.analyse(f, frame):
+                    yield row
+
+            for row in self.finish(pipeline.frames_read):
+                yield row
+        finally:
+            pipeline.close()
+
+#
+# Parallel tracking
+#
+# The frame range is split in chunks and each chunk is tracked by a separate
+# process that seeks to its first frame. The workers only detect the fish
+# (head/tail orientation depends on the previous frames) and the merge replays
+# the head/tail swapping over all the frames in order, so the result is the
+# same as tracking the video in a single process.
+#
+
+def split_chunks(frame_count, chunks, keyframes=None):
+    bounds = [int(round(float(frame_count) * i / chunks)) for i in range(chunks + 1)]
+
+    # starting the chunks at keyframes makes the seeks fast and exact
+    if keyframes:
+        bounds = sorted(set([0] + [keyframes[max(bisect.bisect_right(keyframes, b) - 1, 0)] for b in bounds[1:-1]] + [bounds[-1]]))
+        chunks = len(bounds) - 1
+
+    # the last chunk runs until the end of the video (the frame count is not always accurate)
+    return [(bounds[i], bounds[i + 1] if i < chunks - 1 else None) for i in range(chunks)]
+
+
+def detect_chunk(job):
+    (video, mask, lumth, start, end, window) = job
+
+    # CPU time, so the rate of a worker doesn't depend on how many share the cores
+    t0 = time.process_time()
+
+    capture = cv2.VideoCapture(video)
+    frame_width = capture.get(cv2.CAP_PROP_FRAME_WIDTH)
+    frame_height = capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
+
+    if start > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    # where the seek really landed (not always the frame asked for)
+    position = int(capture.get(cv2.CAP_PROP_POS_FRAMES))
+
+    tracker = Tracker(frame_width, frame_height, mask, lumth)
+    detector = LocalSearch(tracker, window) if window > 0 else tracker
+
+    # one row per frame: detected, head XY, centroid XY, tail XY
+    rows = []
+
+    f = start
+    while (end is None) or (f < end):
+        (ret, frame) = capture.read()
+
+        if(not ret):
+            break
+
+        points = detector.detect(frame)
+
+        if points is None:
+            rows.append((0, 0, 0, 0, 0, 0, 0))
+        else:
+            rows.append((1, ) + tuple(points[0]) + tuple(points[1]) + tuple(points[2]))
+
+        f += 1
+
+    capture.release()
+
+    return (start, end, position, np.array(rows, dtype=np.int32).reshape(-1, 7), time.process_time() - t0)
+
+
+def track_parallel(video, mask, lumth, frame_count, workers, window=0, keyframes=None):
+    jobs = [(video, mask, lumth, start, end, window) for (start, end) in split_chunks(frame_count, workers, keyframes)]
+
+    # the scripts are not import safe so the workers must be forked
+    pool = multiprocessing.get_context("fork").Pool(workers)
+
+    try:
+        results = pool.map(detect_chunk, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def check_chunks(results):
+    #
+    # the chunks must start where they were asked to and (but the last one)
+    # read all their frames, or the merged rows would be shifted or have gaps;
+    # returns what went wrong (None if the chunks line up)
+    #
+    for (i, (start, end, position, rows, elapsed)) in enumerate(results):
+        if position != start:
+            return "worker %d seeked to frame %d instead of %d" % (i, position, start)
+
+        if (end is not None) and (len(rows) != end - start):
+            return "worker %d read %d frames instead of %d" % (i, len(rows), end - start)
+
+        if (i > 0) and (results[i - 1][1] != start):
+            return "worker %d doesn't start where worker %d ended" % (i, i - 1)
+
+    return None
+
+
+def merge_chunks(results, mask):
+    problem = check_chunks(results)
+
+    if problem is not None:
+        raise ValueError("the chunks don't line up: %s" % problem)
+
+    headtail = HeadTail(mask)
+
+    for (start, end, position, rows, elapsed) in results:
+        for (i, row) in enumerate(rows):
+            if row[0] == 0:
+                points = None
+            else:
+                row = tuple(map(int, row))
+                points = (row[1:3], row[3:5], row[5:7])
+
+            yield (start + i, headtail.orient(points))
+
+
+def show_parallel_stats(results, elapsed):
+    total = 0
+    rates = []
+
+    for (i, (start, end, position, rows, chunk_cpu)) in enumerate(results):
+        rate = len(rows) / max(chunk_cpu, 1e-9)
+        rates.append(rate)
+        total += len(rows)
+
+        sys.stderr.write("Worker %2d: frames %7d-%7d, %8.1f fps\n" % (i, start, start + len(rows) - 1, rate))
+
+    rate = total / max(elapsed, 1e-9)
+
+    # the wall clock rate (with the pool start-up and the merge) against one worker alone
+    # (its mean rate) and against the workers all running at their mean rate
+    speedup = rate / max(np.mean(rates), 1e-9)
+    efficiency = speedup / len(results)
+
+    sys.stderr.write("Total:     %d frames in %.1fs, %8.1f fps\n" % (total, elapsed, rate))
+    sys.stderr.write("Speed-up:  x%.2f with %d workers (one worker: %.1f fps)\n" % (speedup, len(results), np.mean(rates)))
+    sys.stderr.write("Efficiency: %.0f%%\n" % (efficiency * 100.0))
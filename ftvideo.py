@@ -0,0 +1,425 @@
+#
+# Fish Tracker
+#
+# Copyright (c) 2015, Rodrigo Abreu, Jose Cruz & Rui Oliveira
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# python standard library
+import bisect
+import collections
+import json
+import os
+import stat
+import threading
+import time
+
+# 3rd party packages
+import cv2
+
+# fish_tracker packages
+from ftlib import *
+
+# decoder options for followed videos: start decoding as soon as there's a frame (no long probing)
+FOLLOW_OPTIONS = "probesize;32|analyzeduration;0|fpsprobesize;0"
+
+
+class VideoIndex(object):
+    #
+    # Keyframes, timestamps (ms) and true frame count of a video, found by
+    # scanning it once. The frame count given by the containers is often
+    # wrong and seeking to a frame that is not a keyframe is slow (and not
+    # always exact), so the tools seek to the keyframe before the frame they
+    # want and decode forward from there.
+    #
+    def __init__(self, video=None, frame_count=0, fps=0.0, keyframes=[], timestamps=[], fingerprint=None):
+        self.video = video
+        self.frame_count = frame_count
+        self.fps = fps
+        self.keyframes = list(keyframes)
+        self.timestamps = list(timestamps)
+        self.fingerprint = fingerprint
+
+    def keyframe_before(self, f):
+        # the last keyframe at or before the frame (0 if there are none)
+        i = bisect.bisect_right(self.keyframes, f) - 1
+        return self.keyframes[i] if i >= 0 else 0
+
+    def max_gap(self):
+        # longest distance between keyframes
+        bounds = self.keyframes + [self.frame_count]
+        return max([b - a for (a, b) in zip(bounds[:-1], bounds[1:])] + [1])
+
+    def fresh(self, video):
+        # the index still describes the video
+        return (self.fingerprint is not None) and os.path.isfile(video) and (video_fingerprint(video) == self.fingerprint)
+
+    def save(self, fname):
+        info = {
+            "video": self.video,
+            "fingerprint": self.fingerprint,
+            "frame_count": self.frame_count,
+            "fps": self.fps,
+            "keyframes": self.keyframes,
+            "timestamps": [round(t, 3) for t in self.timestamps]
+        }
+
+        open(fname + ".tmp", "w").write(json.dumps(info))
+        os.replace(fname + ".tmp", fname)
+
+    @staticmethod
+    def load(fname):
+        try:
+            info = json.loads(open(fname).read())
+        except (IOError, ValueError):
+            return None
+
+        return VideoIndex(info["video"], info["frame_count"], info["fps"], info["keyframes"], info["timestamps"], info["fingerprint"])
+
+
+def build_index(video):
+    #
+    # reads the packets without decoding them when the backend allows it (the
+    # keyframes are only known then), otherwise grabs every frame
+    #
+    capture = cv2.VideoCapture(video, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    raw = capture.isOpened()
+
+    if not raw:
+        capture = cv2.VideoCapture(video)
+
+    if not capture.isOpened():
+        raise IOError("can't open the video '%s'" % video)
+
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    keyframes = []
+    timestamps = []
+
+    f = 0
+    while capture.grab():
+        if raw and capture.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(f)
+
+        timestamps.append(capture.get(cv2.CAP_PROP_POS_MSEC))
+        f += 1
+
+    capture.release()
+
+    return VideoIndex(video, f, fps, keyframes, timestamps, video_fingerprint(video))
+
+
+def project_index(prj):
+    # the index referenced by the project (None if there's none or it's stale)
+    fname = prj.get("index")
+
+    if fname is None:
+        return None
+
+    index = VideoIndex.load(fname)
+
+    if (index is None) or (not index.fresh(prj.get("video"))):
+        return None
+
+    return index
+
+
+class FrameReader(object):
+    #
+    # Random access to the frames of a video.
+    #
+    # Decoded frames are kept in an LRU cache limited by a memory budget. A
+    # background thread owns the capture and decodes the frames ahead of the
+    # cursor (the frame being viewed). Video formats can only start decoding at
+    # a keyframe, so far jumps seek to the last anchor (a multiple of the
+    # keyframe interval) before the target and decode forward from there,
+    # keeping the frames just before the target for stepping back. Jumping
+    # backwards never decodes from the start of the file. With an index the
+    # anchors are the real keyframes.
+    #
+    def __init__(self, video, budget=512, ahead=32, keyint=250, index=None):
+        self._capture = cv2.VideoCapture(video)
+
+        if not self._capture.isOpened():
+            raise IOError("can't open the video '%s'" % video)
+
+        self.frame_count = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT)) if index is None else index.frame_count
+        self.budget = budget * 1024 * 1024
+        self.keyint = keyint if (index is None) or (len(index.keyframes) == 0) else index.max_gap()
+        self.index = index
+
+        self._ahead = ahead
+        self._cache = collections.OrderedDict()
+        self._size = 0
+        self._frame_bytes = 1
+        self._pos = 0
+        self._end = None
+        self._cursor = 0
+        self._wanted = None
+        self._stop = False
+
+        self.decoded = 0
+        self.seeks = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _missing(self):
+        # the frame to decode next (None if there's nothing to do)
+        if (self._wanted is not None) and (self._wanted not in self._cache):
+            return self._wanted
+
+        for f in range(self._cursor, self._cursor + self._ahead + 1):
+            if (self._end is not None) and (f >= self._end):
+                break
+
+            if f not in self._cache:
+                return f
+
+        return None
+
+    def _store(self, f, frame):
+        self._cache[f] = frame
+        self._cache.move_to_end(f)
+        self._size += frame.nbytes
+        self._frame_bytes = frame.nbytes
+
+        # the cursor's frame is never evicted
+        while (self._size > self.budget) and (len(self._cache) > 1):
+            (old, dummy) = next(iter(self._cache.items()))
+
+            if old == self._cursor:
+                self._cache.move_to_end(old)
+                continue
+
+            self._size -= self._cache.pop(old).nbytes
+
+    def _decode(self, target):
+        keep = target - self._ahead
+
+        if (target < self._pos) or (target > self._pos + self.keyint):
+            if target < self._pos:
+                # going backwards: keep as many frames before the target as half the budget allows
+                keep = target - max(self._ahead, min(self.keyint, self.budget // (2 * self._frame_bytes)))
+
+            # seek to the anchor before the target (and the frames kept for stepping back)
+            if (self.index is not None) and (len(self.index.keyframes) > 0):
+                self._pos = self.index.keyframe_before(max(keep, 0))
+            else:
+                self._pos = max(keep // self.keyint * self.keyint, 0)
+
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, self._pos)
+            self.seeks += 1
+
+        while self._pos <= target:
+            if self._pos < keep:
+                ret = self._capture.grab()
+                frame = None
+            else:
+                (ret, frame) = self._capture.read()
+
+            self.decoded += 1
+
+            if not ret:
+                with self._lock:
+                    self._end = self._pos
+                    self._lock.notify_all()
+                return
+
+            with self._lock:
+                if (frame is not None) and (self._pos not in self._cache):
+                    self._store(self._pos, frame)
+                    self._lock.notify_all()
+
+            self._pos += 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                target = self._missing()
+
+                while (target is None) and (not self._stop):
+                    self._lock.wait()
+                    target = self._missing()
+
+                if self._stop:
+                    break
+
+            self._decode(target)
+
+    def get(self, f):
+        # the frame (None after the end of the video); the caller must not change it
+        with self._lock:
+            self._cursor = f
+
+            if f in self._cache:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._wanted = f
+                self._lock.notify_all()
+
+                while (f not in self._cache) and ((self._end is None) or (f < self._end)):
+                    self._lock.wait()
+
+                self._wanted = None
+
+            frame = self._cache.get(f)
+
+            if frame is not None:
+                self._cache.move_to_end(f)
+
+            # wake up the prefetching
+            self._lock.notify_all()
+
+            return frame
+
+    def end(self):
+        # number of frames (once the end was reached, otherwise None)
+        return self._end
+
+    def close(self):
+        with self._lock:
+            self._stop = True
+            self._lock.notify_all()
+
+        self._thread.join()
+        self._capture.release()
+
+
+def follow_capture(source):
+    #
+    # opens a capture with the decoder options of followed videos. OpenCV
+    # only reads them from the environment when a capture is opened, so they
+    # are set just for that and the other captures of the process (and of the
+    # workers it forks) keep the default ones. Options set by the user are
+    # left as they are.
+    #
+    if "OPENCV_FFMPEG_CAPTURE_OPTIONS" in os.environ:
+        return cv2.VideoCapture(source)
+
+    os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = FOLLOW_OPTIONS
+
+    try:
+        return cv2.VideoCapture(source)
+    finally:
+        del os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"]
+
+
+class FollowCapture(object):
+    #
+    # Reads a video that is still being written, as a cv2.VideoCapture would.
+    # A thread copies the file to a pipe as it grows and OpenCV decodes the
+    # pipe as a stream, so a read waits for the next frame instead of failing
+    # at the current end of the file. The video ends when the file doesn't
+    # grow for 'idle' seconds. FIFOs (e.g. a camera writing to a named pipe)
+    # are decoded directly. The container must be readable as a stream (MJPEG,
+    # MKV, MPEG-TS, ...): formats with the index at the end (AVI, MP4) are not.
+    #
+    def __init__(self, fname, idle=10.0, poll=0.01):
+        self.idle = idle
+        self.poll = poll
+
+        self.copied = 0
+        self.frames = 0
+        self._size = 0
+        self._thread = None
+
+        # wait for the recording to start
+        start = time.time()
+        while (not os.path.exists(fname)) and (time.time() - start < idle):
+            time.sleep(poll)
+
+        if os.path.exists(fname) and stat.S_ISFIFO(os.stat(fname).st_mode):
+            self._rfd = None
+            self._capture = follow_capture(fname)
+            return
+
+        (self._rfd, self._wfd) = os.pipe()
+        self._fin = open(fname, "rb") if os.path.exists(fname) else None
+
+        if self._fin is not None:
+            self._thread = threading.Thread(target=self._copy)
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            os.close(self._wfd)
+
+        self._capture = follow_capture("/dev/fd/%d" % self._rfd)
+
+    def _copy(self):
+        last = time.time()
+
+        while True:
+            data = self._fin.read(65536)
+            self._size = os.fstat(self._fin.fileno()).st_size
+
+            if len(data) > 0:
+                try:
+                    os.write(self._wfd, data)
+                except OSError:
+                    # the capture was released
+                    break
+
+                self.copied += len(data)
+                last = time.time()
+            elif time.time() - last > self.idle:
+                break
+            else:
+                time.sleep(self.poll)
+
+        self._fin.close()
+        os.close(self._wfd)
+
+    def isOpened(self):
+        return self._capture.isOpened()
+
+    def get(self, prop):
+        return self._capture.get(prop)
+
+    def grab(self):
+        ret = self._capture.grab()
+        self.frames += ret
+        return ret
+
+    def read(self, image=None):
+        (ret, image) = self._capture.read(image)
+        self.frames += ret
+        return (ret, image)
+
+    def pending(self):
+        # estimate of the frames already in the file but not decoded yet
+        if (self._thread is None) or (self.frames == 0):
+            return 0
+
+        return max(self._size - self.copied, 0) * self.frames / float(self.copied)
+
+    def release(self):
+        self._capture.release()
+
+        if self._rfd is not None:
+            os.close(self._rfd)
@@ -34,6 +34,61 @@ import os
 import cv2
 
 from ftlib import *
+from ftvideo import *
+
+
+# navigation keys (letters and arrows)
+QUIT_VIEW_KEYS = [113, 65617]               # q, Q
+PAUSE_KEYS = [32]                           # space
+STEP_BACK_KEYS = [97, 65361, 2424832]       # a, arrow left
+STEP_FORWARD_KEYS = [100, 65363, 2555904]   # d, arrow right
+JUMP_BACK_KEYS = [115, 65364, 2621440]      # s, arrow down
+JUMP_FORWARD_KEYS = [119, 65362, 2490368]   # w, arrow up
+
+
+def draw_fish(frame, mask, draw, ddat, label=None):
+    (mx, my, mw, mh) = mask
+
+    draw = list(map(int,   draw))
+    ddat = list(map(float, ddat))
+
+    # compute theta
+    cv2.circle(frame, tuple(draw[2:4]), 3, (0, 0, 255), -1)
+    cv2.circle(frame, tuple(draw[4:6]), 3, (0, 255, 0), -1)
+    cv2.circle(frame, tuple(draw[6:8]), 3, (255, 0, 0), -1)
+    cv2.line(frame, tuple(draw[2:4]), tuple(draw[4:6]), (255, 255, 255), 1)
+    cv2.line(frame, tuple(draw[4:6]), tuple(draw[6:8]), (255, 255, 255), 1)
+
+    cv2.putText(frame, "%5.2f" % ddat[8], tuple(draw[2:4]), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0))
+
+    if label is None:
+        cv2.putText(frame, "raw: %3d x %3d"     % (draw[4], draw[5]), (mx, my+20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
+        cv2.putText(frame, "dat: %5.2f x %5.2f" % (ddat[4], ddat[5]), (mx, my+40), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
+    else:
+        cv2.putText(frame, label, (draw[4] + 5, draw[5] + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
+
+
+def draw_arena(frame, name, mask, draws, ddats):
+    # draws holds one row per fish
+    (mx, my, mw, mh) = mask
+
+    found = [(i, draw, ddat) for (i, (draw, ddat)) in enumerate(zip(draws, ddats)) if int(draw[1]) == 1]
+
+    for (i, draw, ddat) in found:
+        draw_fish(frame, mask, draw, ddat, None if len(draws) == 1 else "%d" % (i + 1))
+
+    if len(found) == 0 and name is None:
+        cv2.putText(frame, "NO FISH", (10, 100), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 0, 0))
+    elif len(found) == 0:
+        cv2.putText(frame, "NO FISH", (mx + 5, my + 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0))
+
+    if name is not None:
+        cv2.putText(frame, name, (mx, my - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255))
+
+    cv2.line(frame, (mx, my), (mx + mw, my), (255, 0, 255), 2)
+    cv2.line(frame, (mx + mw, my), (mx + mw, my + mh), (255, 0, 255), 2)
+    cv2.line(frame, (mx + mw, my + mh), (mx, my + mh), (255, 0, 255), 2)
+    cv2.line(frame, (mx, my + mh), (mx, my), (255, 0, 255), 2)
 
 
 #
@@ -43,6 +98,9 @@ from ftlib import *
 parser = argparse.ArgumentParser()
 parser.add_argument("-d", "--delay", type=int, help="set the delay between frames (ms)", default=1)
 parser.add_argument("-j", "--jump",  type=int, help="Jump to a specific frame", default=0)
+parser.add_argument("-n", "--step",  type=int, help="number of frames of the jump keys", default=100)
+parser.add_argument("-c", "--cache", type=int, help="memory used to cache decoded frames (MB)", default=512)
+parser.add_argument("-k", "--keyint", type=int, help="keyframe interval of the video (frames)", default=250)
 parser.add_argument("prj",           type=str, help="project file.")
 args = parser.parse_args()
 
@@ -57,74 +115,72 @@ if not os.path.isfile(prj.get("video")):
     sys.stderr.write("\nVideo file '%s' not found.\n" % prj.get("video"))
     sys.exit(1)
 
-# read data
-raw = read_data(prj.get_raw_fname())
-dat = read_data(prj.get_dat_fname())
+# the rows of each arena are only read when shown (binary files are memory mapped)
+arenas = []
 
-if(len(raw) != len(dat)):
-    sys.stderr.write("\nRaw and processed data have different lengths.\n")
-    sys.exit(1)
+for (name, mask, lumth) in prj.get_arenas():
+    raw = open_rows(prj.get_raw_fname(name))
+    dat = open_rows(prj.get_dat_fname(name))
 
-# get the mask coordinates
-(mx, my, mw, mh) = prj.get("mask")
+    if(len(raw) != len(dat)):
+        sys.stderr.write("\nRaw and processed data have different lengths.\n")
+        sys.exit(1)
 
-# start capture
-capture = cv2.VideoCapture(prj.get("video"))
-frame_height  = int(capture.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT))
+    arenas.append((name, mask, raw, dat))
 
-if args.jump > 0:
-    capture.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, args.jump)
+# the frames of all the arenas
+# (multi-fish projects have one row per fish in each frame)
+fish = prj.get("fish") or 1
+count = min(len(raw) for (name, mask, raw, dat) in arenas) // fish
 
-lifo = []
+# decoded frames are cached and read ahead in the background (seeking to the keyframes of the index, if any)
+reader = FrameReader(prj.get("video"), budget=args.cache, keyint=args.keyint, index=project_index(prj))
 
-f = args.jump
-while f < len(raw):
-    draw = raw[f]
-    ddat = dat[f]
+sys.stderr.write("\nPress 'Q' or 'q' to terminate, SPACE to pause, 'A'/'D' (or LEFT/RIGHT) to step and 'S'/'W' (or DOWN/UP) to jump %d frames.\n" % args.step)
 
-    f += 1
+f = min(max(args.jump, 0), count - 1)
+paused = False
 
-    (ret, frame) = capture.read()
+while 0 <= f < count:
+    frame = reader.get(f)
 
-    #K = 200.0
-    #for i in xrange(int(K)):
-    #    if f - i <= 0:
-    #        break
-    #
-    #    praw = list(map(int, data_raw[f - i]))
-
-    if(f == 1):
-        sys.stderr.write("\nPress 'Q' or 'q' to terminate.\n")
-
-    if(int(draw[1]) == 1):
-        draw = list(map(int,   draw))
-        ddat = list(map(float, ddat))
-
-        # compute theta
-        cv2.circle(frame, tuple(draw[2:4]), 3, (0, 0, 255), -1)
-        cv2.circle(frame, tuple(draw[4:6]), 3, (0, 255, 0), -1)
-        cv2.circle(frame, tuple(draw[6:8]), 3, (255, 0, 0), -1)
-        cv2.line(frame, tuple(draw[2:4]), tuple(draw[4:6]), (255, 255, 255), 1)
-        cv2.line(frame, tuple(draw[4:6]), tuple(draw[6:8]), (255, 255, 255), 1)
+    if frame is None:
+        break
 
-        cv2.putText(frame, "%5.2f" % ddat[8], tuple(draw[2:4]), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0))
-        cv2.putText(frame, "raw: %3d x %3d"     % (draw[4], draw[5]), (mx, my+20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
-        cv2.putText(frame, "dat: %5.2f x %5.2f" % (ddat[4], ddat[5]), (mx, my+40), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
-    else:
-        cv2.putText(frame, "NO FISH", (10, 100), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 0, 0))
+    # the cached frame must stay clean
+    frame = frame.copy()
 
-    cv2.putText(frame, "%d" % f, (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255))
+    for (name, mask, raw, dat) in arenas:
+        draw_arena(frame, name, mask, [raw[f * fish + i] for i in range(fish)], [dat[f * fish + i] for i in range(fish)])
 
-    cv2.line(frame, (mx, my), (mx + mw, my), (255, 0, 255), 2)
-    cv2.line(frame, (mx + mw, my), (mx + mw, my + mh), (255, 0, 255), 2)
-    cv2.line(frame, (mx + mw, my + mh), (mx, my + mh), (255, 0, 255), 2)
-    cv2.line(frame, (mx, my + mh), (mx, my), (255, 0, 255), 2)
+    cv2.putText(frame, "%d" % (f + 1), (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255))
 
     cv2.imshow("Analyse", frame)
-    key = cv2.waitKey(args.delay)
+    key = cv2.waitKey(0 if paused else args.delay)
 
-    if key in [113, 65617]:
+    if key in QUIT_VIEW_KEYS:
         sys.stderr.write("\nTerminated by the user...\n")
         break
 
+    if key in PAUSE_KEYS:
+        paused = not paused
+        continue
+
+    # the navigation keys pause the playback
+    if key in STEP_BACK_KEYS + STEP_FORWARD_KEYS + JUMP_BACK_KEYS + JUMP_FORWARD_KEYS:
+        paused = True
+
+        if key in STEP_BACK_KEYS:
+            f = max(f - 1, 0)
+        elif key in STEP_FORWARD_KEYS:
+            f = min(f + 1, count - 1)
+        elif key in JUMP_BACK_KEYS:
+            f = max(f - args.step, 0)
+        else:
+            f = min(f + args.step, count - 1)
+    elif not paused:
+        f += 1
+
+reader.close()
+
 sys.stderr.write("\nDONE\n")